@@ -7,21 +7,40 @@ import re
 import uuid
 import base64
 import secrets
+import hashlib
 import json
+import time
 from io import BytesIO
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
 from dotenv import load_dotenv
-import mysql.connector
 from mysql.connector import Error
-import markdown
-import bleach
+from db import get_db_connection, record_write, register_share_token, find_share_owner, SHARDING_ENABLED, shards
+from rendering import (render_markdown, make_excerpt, split_blocks, render_block, PREVIEW_MAX_BLOCKS,
+                       WARMUP_MARKDOWN)
+from assets import init_app as init_assets
+from ratelimit import init_app as init_ratelimit, limited
+from fragments import init_app as init_fragments
+from profiler import init_app as init_profiler
+from note_store import encode_content, decode_note, decode_notes, matches_search
+from revisions import record_revision, load_revision, list_revisions, unified_diff, apply_delta
+from note_archive import fill_cold, warm_note
+import events
+from events import record_event, SAVED, DELETED, RELOAD
+import sync
+import search_index
+import related
+import uploads
+import storage
+import cognito
+import render_pool
 # Load environment variables
 load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
 # Trust reverse proxy headers (Nginx) so url_for generates correct public URLs
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
@@ -33,81 +52,59 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-# AWS S3 configuration (optional)
-S3_BUCKET = os.getenv('S3_BUCKET', '')
-S3_REGION = os.getenv('S3_REGION', os.getenv('AWS_REGION', 'us-east-1'))
-S3_ENABLED = False
-s3_client = None
-
-try:
-    import boto3
-    if S3_BUCKET:
-        s3_client = boto3.client('s3', region_name=S3_REGION)
-        S3_ENABLED = True
-        print(f"\u2705 S3 enabled: bucket={S3_BUCKET}")
-except ImportError:
-    pass
-except Exception as e:
-    print(f"\u26a0\ufe0f S3 init failed (falling back to local): {e}")
+# File storage: local, S3 or in-memory (storage.py)
+def get_s3_client():
+    """The S3 client for multipart uploads (None unless files are stored in S3)."""
+    return storage.s3_client()
 
 
 def upload_file_to_storage(file_data, filename, content_type='image/jpeg', folder='avatars'):
-    """Upload file to S3 if available, otherwise save locally. Returns URL."""
-    if S3_ENABLED and s3_client:
-        try:
-            key = f"{folder}/{filename}"
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
-                Key=key,
-                Body=file_data,
-                ContentType=content_type
-            )
-            # Generate a pre-signed URL or public URL if bucket is public
-            # For this simple implementation, we'll return a path that might need a proxy route if private
-            # But let's assume we might need a getter for S3 files too
-            return url_for('get_s3_file', folder=folder, filename=filename)
-        except Exception as e:
-            print(f"S3 upload failed, falling back to local: {e}")
-    
-    # Local fallback
-    local_folder = os.path.join(UPLOAD_FOLDER, folder)
-    os.makedirs(local_folder, exist_ok=True)
-    filepath = os.path.join(local_folder, filename)
-    with open(filepath, 'wb') as f:
-        f.write(file_data)
-    return f"/static/uploads/{folder}/{filename}"
+    """Store a file and return its URL; local files if the backend fails."""
+    key = f"{folder}/{filename}"
+    backend = storage.get_storage()
+    try:
+        backend.put(key, file_data, content_type)
+        return backend.url(key)
+    except storage.StorageError as e:
+        if backend is storage.local_storage():
+            raise
+        print(f"Storage upload failed, falling back to local: {e}")
+    local = storage.local_storage()
+    local.put(key, file_data, content_type)
+    return local.url(key)
+
+
+def delete_file_from_storage(key):
+    """Delete a stored file by its storage key (e.g. "attachments/<name>")."""
+    try:
+        storage.get_storage().delete(key)
+    except storage.StorageError as e:
+        print(f"Storage delete failed for {key}: {e}")
+
+
+def delete_files_from_storage(keys):
+    """Delete many stored files at once (storage errors are logged)."""
+    if not keys:
+        return
+    failed = storage.get_storage().delete_many(keys)
+    if failed:
+        print(f"Storage delete failed for {len(failed)} of {len(keys)} files: {failed[:5]}")
+
+
+def storage_key_from_url(url):
+    """Map a URL returned by upload_file_to_storage back to its storage key."""
+    return storage.key_from_url(url)
 # Import and register auth blueprint
-from auth import auth_bp, login_required, get_current_user
+from auth import (auth_bp, login_required, admin_required, get_current_user, is_lazy_guest, ensure_user,
+                  virtual_categories, resolve_category_id)
 app.register_blueprint(auth_bp)
-# Database configuration
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASSWORD', ''),
-    'database': os.getenv('DB_NAME', 'notes_db'),
-    'port': int(os.getenv('DB_PORT', 3306))
-}
-# Allowed HTML tags for markdown
-ALLOWED_TAGS = [
-    'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 'ul', 'ol', 'li', 
-    'code', 'pre', 'blockquote', 'a', 'br', 'hr',
-    'table', 'thead', 'tbody', 'tr', 'th', 'td', 'img',
-    'del', 'ins', 'sup', 'sub', 'mark'
-]
-ALLOWED_ATTRS = {
-    'a': ['href', 'title'],
-    'img': ['src', 'alt', 'title', 'width', 'height'],
-    '*': ['class']
-}
-def get_db_connection():
-    """Create and return a database connection."""
-    try:
-        # Explicitly set auth_plugin for MariaDB compatibility
-        connection = mysql.connector.connect(**DB_CONFIG, auth_plugin='mysql_native_password')
-        return connection
-    except Error as e:
-        print(f"Error connecting to MariaDB: {e}")
-        return None
+# Database connections (primary + optional read replicas)
+app.after_request(record_write)
+init_assets(app)
+init_ratelimit(app)
+init_fragments(app)
+init_profiler(app)
+events.init_app(app)
 def init_db():
     """Initialize database tables."""
     connection = get_db_connection()
@@ -131,8 +128,10 @@ def init_db():
                 timezone VARCHAR(50) DEFAULT 'UTC',
                 profile_complete BOOLEAN DEFAULT FALSE,
                 is_guest BOOLEAN DEFAULT FALSE,
+                last_seen_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_guest_last_seen (is_guest, last_seen_at)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         ''')
         
@@ -155,9 +154,15 @@ def init_db():
                 user_id INT NOT NULL,
                 category_id INT,
                 title VARCHAR(255) DEFAULT '',
-                content TEXT NOT NULL,
+                content MEDIUMTEXT NOT NULL,
+                content_z MEDIUMBLOB NULL,
+                content_size INT NULL,
+                excerpt_html TEXT NULL,
+                summary VARCHAR(255) NULL,
+                version INT NOT NULL DEFAULT 1,
                 is_pinned BOOLEAN DEFAULT FALSE,
                 is_archived BOOLEAN DEFAULT FALSE,
+                is_cold BOOLEAN NOT NULL DEFAULT FALSE,
                 is_public BOOLEAN DEFAULT FALSE,
                 share_token VARCHAR(64) UNIQUE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -173,15 +178,6 @@ def init_db():
     finally:
         cursor.close()
         connection.close()
-def render_markdown(text):
-    """Convert markdown to sanitized HTML."""
-    html = markdown.markdown(text, extensions=[
-        'extra',        # Tables, fenced code, footnotes, attrib, def types
-        'nl2br',        # Newlines to <br>
-        'sane_lists',   # Better list handling
-        'smarty'        # Smart quotes
-    ])
-    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS)
 # =============================================================================
 # MAIN ROUTES
 # =============================================================================
@@ -192,17 +188,49 @@ def favicon():
                                'logo.png', mimetype='image/png')
 
 
+@app.route('/sw.js')
+def service_worker():
+    """The offline cache's service worker (static/sw.js), served from the root
+    so it controls the dashboard. It gets the current asset URLs prepended;
+    a deploy changes them and so installs the new worker."""
+    shell = [*app.jinja_env.globals['bundle_urls']('app.css'),
+             url_for('static', filename='notes-db.js'),
+             url_for('static', filename='app.js'),
+             url_for('static', filename='images/logo.png')]
+    with open(os.path.join(app.root_path, 'static', 'sw.js'), encoding='utf-8') as f:
+        source = f.read()
+    version = hashlib.sha1((json.dumps(shell) + source).encode('utf-8')).hexdigest()[:12]
+    response = Response(
+        f'const SHELL_ASSETS = {json.dumps(shell)};\nconst SHELL_VERSION = {json.dumps(version)};\n{source}',
+        mimetype='application/javascript'
+    )
+    # Browsers check for a new worker on every visit
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 # Routes
 @app.route('/')
 @login_required
 def index():
     """Display all notes with filters."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     search_query = request.args.get('q', '').strip()
     category_filter = request.args.get('category', '')
     show_archived = request.args.get('archived', '0') == '1'
     
-    connection = get_db_connection()
+    # Guests that have not saved anything yet are served without the database
+    if is_lazy_guest():
+        return render_template('index.html',
+                             notes=[],
+                             categories=virtual_categories(),
+                             stats={'total': 0, 'active': 0, 'pinned': 0, 'archived': 0},
+                             user=get_current_user(),
+                             search_query=search_query,
+                             category_filter=category_filter,
+                             show_archived=show_archived)
+    
+    connection = get_db_connection(read_only=True)
     if not connection:
         flash('Database connection failed.', 'error')
         return render_template('index.html', notes=[], categories=[], stats={})
@@ -214,17 +242,26 @@ def index():
         cursor.execute('SELECT * FROM categories WHERE user_id = %s ORDER BY name', (user_id,))
         categories = cursor.fetchall()
         
-        # Build notes query
-        query = '''
-            SELECT n.*, c.name as category_name, c.color as category_color
+        # Build notes query. Cards show the stored excerpt; bodies are only
+        # loaded for rows without one yet and compressed rows being searched.
+        # Cold (long-archived) notes keep their excerpt in note_archive.
+        query = f'''
+            SELECT n.id, n.title, {'COALESCE(n.excerpt_html, a.excerpt_html)' if show_archived else 'n.excerpt_html'} AS excerpt_html,
+                   n.summary, n.user_id, n.category_id, n.version, n.is_pinned,
+                   n.is_archived, n.is_cold, n.is_public, n.created_at, n.updated_at,
+                   IF(n.excerpt_html IS NULL, n.content, NULL) AS content,
+                   {'n.content_z' if search_query else 'IF(n.excerpt_html IS NULL, n.content_z, NULL) AS content_z'},
+                   c.name as category_name, c.color as category_color
             FROM notes n
             LEFT JOIN categories c ON n.category_id = c.id
+            {'LEFT JOIN note_archive a ON a.note_id = n.id' if show_archived else ''}
             WHERE n.user_id = %s AND n.is_archived = %s
         '''
         params = [user_id, show_archived]
         
         if search_query:
-            query += ' AND (n.title LIKE %s OR n.content LIKE %s)'
+            # Compressed and cold bodies cannot be matched in SQL; they are filtered below
+            query += ' AND (n.title LIKE %s OR n.content LIKE %s OR n.content_z IS NOT NULL OR n.is_cold)'
             search_term = f'%{search_query}%'
             params.extend([search_term, search_term])
         
@@ -236,10 +273,19 @@ def index():
         
         cursor.execute(query, params)
         notes = cursor.fetchall()
+        if search_query:
+            # Plain bodies were matched in SQL; compressed and cold ones are checked here
+            fill_cold(connection, notes)
+            notes = [note for note in notes
+                     if (note.get('content_z') is None and not note['is_cold'])
+                     or matches_search(decode_note(note), search_query)]
         
-        # Render markdown for each note
+        # Notes saved before excerpts existed (until build_excerpts.py has run), or
+        # whose excerpt could not be rendered when they were saved
+        fill_cold(connection, [note for note in notes if note['excerpt_html'] is None])
         for note in notes:
-            note['content_html'] = render_markdown(note['content'])
+            if note['excerpt_html'] is None:
+                note['excerpt_html'], note['summary'] = make_excerpt(decode_note(note)['content'])
         
         # Get statistics
         cursor.execute('''
@@ -299,7 +345,7 @@ def profile():
 @login_required
 def save_profile():
     """Save profile changes."""
-    user_id = session['user_id']
+    user_id = ensure_user()
     
     first_name = request.form.get('first_name', '').strip()
     last_name = request.form.get('last_name', '').strip()
@@ -311,7 +357,7 @@ def save_profile():
         flash('Display name is required!', 'error')
         return redirect(url_for('profile'))
     
-    connection = get_db_connection()
+    connection = get_db_connection() if user_id else None
     if not connection:
         flash('Database connection failed.', 'error')
         return redirect(url_for('profile'))
@@ -351,9 +397,15 @@ def save_profile():
 @login_required
 def upload_avatar():
     """Upload and save user avatar (accepts base64 or file upload)."""
-    user_id = session['user_id']
+    user_id = ensure_user()
     avatar_url = None
 
+    if not user_id:
+        if request.is_json:
+            return jsonify({'error': 'Database connection failed'}), 500
+        flash('Database connection failed.', 'error')
+        return redirect(url_for('profile'))
+
     # Handle base64 upload (from client-side compression)
     if request.is_json:
         data = request.get_json()
@@ -415,30 +467,37 @@ def upload_avatar():
 @app.route('/s3/<folder>/<path:filename>')
 @login_required
 def get_s3_file(folder, filename):
-    """Serve S3 file through the backend (proxy)."""
-    if not S3_ENABLED or not s3_client:
-        return jsonify({'error': 'S3 not enabled'}), 404
-    
+    """Serve a file from a storage backend the browser cannot reach (S3, memory)."""
+    backend = storage.get_storage()
+    if not isinstance(backend, storage.ProxiedStorage):
+        return jsonify({'error': 'Not found'}), 404
+    # Ensure folder is valid to prevent traversal (basic check)
+    if folder not in ['avatars', 'attachments']:
+        return jsonify({'error': 'Invalid folder'}), 403
+    key = f'{folder}/{filename}'
+
     try:
-        # Fetch from S3
-        # Ensure folder is valid to prevent traversal (basic check)
-        if folder not in ['avatars', 'attachments']:
-             return jsonify({'error': 'Invalid folder'}), 403
+        if storage.STORAGE_PRESIGN:
+            presigned = backend.presign(key)
+            if presigned:
+                response = redirect(presigned)
+                # Reuse the redirect while the signature is still valid
+                response.headers['Cache-Control'] = f'private, max-age={storage.STORAGE_PRESIGN_SECONDS // 2}'
+                return response
 
-        file_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=f'{folder}/{filename}')
-        
-        # Stream response
+        # Stream response (attachments can be far larger than worker memory)
+        stored = backend.stream(key)
         return Response(
-            file_obj['Body'].read(),
-            mimetype=file_obj.get('ContentType', 'application/octet-stream'),
+            stored.chunks,
+            mimetype=stored.content_type,
             headers={
-                'Cache-Control': 'public, max-age=31536000'
+                'Cache-Control': 'public, max-age=31536000',
+                'Content-Length': str(stored.size)
             }
         )
-    except Exception as e:
-        # Check if 404
-        if 'NoSuchKey' in str(e):
-             return jsonify({'error': 'File not found'}), 404
+    except storage.NotFound:
+        return jsonify({'error': 'File not found'}), 404
+    except storage.StorageError as e:
         return jsonify({'error': str(e)}), 500
 
 # =============================================================================
@@ -448,7 +507,7 @@ def get_s3_file(folder, filename):
 @login_required
 def attach_file(note_id):
     """Attach a file to a note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -476,15 +535,17 @@ def attach_file(note_id):
         # Determine content type
         content_type = file.mimetype or 'application/octet-stream'
         
-        # Upload
+        # Upload. The row stores the storage key; URLs are built from it, so
+        # attachments do not fall back to local files like avatars do
         file_data = file.read()
-        file_url = upload_file_to_storage(file_data, unique_filename, content_type, folder='attachments')
-        
-        # S3 key (if S3) or local path
-        # If upload_file_to_storage returns a URL, we need to derive the key/path for the DB
-        # But schema has s3_key. If local, we can just store the relative path or 'local:...'
-        # Actually, let's just store the key relative to generic storage
         s3_key = f"attachments/{unique_filename}"
+        backend = storage.get_storage()
+        try:
+            backend.put(s3_key, file_data, content_type)
+        except storage.StorageError as e:
+            print(f"Attachment upload failed for note {note_id}: {e}")
+            return jsonify({'error': 'File storage unavailable'}), 502
+        file_url = backend.url(s3_key)
         
         file_size = len(file_data)
         
@@ -501,7 +562,8 @@ def attach_file(note_id):
                 'id': attachment_id,
                 'filename': original_filename,
                 'url': file_url,
-                'size': file_size
+                'size': file_size,
+                'type': content_type
             }
         })
     except Error as e:
@@ -514,7 +576,7 @@ def attach_file(note_id):
 @login_required
 def delete_attachment(note_id, attachment_id):
     """Delete an attachment."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if not connection:
@@ -538,15 +600,9 @@ def delete_attachment(note_id, attachment_id):
         cursor.execute('DELETE FROM attachments WHERE id = %s', (attachment_id,))
         connection.commit()
         
-        # Optional: Delete from S3/Local
-        # Note: We might want to do this asynchronously or just ignore orphans for now
-        # But let's try to delete if S3
-        if S3_ENABLED and s3_client:
-            try:
-                s3_client.delete_object(Bucket=S3_BUCKET, Key=attachment['s3_key'])
-            except:
-                pass # Fail silently on storage delete
-                
+        # Delete from S3/Local (fails silently on storage errors)
+        delete_file_from_storage(attachment['s3_key'])
+
         return jsonify({'success': True})
     except Error as e:
         return jsonify({'error': str(e)}), 500
@@ -555,6 +611,253 @@ def delete_attachment(note_id, attachment_id):
         connection.close()
 
 
+# =============================================================================
+# RESUMABLE UPLOADS (see uploads.py)
+# =============================================================================
+def _upload_error(message, status, upload=None):
+    body = {'error': message}
+    if upload is not None:
+        body['offset'] = upload['received']
+    return jsonify(body), status
+
+
+@app.route('/api/note/<int:note_id>/uploads', methods=['POST'])
+@login_required
+@limited('uploads', per_user='60/60')
+def start_upload(note_id):
+    """Start a resumable attachment upload; chunks follow with PATCH."""
+    user_id = session.get('user_id')
+    data = request.get_json(silent=True) or {}
+
+    filename = secure_filename(str(data.get('filename') or ''))
+    if not filename:
+        return jsonify({'error': 'No selected file'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'File size required'}), 400
+    if size < 1:
+        return jsonify({'error': 'File is empty'}), 400
+    if size > uploads.UPLOAD_MAX_BYTES:
+        return jsonify({'error': f'File too large (max {uploads.UPLOAD_MAX_BYTES // 1024 ** 2}MB)'}), 413
+    sha256 = data.get('sha256') or None
+    if sha256 is not None and not re.fullmatch(r'[0-9a-fA-F]{64}', str(sha256)):
+        return jsonify({'error': 'sha256 must be 64 hex digits'}), 400
+    content_type = str(data.get('type') or 'application/octet-stream')[:100]
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute('SELECT id FROM notes WHERE id = %s AND user_id = %s', (note_id, user_id))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Note not found'}), 404
+        upload = uploads.create_upload(cursor, get_s3_client(), user_id, note_id, filename,
+                                       content_type, size, sha256)
+        connection.commit()
+        return jsonify(uploads.describe(upload)), 201
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        print(f"Upload start failed: {e}")
+        return jsonify({'error': 'File storage unavailable'}), 502
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@app.route('/api/uploads/<upload_id>')
+@login_required
+def upload_status(upload_id):
+    """Current offset of an upload, for resuming after a failure."""
+    user_id = session.get('user_id')
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        upload = uploads.get_upload(cursor, upload_id, user_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        response = jsonify(uploads.describe(upload))
+        response.headers['Upload-Offset'] = str(upload['received'])
+        response.headers['Upload-Length'] = str(upload['total_size'])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    """Store one chunk at Upload-Offset, streamed from the request body."""
+    user_id = session.get('user_id')
+    length = request.content_length
+    if not length:
+        return jsonify({'error': 'Content-Length required'}), 411
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Upload-Offset header required'}), 400
+    try:
+        checksum = uploads.parse_checksum(request.headers.get('Upload-Checksum'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        upload = uploads.get_upload(cursor, upload_id, user_id)
+        # No transaction stays open while the chunk streams in
+        connection.commit()
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        if offset != upload['received']:
+            return _upload_error('Offset mismatch', 409, upload)
+
+        multipart = upload['multipart_id'] is not None
+        chunk_size = uploads.chunk_size(multipart)
+        end = offset + length
+        if end > upload['total_size']:
+            return _upload_error('Chunk goes past the end of the file', 400, upload)
+        if length > chunk_size or (multipart and length != chunk_size and end != upload['total_size']):
+            return _upload_error(f'Chunks must be {chunk_size} bytes (except the last)', 400, upload)
+
+        s3_client = get_s3_client() if multipart else None
+        if multipart and not s3_client:
+            return _upload_error('File storage unavailable', 502, upload)
+
+        # The app-wide MAX_CONTENT_LENGTH is for forms; chunks have their own limit
+        stream = get_input_stream(request.environ, max_content_length=chunk_size)
+        try:
+            with uploads.chunk_lock(upload):
+                # Another request may have stored this chunk before the lock was free
+                upload = uploads.get_upload(cursor, upload_id, user_id)
+                connection.commit()
+                if not upload:
+                    return jsonify({'error': 'Upload not found'}), 404
+                if offset != upload['received']:
+                    return _upload_error('Offset mismatch', 409, upload)
+                try:
+                    part = uploads.receive_chunk(upload, s3_client, stream, length, checksum)
+                except uploads.ChecksumError as e:
+                    return _upload_error(str(e), 460, upload)
+                except uploads.IncompleteChunk as e:
+                    return _upload_error(str(e), 400, upload)
+
+                if not uploads.record_chunk(cursor, upload, length, part):
+                    connection.rollback()
+                    return _upload_error('Offset mismatch', 409, uploads.get_upload(cursor, upload_id, user_id))
+                connection.commit()
+        except uploads.ChunkInProgress as e:
+            return _upload_error(str(e), 409, upload)
+
+        response = jsonify({'offset': end, 'size': upload['total_size']})
+        response.headers['Upload-Offset'] = str(end)
+        return response
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        print(f"Upload chunk failed for {upload_id}: {e}")
+        return jsonify({'error': 'File storage unavailable'}), 502
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@app.route('/api/uploads/<upload_id>/finish', methods=['POST'])
+@login_required
+def finish_upload(upload_id):
+    """Attach a completely received upload to its note."""
+    user_id = session.get('user_id')
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        upload = uploads.get_upload(cursor, upload_id, user_id, for_update=True)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        if upload['received'] != upload['total_size']:
+            return _upload_error('Upload incomplete', 409, upload)
+
+        multipart = upload['multipart_id'] is not None
+        s3_client = get_s3_client() if multipart else None
+        if multipart and not s3_client:
+            return _upload_error('File storage unavailable', 502, upload)
+        try:
+            uploads.finish_upload(upload, s3_client)
+        except uploads.ChecksumError as e:
+            # The stored data is wrong; the client has to start over
+            cursor.execute('DELETE FROM uploads WHERE id = %s', (upload_id,))
+            connection.commit()
+            uploads.discard_upload(upload, s3_client)
+            return jsonify({'error': str(e)}), 460
+
+        cursor.execute(
+            'INSERT INTO attachments (note_id, filename, s3_key, file_type, file_size) VALUES (%s, %s, %s, %s, %s)',
+            (upload['note_id'], upload['filename'], upload['s3_key'], upload['file_type'], upload['total_size'])
+        )
+        attachment_id = cursor.lastrowid
+        cursor.execute('DELETE FROM uploads WHERE id = %s', (upload_id,))
+        connection.commit()
+
+        file_url = storage.get_storage().url(upload['s3_key'])
+        return jsonify({
+            'success': True,
+            'attachment': {
+                'id': attachment_id,
+                'filename': upload['filename'],
+                'url': file_url,
+                'size': upload['total_size'],
+                'type': upload['file_type']
+            }
+        })
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        print(f"Upload finish failed for {upload_id}: {e}")
+        return jsonify({'error': 'File storage unavailable'}), 502
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    """Abandon an upload and remove what was received."""
+    user_id = session.get('user_id')
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        upload = uploads.get_upload(cursor, upload_id, user_id)
+        if not upload:
+            return jsonify({'error': 'Upload not found'}), 404
+        cursor.execute('DELETE FROM uploads WHERE id = %s', (upload_id,))
+        connection.commit()
+        uploads.discard_upload(upload, get_s3_client() if upload['multipart_id'] else None)
+        return jsonify({'success': True})
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        connection.close()
+
 # =============================================================================
 # NOTE CRUD
 # =============================================================================
@@ -562,7 +865,6 @@ def delete_attachment(note_id, attachment_id):
 @login_required
 def add_note():
     """Create a new note."""
-    user_id = session['user_id']
     title = request.form.get('title', '').strip()
     content = request.form.get('content', '').strip()
     category_id = request.form.get('category_id') or None
@@ -571,18 +873,26 @@ def add_note():
         flash('Note content cannot be empty!', 'error')
         return redirect(url_for('index'))
     
-    connection = get_db_connection()
+    user_id = ensure_user()
+    connection = get_db_connection() if user_id else None
     if not connection:
         flash('Database connection failed.', 'error')
         return redirect(url_for('index'))
     
     try:
-        cursor = connection.cursor()
+        cursor = connection.cursor(dictionary=True)
+        category_id = resolve_category_id(cursor, user_id, category_id)
         cursor.execute(
-            'INSERT INTO notes (user_id, title, content, category_id) VALUES (%s, %s, %s, %s)',
-            (user_id, title, content, category_id)
+            '''INSERT INTO notes (user_id, title, content, content_z, content_size, excerpt_html, summary,
+                                  category_id)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+            (user_id, title, *encode_content(content), *make_excerpt(content), category_id)
         )
+        note_id = cursor.lastrowid
+        record_event(cursor, user_id, SAVED, note_id)
         connection.commit()
+        search_index.note_saved(user_id, note_id, title, content)
+        related.note_saved(user_id, note_id, title, content)
         flash('Note created successfully!', 'success')
     except Error as e:
         flash(f'Error creating note: {e}', 'error')
@@ -595,7 +905,7 @@ def add_note():
 @login_required
 def edit_note(note_id):
     """Update an existing note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     title = request.form.get('title', '').strip()
     content = request.form.get('content', '').strip()
     category_id = request.form.get('category_id') or None
@@ -611,12 +921,21 @@ def edit_note(note_id):
     
     try:
         cursor = connection.cursor()
+        warm_note(connection, note_id, user_id)
+        record_revision(connection, note_id, user_id, title, content)
         cursor.execute(
-            '''UPDATE notes SET title = %s, content = %s, category_id = %s, 
+            '''UPDATE notes SET title = %s, content = %s, content_z = %s, content_size = %s,
+               excerpt_html = %s, summary = %s, category_id = %s, version = version + 1,
                updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s''',
-            (title, content, category_id, note_id, user_id)
+            (title, *encode_content(content), *make_excerpt(content), category_id, note_id, user_id)
         )
+        saved = cursor.rowcount
+        if saved:
+            record_event(cursor, user_id, SAVED, note_id)
         connection.commit()
+        if saved:
+            search_index.note_saved(user_id, note_id, title, content)
+            related.note_saved(user_id, note_id, title, content)
         flash('Note updated successfully!', 'success')
     except Error as e:
         flash(f'Error updating note: {e}', 'error')
@@ -629,7 +948,7 @@ def edit_note(note_id):
 @login_required
 def delete_note(note_id):
     """Permanently delete a note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if not connection:
@@ -638,8 +957,20 @@ def delete_note(note_id):
     
     try:
         cursor = connection.cursor()
+        cursor.execute(
+            '''SELECT a.s3_key FROM attachments a JOIN notes n ON a.note_id = n.id
+               WHERE n.id = %s AND n.user_id = %s''',
+            (note_id, user_id)
+        )
+        attachment_keys = [row[0] for row in cursor.fetchall()]
+        # Attachment rows go with the note (ON DELETE CASCADE)
         cursor.execute('DELETE FROM notes WHERE id = %s AND user_id = %s', (note_id, user_id))
+        if cursor.rowcount:
+            record_event(cursor, user_id, DELETED, note_id)
         connection.commit()
+        search_index.note_deleted(user_id, note_id)
+        related.note_deleted(user_id, note_id)
+        delete_files_from_storage(attachment_keys)
         flash('Note deleted permanently!', 'success')
     except Error as e:
         flash(f'Error deleting note: {e}', 'error')
@@ -655,7 +986,7 @@ def delete_note(note_id):
 @login_required
 def toggle_pin(note_id):
     """Toggle pin status of a note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if connection:
@@ -665,6 +996,8 @@ def toggle_pin(note_id):
                 'UPDATE notes SET is_pinned = NOT is_pinned WHERE id = %s AND user_id = %s',
                 (note_id, user_id)
             )
+            if cursor.rowcount:
+                record_event(cursor, user_id, SAVED, note_id)
             connection.commit()
         finally:
             cursor.close()
@@ -675,16 +1008,20 @@ def toggle_pin(note_id):
 @login_required
 def toggle_archive(note_id):
     """Toggle archive status of a note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if connection:
         try:
             cursor = connection.cursor()
+            # Only archived notes can be cold, so this is an unarchive
+            warm_note(connection, note_id, user_id)
             cursor.execute(
                 'UPDATE notes SET is_archived = NOT is_archived, is_pinned = FALSE WHERE id = %s AND user_id = %s',
                 (note_id, user_id)
             )
+            if cursor.rowcount:
+                record_event(cursor, user_id, SAVED, note_id)
             connection.commit()
             flash('Note archive status updated!', 'success')
         finally:
@@ -702,8 +1039,8 @@ def toggle_archive(note_id):
 @login_required
 def get_note_api(note_id):
     """Get note details (JSON) for modals."""
-    user_id = session['user_id']
-    connection = get_db_connection()
+    user_id = session.get('user_id')
+    connection = get_db_connection(read_only=True)
     
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
@@ -722,6 +1059,7 @@ def get_note_api(note_id):
         
         if not note:
             return jsonify({'error': 'Note not found'}), 404
+        fill_cold(connection, [decode_note(note)])
             
         # Fetch attachments
         cursor.execute(
@@ -730,53 +1068,403 @@ def get_note_api(note_id):
         )
         attachments = cursor.fetchall()
         
-        # Format attachments using our new upload logic
-        # We need to reconstruct the URL. 
-        # For local, it's /static/uploads/attachments/filename
-        # For S3, it's url_for('get_s3_file', folder='attachments', filename=filename) but we need to parse s3_key
-        
+        # s3_key is the storage key, "attachments/<uuid>_<filename>"
+        backend = storage.get_storage()
         formatted_attachments = []
         for att in attachments:
-            # Simple heuristic: if s3_key starts with attachments/, use that.
-            # If we don't store full URL in DB, we generate it here.
-            
-            # Extract filename from s3_key if possible or use filename
-            # s3_key is like "attachments/uuid_filename"
-            
-            # If S3 is enabled, use s3 route
-            if S3_ENABLED and s3_client:
-                 # We assume s3_key is "folder/filename"
-                 parts = att['s3_key'].split('/', 1)
-                 if len(parts) == 2:
-                     url = url_for('get_s3_file', folder=parts[0], filename=parts[1])
-                 else:
-                     url = '#' # Fallback
-            else:
-                 # Local fallback
-                 # Ensure we point to the right folder. 
-                 # Our upload logic stores s3_key as "attachments/filename".
-                 url = f"/static/uploads/{att['s3_key']}"
-
             formatted_attachments.append({
                 'id': att['id'],
                 'filename': att['filename'],
-                'url': url,
+                'url': backend.url(att['s3_key']),
                 'size': att['file_size'],
                 'type': att['file_type']
             })
 
         note['content_html'] = render_markdown(note['content'])
         note['attachments'] = formatted_attachments
+        note['related'] = related_note_links(connection, user_id, note_id)
         
         return jsonify(note)
     finally:
         cursor.close()
         connection.close()
+
+def related_note_links(connection, user_id, note_id):
+    """[{id, title, score}] of the notes most like note_id (related.py); None
+    while the user's index is still being prepared."""
+    try:
+        matches = related.related_notes(connection, user_id, note_id)
+    except Exception as e:
+        print(f"Related notes failed for note {note_id}: {e}")
+        return None
+    if not matches:
+        return matches
+    cursor = connection.cursor(dictionary=True)
+    try:
+        placeholders = ', '.join(['%s'] * len(matches))
+        cursor.execute(
+            f'SELECT id, title FROM notes WHERE user_id = %s AND id IN ({placeholders})',
+            [user_id, *(match_id for match_id, _ in matches)]
+        )
+        titles = {row['id']: row['title'] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    # A note deleted on another worker may still be in this one's index
+    return [{'id': match_id, 'title': titles[match_id], 'score': score}
+            for match_id, score in matches if match_id in titles]
+
+@app.route('/api/note/<int:note_id>/card')
+@login_required
+def get_note_card(note_id):
+    """A note's dashboard card HTML, for patching open dashboards (live updates)."""
+    user_id = session.get('user_id')
+    # Another tab or device just wrote this note; replicas may not have it yet
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            '''SELECT n.id, n.title, COALESCE(n.excerpt_html, a.excerpt_html) AS excerpt_html,
+                      n.summary, n.user_id, n.category_id, n.version, n.is_pinned,
+                      n.is_archived, n.is_cold, n.is_public, n.created_at, n.updated_at,
+                      IF(n.excerpt_html IS NULL, n.content, NULL) AS content,
+                      IF(n.excerpt_html IS NULL, n.content_z, NULL) AS content_z,
+                      c.name as category_name, c.color as category_color
+               FROM notes n
+               LEFT JOIN categories c ON n.category_id = c.id
+               LEFT JOIN note_archive a ON a.note_id = n.id
+               WHERE n.id = %s AND n.user_id = %s''',
+            (note_id, user_id)
+        )
+        note = cursor.fetchone()
+        if not note:
+            return jsonify({'error': 'Note not found'}), 404
+        if note['excerpt_html'] is None:
+            fill_cold(connection, [note])
+            note['excerpt_html'], note['summary'] = make_excerpt(decode_note(note)['content'])
+        return jsonify({
+            'id': note['id'],
+            'is_pinned': bool(note['is_pinned']),
+            'is_archived': bool(note['is_archived']),
+            'html': render_template('_note_card.html', note=note)
+        })
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.route('/api/events')
+@login_required
+@limited('events', per_user='30/60')
+def api_events():
+    """Server-sent events for changes to the user's notes (see events.py)."""
+    user_id = session.get('user_id')
+    if not user_id or not events.EVENTS_ENABLED:
+        # 204 tells EventSource not to reconnect
+        return Response(status=204)
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 503
+    try:
+        # EventSource sends the header when it reconnects by itself; the page
+        # passes ?last_event_id= when it opens a new stream after a failure
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')
+        if last_id.isdigit():
+            after_id = int(last_id)
+            replay = events.replay_events(connection, user_id, after_id)
+        else:
+            after_id, replay = events.last_event_id(connection, user_id), []
+    finally:
+        connection.close()
+
+    subscription = events.get_bus().subscribe(user_id, after_id)
+    if subscription is None:
+        response = jsonify({'error': 'Too many open event streams', 'retry_after': 10})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    return Response(
+        events.stream(subscription, replay),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/note/<int:note_id>', methods=['PATCH'])
+@login_required
+def patch_note_api(note_id):
+    """Partially update a note (autosave).
+
+    JSON body: {"version": <base version>, "title"?, "category_id"?, and either
+    "content" (full text) or "diff" (line ops against the base version's text,
+    see revisions.py)}. Returns the new version and the card's excerpt HTML, or
+    409 with the current note when the base version is stale.
+    """
+    user_id = session.get('user_id')
+    data = request.get_json(silent=True) or {}
+    base_version = data.get('version')
+    if not isinstance(base_version, int):
+        return jsonify({'error': 'version is required'}), 400
+    if 'content' in data and 'diff' in data:
+        return jsonify({'error': 'Send either content or diff, not both'}), 400
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        warm_note(connection, note_id, user_id)
+        cursor.execute(
+            '''SELECT title, content, content_z, category_id, version FROM notes
+               WHERE id = %s AND user_id = %s FOR UPDATE''',
+            (note_id, user_id)
+        )
+        note = cursor.fetchone()
+        if not note:
+            return jsonify({'error': 'Note not found'}), 404
+        decode_note(note)
+
+        if note['version'] != base_version:
+            connection.rollback()
+            return jsonify({
+                'error': 'This note was changed elsewhere',
+                'version': note['version'],
+                'title': note['title'],
+                'content': note['content']
+            }), 409
+
+        title = note['title']
+        if 'title' in data:
+            title = str(data['title'] or '').strip()[:255]
+        content = note['content']
+        if 'content' in data:
+            content = str(data['content'] or '').strip()
+        elif 'diff' in data:
+            try:
+                content = apply_delta(note['content'], data['diff']).strip()
+            except ValueError as e:
+                return jsonify({'error': f'Invalid diff: {e}'}), 400
+        if not content:
+            return jsonify({'error': 'Note content cannot be empty'}), 400
+        category_id = note['category_id']
+        if 'category_id' in data:
+            category_id = resolve_category_id(cursor, user_id, data['category_id'] or None)
+            try:
+                category_id = int(category_id) if category_id is not None else None
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid category'}), 400
+
+        if (title, content, category_id) == (note['title'], note['content'], note['category_id']):
+            connection.rollback()
+            return jsonify({'version': note['version'], 'unchanged': True})
+
+        record_revision(connection, note_id, user_id, title, content)
+        excerpt_html, summary = make_excerpt(content)
+        cursor.execute(
+            '''UPDATE notes SET title = %s, content = %s, content_z = %s, content_size = %s,
+               excerpt_html = %s, summary = %s, category_id = %s, version = version + 1,
+               updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s''',
+            (title, *encode_content(content), excerpt_html, summary, category_id, note_id, user_id)
+        )
+        record_event(cursor, user_id, SAVED, note_id)
+        connection.commit()
+        search_index.note_saved(user_id, note_id, title, content)
+        related.note_saved(user_id, note_id, title, content)
+        return jsonify({
+            'version': base_version + 1,
+            'title': title,
+            'excerpt_html': excerpt_html
+        })
+    except Error as e:
+        connection.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        connection.close()
+
+# =============================================================================
+# OFFLINE SYNC (API)
+# =============================================================================
+@app.route('/api/sync')
+@login_required
+@limited('sync', per_user='60/60')
+def api_sync():
+    """Bring the client's offline copy up to date (see sync.py).
+
+    ?since=<cursor> returns the notes changed and deleted since, or
+    {"reset": true}; without it, ?after=<note id> pages through every note.
+    """
+    user_id = session.get('user_id')
+    if not user_id or not sync.SYNC_ENABLED:
+        return jsonify({'error': 'Offline sync is not available'}), 404
+
+    # Changes were just made elsewhere; replicas may not have them yet
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 503
+    try:
+        since = request.args.get('since', '')
+        if since.isdigit():
+            changes = sync.load_changes(connection, user_id, int(since))
+            return jsonify(changes if changes is not None else {'reset': True})
+        after = request.args.get('after', '')
+        return jsonify(sync.load_page(connection, user_id, int(after) if after.isdigit() else 0))
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        connection.close()
+
+@app.route('/api/sync', methods=['POST'])
+@login_required
+@limited('sync', per_user='60/60')
+def api_sync_upload():
+    """Save edits made offline: {"changes": [{id, version, title, content,
+    category_id}, ...]}. Each is committed on its own; see sync.apply_change
+    for the results."""
+    user_id = session.get('user_id')
+    if not user_id or not sync.SYNC_ENABLED:
+        return jsonify({'error': 'Offline sync is not available'}), 404
+    changes = (request.get_json(silent=True) or {}).get('changes')
+    if not isinstance(changes, list) or len(changes) > sync.SYNC_MAX_CHANGES:
+        return jsonify({'error': f'changes must be a list of at most {sync.SYNC_MAX_CHANGES} edits'}), 400
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 503
+    try:
+        results = []
+        for change in changes:
+            if not isinstance(change, dict):
+                results.append({'id': None, 'status': 'rejected', 'error': 'Invalid change'})
+                continue
+            try:
+                results.append(sync.apply_change(connection, user_id, change))
+            except Error as e:
+                print(f"Offline edit of note {change.get('id')} failed: {e}")
+                results.append({'id': change.get('id'), 'status': 'error', 'error': 'Not saved, try again'})
+        return jsonify({'results': results})
+    finally:
+        connection.close()
+
+# =============================================================================
+# REVISIONS (API)
+# =============================================================================
+@app.route('/api/note/<int:note_id>/revisions')
+@login_required
+def api_note_revisions(note_id):
+    """List saved revisions of a note, newest first."""
+    user_id = session.get('user_id')
+    connection = get_db_connection(read_only=True)
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        return jsonify({'revisions': list_revisions(connection, note_id, user_id)})
+    finally:
+        connection.close()
+
+
+def _load_owned_revision(connection, note_id, user_id, rev):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT id FROM notes WHERE id = %s AND user_id = %s', (note_id, user_id))
+        if not cursor.fetchone():
+            return None
+    finally:
+        cursor.close()
+    return load_revision(connection, note_id, rev)
+
+
+@app.route('/api/note/<int:note_id>/revisions/<int:rev>')
+@login_required
+def api_note_revision(note_id, rev):
+    """Get the full text of one revision."""
+    user_id = session.get('user_id')
+    connection = get_db_connection(read_only=True)
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        revision = _load_owned_revision(connection, note_id, user_id, rev)
+        if not revision:
+            return jsonify({'error': 'Revision not found'}), 404
+        revision['content_html'] = render_markdown(revision['content'])
+        return jsonify(revision)
+    finally:
+        connection.close()
+
+
+@app.route('/api/note/<int:note_id>/revisions/<int:rev>/diff')
+@login_required
+def api_note_revision_diff(note_id, rev):
+    """Unified diff of a revision against ?against=<rev> (default: the previous one)."""
+    user_id = session.get('user_id')
+    against = request.args.get('against', type=int, default=rev - 1)
+    connection = get_db_connection(read_only=True)
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        revision = _load_owned_revision(connection, note_id, user_id, rev)
+        if not revision:
+            return jsonify({'error': 'Revision not found'}), 404
+        if against < 1:
+            old = {'rev': 0, 'title': '', 'content': ''}
+        else:
+            old = load_revision(connection, note_id, against)
+            if not old:
+                return jsonify({'error': 'Revision not found'}), 404
+        return jsonify({
+            'from': old['rev'],
+            'to': rev,
+            'title_changed': old['title'] != revision['title'],
+            'diff': unified_diff(old['content'], revision['content'], f"rev {old['rev']}", f'rev {rev}')
+        })
+    finally:
+        connection.close()
+
+
+@app.route('/api/note/<int:note_id>/revisions/<int:rev>/restore', methods=['POST'])
+@login_required
+def api_restore_revision(note_id, rev):
+    """Make a revision the current text of the note (recorded as a new revision)."""
+    user_id = session.get('user_id')
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = connection.cursor()
+        revision = _load_owned_revision(connection, note_id, user_id, rev)
+        if not revision:
+            return jsonify({'error': 'Revision not found'}), 404
+        warm_note(connection, note_id, user_id)
+        new_rev = record_revision(connection, note_id, user_id, revision['title'], revision['content'],
+                                  coalesce=False)
+        cursor.execute(
+            '''UPDATE notes SET title = %s, content = %s, content_z = %s, content_size = %s,
+               excerpt_html = %s, summary = %s, version = version + 1, updated_at = CURRENT_TIMESTAMP
+               WHERE id = %s AND user_id = %s''',
+            (revision['title'], *encode_content(revision['content']), *make_excerpt(revision['content']),
+             note_id, user_id)
+        )
+        record_event(cursor, user_id, SAVED, note_id)
+        connection.commit()
+        search_index.note_saved(user_id, note_id, revision['title'], revision['content'])
+        related.note_saved(user_id, note_id, revision['title'], revision['content'])
+        return jsonify({'success': True, 'rev': new_rev})
+    except Error as e:
+        connection.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+        connection.close()
 @app.route('/api/note/<int:note_id>/share', methods=['POST'])
 @login_required
 def api_share_note(note_id):
     """Enable sharing for a note and return the link."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if not connection:
@@ -798,7 +1486,9 @@ def api_share_note(note_id):
             'UPDATE notes SET is_public = TRUE, share_token = %s WHERE id = %s',
             (token, note_id)
         )
+        record_event(cursor, user_id, SAVED, note_id)
         connection.commit()
+        register_share_token(token, user_id, note_id)
         
         share_url = url_for('view_shared', token=token, _external=True)
         return jsonify({'share_url': share_url, 'is_public': True})
@@ -812,7 +1502,7 @@ def api_share_note(note_id):
 @login_required
 def api_unshare_note(note_id):
     """Disable sharing for a note."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
     connection = get_db_connection()
     if not connection:
@@ -824,6 +1514,8 @@ def api_unshare_note(note_id):
             'UPDATE notes SET is_public = FALSE WHERE id = %s AND user_id = %s',
             (note_id, user_id)
         )
+        if cursor.rowcount:
+            record_event(cursor, user_id, SAVED, note_id)
         connection.commit()
         return jsonify({'success': True, 'is_public': False})
     except Error as e:
@@ -835,7 +1527,11 @@ def api_unshare_note(note_id):
 @app.route('/shared/<token>')
 def view_shared(token):
     """View a publicly shared note."""
-    connection = get_db_connection()
+    owner_id = find_share_owner(token)
+    if SHARDING_ENABLED and not owner_id:
+        return render_template('shared.html', error="This note is not available or the link has expired."), 404
+    
+    connection = get_db_connection(read_only=True, user_id=owner_id)
     if not connection:
         flash('Database connection failed.', 'error')
         return redirect(url_for('auth.login'))
@@ -854,6 +1550,7 @@ def view_shared(token):
             # If not found or not public, maybe show a custom 404 or redirect
             return render_template('shared.html', error="This note is not available or the link has expired."), 404
         
+        fill_cold(connection, [decode_note(note)])
         note['content_html'] = render_markdown(note['content'])
         return render_template('shared.html', note=note)
     finally:
@@ -866,12 +1563,11 @@ def view_shared(token):
 @login_required
 def manage_categories():
     """List and create categories."""
-    user_id = session['user_id']
-    connection = get_db_connection()
-    
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         color = request.form.get('color', '#6366f1')
+        user_id = ensure_user() if name else None
+        connection = get_db_connection() if user_id else None
         
         if name and connection:
             try:
@@ -880,13 +1576,20 @@ def manage_categories():
                     'INSERT INTO categories (user_id, name, color) VALUES (%s, %s, %s)',
                     (user_id, name, color)
                 )
+                record_event(cursor, user_id, RELOAD)
                 connection.commit()
                 flash('Category created!', 'success')
             finally:
                 cursor.close()
+                connection.close()
         
         return redirect(url_for('manage_categories'))
     
+    if is_lazy_guest():
+        return render_template('categories.html', categories=virtual_categories())
+    
+    user_id = session.get('user_id')
+    connection = get_db_connection(read_only=True)
     categories = []
     if connection:
         try:
@@ -898,17 +1601,20 @@ def manage_categories():
             connection.close()
     
     return render_template('categories.html', categories=categories)
-@app.route('/categories/<int:cat_id>/delete', methods=['POST'])
+@app.route('/categories/<int(signed=True):cat_id>/delete', methods=['POST'])
 @login_required
 def delete_category(cat_id):
     """Delete a category."""
-    user_id = session['user_id']
+    user_id = ensure_user()
     
-    connection = get_db_connection()
+    connection = get_db_connection() if user_id else None
     if connection:
         try:
-            cursor = connection.cursor()
+            cursor = connection.cursor(dictionary=True)
+            cat_id = resolve_category_id(cursor, user_id, cat_id)
             cursor.execute('DELETE FROM categories WHERE id = %s AND user_id = %s', (cat_id, user_id))
+            if cursor.rowcount:
+                record_event(cursor, user_id, RELOAD)
             connection.commit()
             flash('Category deleted!', 'success')
         finally:
@@ -921,12 +1627,13 @@ def delete_category(cat_id):
 # =============================================================================
 @app.route('/export')
 @login_required
+@limited('export', per_user='10/60', concurrent=2)
 def export_notes():
     """Export all notes as JSON."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     format_type = request.args.get('format', 'json')
     
-    connection = get_db_connection()
+    connection = get_db_connection(read_only=True)
     if not connection:
         flash('Database connection failed.', 'error')
         return redirect(url_for('index'))
@@ -934,15 +1641,17 @@ def export_notes():
     try:
         cursor = connection.cursor(dictionary=True)
         cursor.execute(
-            '''SELECT n.title, n.content, n.created_at, n.updated_at, c.name as category
+            '''SELECT n.id, n.is_cold, n.title, n.content, n.content_z, n.created_at, n.updated_at,
+                      c.name as category
                FROM notes n LEFT JOIN categories c ON n.category_id = c.id
                WHERE n.user_id = %s ORDER BY n.created_at DESC''',
             (user_id,)
         )
-        notes = cursor.fetchall()
+        notes = fill_cold(connection, decode_notes(cursor.fetchall()))
         
         # Convert datetime to string
         for note in notes:
+            del note['id'], note['is_cold']
             note['created_at'] = note['created_at'].isoformat() if note['created_at'] else None
             note['updated_at'] = note['updated_at'].isoformat() if note['updated_at'] else None
         
@@ -977,11 +1686,34 @@ def export_notes():
 # =============================================================================
 # IMPORT
 # =============================================================================
+def _import_attachments(notes):
+    """Files embedded in imported JSON notes, as "attachments": [{"filename",
+    "type", "data" (base64)}]. Returns them decoded, with new storage keys."""
+    files = []
+    for note in notes:
+        if not isinstance(note, dict) or not str(note.get('content') or '').strip():
+            continue
+        for att in note.get('attachments') or []:
+            try:
+                data = base64.b64decode(att['data'], validate=True)
+                filename = secure_filename(att['filename']) or 'file'
+            except (KeyError, TypeError, ValueError):
+                continue
+            files.append({
+                'note': note,
+                'key': f"attachments/{uuid.uuid4().hex}_{filename}",
+                'filename': filename,
+                'type': att.get('type') or 'application/octet-stream',
+                'data': data
+            })
+    return files
+
+
 @app.route('/import', methods=['POST'])
 @login_required
+@limited('import', per_user='5/60', per_ip='20/60', concurrent=2)
 def import_notes():
     """Import notes from JSON or TXT file."""
-    user_id = session['user_id']
 
     if 'file' not in request.files:
         flash('No file selected.', 'error')
@@ -1044,11 +1776,20 @@ def import_notes():
         flash('No notes found in file.', 'error')
         return redirect(url_for('index'))
 
-    connection = get_db_connection()
+    user_id = ensure_user()
+    connection = get_db_connection() if user_id else None
     if not connection:
         flash('Database connection failed.', 'error')
         return redirect(url_for('index'))
 
+    # Files embedded in JSON notes are stored concurrently before the notes
+    # are inserted, and removed again if the import fails
+    files = _import_attachments(notes_to_import)
+    failed = {key for key, _ in storage.get_storage().put_many([(f['key'], f['data'], f['type']) for f in files])}
+    files = [f for f in files if f['key'] not in failed]
+    if failed:
+        print(f"Import: {len(failed)} attachments could not be stored")
+
     try:
         cursor = connection.cursor(dictionary=True)
         imported = 0
@@ -1080,14 +1821,32 @@ def import_notes():
                     cat_cache[cat_key] = category_id
 
             cursor.execute(
-                'INSERT INTO notes (user_id, title, content, category_id) VALUES (%s, %s, %s, %s)',
-                (user_id, title, note_content, category_id)
+                '''INSERT INTO notes (user_id, title, content, content_z, content_size, excerpt_html, summary,
+                                      category_id)
+                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+                (user_id, title, *encode_content(note_content), *make_excerpt(note_content), category_id)
             )
+            note_id = cursor.lastrowid
             imported += 1
 
+            note_files = [f for f in files if f['note'] is note]
+            if note_files:
+                cursor.executemany(
+                    'INSERT INTO attachments (note_id, filename, s3_key, file_type, file_size) VALUES (%s, %s, %s, %s, %s)',
+                    [(note_id, f['filename'], f['key'], f['type'], len(f['data'])) for f in note_files]
+                )
+
+        if imported:
+            record_event(cursor, user_id, RELOAD)
         connection.commit()
+        search_index.forget(user_id)
+        related.forget(user_id)
         flash(f'Successfully imported {imported} note{"s" if imported != 1 else ""}!', 'success')
+        if failed:
+            flash(f'{len(failed)} attachment{"s" if len(failed) != 1 else ""} could not be stored.', 'error')
     except Error as e:
+        connection.rollback()
+        delete_files_from_storage([f['key'] for f in files])
         flash(f'Import error: {e}', 'error')
     finally:
         cursor.close()
@@ -1102,9 +1861,9 @@ def import_notes():
 @login_required
 def api_stats():
     """Get user statistics as JSON."""
-    user_id = session['user_id']
+    user_id = session.get('user_id')
     
-    connection = get_db_connection()
+    connection = get_db_connection(read_only=True)
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
@@ -1116,7 +1875,7 @@ def api_stats():
                 SUM(CASE WHEN is_archived = FALSE THEN 1 ELSE 0 END) as active_notes,
                 SUM(CASE WHEN is_pinned = TRUE THEN 1 ELSE 0 END) as pinned_notes,
                 SUM(CASE WHEN is_archived = TRUE THEN 1 ELSE 0 END) as archived_notes,
-                SUM(LENGTH(content)) as total_characters
+                SUM(COALESCE(content_size, LENGTH(content))) as total_characters
             FROM notes WHERE user_id = %s
         ''', (user_id,))
         stats = cursor.fetchone()
@@ -1131,14 +1890,81 @@ def api_stats():
         connection.close()
 
 
+@app.route('/api/search/suggest')
+@login_required
+def api_search_suggest():
+    """As-you-type search over the user's notes (in-memory index, see search_index.py).
+
+    Returns the best `limit` matches with titles, plus the ids of all matches
+    so the page can filter its cards.
+    """
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 8, type=int), 50)
+    if not query or is_lazy_guest():
+        return jsonify({'results': [], 'ids': []})
+
+    user_id = session.get('user_id')
+    connection = get_db_connection(read_only=True)
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    started = time.perf_counter()
+    try:
+        results, ids = search_index.suggest(connection, user_id, query, limit)
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        connection.close()
+    return jsonify({
+        'results': [{'id': note_id, 'title': label} for note_id, label in results],
+        'ids': ids[:1000],
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+
 @app.route('/api/preview', methods=['POST'])
 @login_required
+@limited('preview', per_user='240/60', concurrent=8)
 def api_preview_markdown():
-    """Render markdown for preview."""
-    data = request.get_json()
+    """Render markdown for preview.
+
+    Accepts either the full document ({"content": ...}) or only the blocks the
+    client has not rendered yet ({"blocks": [{"i": index, "text": ...}]}), at
+    most PREVIEW_MAX_BLOCKS blocks per request either way.
+    Each block is rendered once and served from the block cache afterwards.
+    """
+    data = request.get_json(silent=True) or {}
+
+    if 'blocks' in data:
+        blocks = data.get('blocks')
+        if not isinstance(blocks, list) or len(blocks) > PREVIEW_MAX_BLOCKS:
+            return jsonify({'error': 'Invalid blocks'}), 400
+        rendered = []
+        for block in blocks:
+            if not isinstance(block, dict) or not isinstance(block.get('text'), str):
+                return jsonify({'error': 'Invalid blocks'}), 400
+            key, html = render_block(block['text'])
+            rendered.append({'i': block.get('i'), 'hash': key, 'html': html})
+        return jsonify({'blocks': rendered})
+
     content = data.get('content', '')
-    html = render_markdown(content)
-    return jsonify({'html': html})
+    if not isinstance(content, str):
+        return jsonify({'error': 'Invalid content'}), 400
+    texts = split_blocks(content)
+    if len(texts) > PREVIEW_MAX_BLOCKS:
+        return jsonify({'error': f'Too many blocks (max {PREVIEW_MAX_BLOCKS}); send them as "blocks" in batches'}), 400
+    rendered = [render_block(text) for text in texts]
+    return jsonify({
+        'html': '\n'.join(html for _, html in rendered),
+        'blocks': [{'i': i, 'hash': key, 'html': html} for i, (key, html) in enumerate(rendered)]
+    })
+
+
+@app.route('/api/admin/render-stats')
+@admin_required
+def api_render_stats():
+    """Markdown renders per path (inline, helper process, fallbacks) in the worker that answers."""
+    return jsonify(render_pool.stats())
 
 
 
@@ -1151,6 +1977,34 @@ def api_preview_markdown():
 # =============================================================================
 
 
+def warmup():
+    """Prime per-worker state before the worker takes traffic.
+
+    Renders a sample document (loads markdown extensions and bleach's parser),
+    starts the render helper processes, creates the S3 client, fetches
+    Cognito's signing keys, opens a connection to every shard primary and
+    reads replica health, so the first real requests do not pay for cold
+    imports and DNS/auth setup.
+    """
+    started = time.time()
+    render_markdown(WARMUP_MARKDOWN)
+    render_pool.warm()
+    get_s3_client()
+    if cognito.COGNITO_ENABLED:
+        try:
+            cognito.get_token_service().warm()
+        except cognito.TokenError as e:
+            # The first login fetches them instead
+            print(f"Cognito warmup failed: {e}")
+    for shard in shards:
+        connection = shard.connect()
+        if connection:
+            connection.close()
+        for replica in shard.replicas:
+            replica.check()
+    print(f"Worker warmup finished in {(time.time() - started) * 1000:.0f}ms")
+
+
 if __name__ == '__main__':
     init_db()
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -0,0 +1,72 @@
+"""
+Cold-tier mover for Note-Taking App
+Moves notes archived for more than NOTE_ARCHIVE_AFTER_DAYS into note_archive
+(see note_archive.py), or with --warm-all moves every cold note back.
+
+Safe to run while the app is serving: each batch is one short transaction
+that locks only the rows it moves, and the app warms a note before changing
+it. Run nightly via cron (see scripts/08_setup_reaper.sh):
+
+    python archive_notes.py --after-days 30
+    python archive_notes.py --dry-run        # report savings for one batch
+    python archive_notes.py --warm-all       # undo, e.g. before a downgrade
+"""
+import sys
+import time
+import argparse
+
+from db import shards
+from note_archive import NOTE_ARCHIVE_AFTER_DAYS, cool_batch, warm_batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move long-archived notes to the cold archive table.')
+    parser.add_argument('--after-days', type=int, default=NOTE_ARCHIVE_AFTER_DAYS,
+                        help='move notes archived (and unedited) for this many days')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.05,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report savings for one batch without writing')
+    parser.add_argument('--warm-all', action='store_true',
+                        help='move every cold note back into the notes table')
+    args = parser.parse_args()
+
+    started = time.time()
+    moved = before = after = 0
+    failed = False
+    for shard in shards:
+        connection = shard.connect()
+        if not connection:
+            print(f'Error: database connection failed (shard {shard.shard_id}).')
+            failed = True
+            continue
+        try:
+            while True:
+                if args.warm_all:
+                    count = warm_batch(connection, args.batch_size)
+                    if not count:
+                        break
+                    moved += count
+                else:
+                    result = cool_batch(connection, args.batch_size, args.after_days, dry_run=args.dry_run)
+                    if not result:
+                        break
+                    moved, before, after = moved + result[0], before + result[1], after + result[2]
+                    if args.dry_run:
+                        break
+                time.sleep(args.pause)
+        finally:
+            connection.close()
+
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    if args.warm_all:
+        print(f'[{stamp}] archive: warmed {moved} notes elapsed={time.time() - started:.2f}s')
+    else:
+        print(f"[{stamp}] archive{' (dry run)' if args.dry_run else ''}: cooled {moved} notes, "
+              f"{before / 1024:.0f}KB -> {after / 1024:.0f}KB elapsed={time.time() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Static assets for Note-Taking App
+Build step for fingerprinted, minified and precompressed files, plus the
+Flask hooks that point templates at them and compress dynamic responses.
+
+Build (run on deploy, see scripts/03_setup_app.sh):
+    python assets.py
+
+Output goes to static/dist/: `<name>.<hash>.<ext>` plus .gz (and .br when the
+brotli module is installed) next to each file, and manifest.json mapping
+source names to built ones. Without a manifest (development) templates keep
+using the plain files in static/.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+
+from flask import request
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Files concatenated into one request. Pages that need only part of a bundle
+# keep referencing the individual (also fingerprinted) file.
+BUNDLES = {
+    'app.css': ['style.css', 'icons.css'],
+}
+
+# Everything under static/ except user uploads and previous builds
+SKIP_DIRS = {'dist', 'uploads'}
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Dynamic compression of HTML/JSON responses
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+COMPRESS_MIMETYPES = {'text/html', 'application/json', 'text/plain', 'text/csv'}
+
+
+# =============================================================================
+# MINIFICATION
+# =============================================================================
+CSS_STRING_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+
+
+def _minify_css_fallback(css):
+    """Strip comments and redundant whitespace, leaving string literals alone."""
+    parts = CSS_STRING_RE.split(css)
+    for i in range(0, len(parts), 2):
+        code = CSS_COMMENT_RE.sub('', parts[i])
+        code = re.sub(r'\s+', ' ', code)
+        # Whitespace around punctuation that never needs it (selectors keep " :")
+        code = re.sub(r' ?([{};,>]) ?', r'\1', code)
+        code = re.sub(r': ', ':', code)
+        parts[i] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_css(css):
+    try:
+        import rcssmin
+        return rcssmin.cssmin(css)
+    except ImportError:
+        return _minify_css_fallback(css)
+
+
+def minify_js(js):
+    """Minify with rjsmin when installed; otherwise leave the source as is
+    (regex literals, template strings and ASI make ad-hoc JS minifying unsafe)
+    and rely on the precompressed variants."""
+    try:
+        import rjsmin
+        return rjsmin.jsmin(js)
+    except ImportError:
+        return js
+
+
+# =============================================================================
+# BUILD
+# =============================================================================
+def _source_files():
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = [d for d in dirs if os.path.relpath(os.path.join(root, d), STATIC_DIR) not in SKIP_DIRS]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, STATIC_DIR).replace(os.sep, '/'), path
+
+
+def _process(name, data):
+    if name.endswith('.css'):
+        return minify_css(data.decode('utf-8')).encode('utf-8')
+    if name.endswith('.js'):
+        return minify_js(data.decode('utf-8')).encode('utf-8')
+    return data
+
+
+def _write_asset(name, data):
+    """Write a fingerprinted file (and compressed variants); return its dist path."""
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, ext = os.path.splitext(name)
+    built = f'{stem}.{digest}{ext}'
+    path = os.path.join(DIST_DIR, built)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    if ext in COMPRESSIBLE:
+        # mtime=0 keeps the .gz byte-identical across builds
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        try:
+            import brotli
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+        except ImportError:
+            pass
+    return f'dist/{built}'
+
+
+def build():
+    """Rebuild static/dist and its manifest from static/."""
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    manifest = {'files': {}, 'bundles': {}}
+    processed = {}
+    for name, path in _source_files():
+        with open(path, 'rb') as f:
+            processed[name] = _process(name, f.read())
+        manifest['files'][name] = _write_asset(name, processed[name])
+
+    for bundle, parts in BUNDLES.items():
+        data = b'\n'.join(processed[part] for part in parts)
+        manifest['bundles'][bundle] = _write_asset(bundle, data)
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    before = sum(os.path.getsize(p) for _, p in _source_files())
+    after = sum(len(d) for d in processed.values())
+    print(f'[OK] Built {len(manifest["files"])} files and {len(manifest["bundles"])} bundles '
+          f'into {DIST_DIR} ({before / 1024:.0f}KB -> {after / 1024:.0f}KB minified)')
+    return manifest
+
+
+# =============================================================================
+# FLASK INTEGRATION
+# =============================================================================
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_app(app):
+    """Point url_for('static', ...) at built files and compress responses."""
+    manifest = load_manifest()
+    files = manifest['files'] if manifest else {}
+    bundles = manifest['bundles'] if manifest else {}
+    if manifest:
+        print(f"\u2705 Static assets: {len(files)} fingerprinted files")
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in files:
+            values['filename'] = files[values['filename']]
+
+    def bundle_urls(name):
+        """URLs to include for a bundle: the built file, or its parts in development."""
+        from flask import url_for
+        if name in bundles:
+            return [url_for('static', filename=bundles[name])]
+        return [url_for('static', filename=part) for part in BUNDLES[name]]
+
+    app.jinja_env.globals['bundle_urls'] = bundle_urls
+    app.after_request(cache_fingerprinted)
+    app.after_request(compress_response)
+
+
+def cache_fingerprinted(response):
+    """Fingerprinted files never change; nginx sets the same header in production."""
+    if request.path.startswith('/static/dist/') and response.status_code == 200:
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
+
+def compress_response(response):
+    """gzip HTML/JSON responses for clients that accept it."""
+    if (response.status_code < 200 or response.status_code >= 300
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+if __name__ == '__main__':
+    build()
+    sys.exit(0)
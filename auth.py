@@ -3,42 +3,49 @@ Authentication module for Note-Taking App
 Supports AWS Cognito and Guest mode
 """
 import os
+import time
 import secrets
 import functools
 from flask import Blueprint, session, redirect, url_for, request, flash, jsonify
 from dotenv import load_dotenv
+from mysql.connector import Error
+from db import (get_db_connection, allocate_user_id, find_user_id_by_cognito_sub,
+                register_cognito_sub, forget_users)
+from ratelimit import limited
+from cognito import COGNITO_ENABLED, COGNITO_CLIENT_ID, COGNITO_BASE_URL, TokenError, get_token_service
 
 load_dotenv()
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
-# AWS Cognito configuration (optional)
-COGNITO_REGION = os.getenv('AWS_REGION', 'us-east-1')
-COGNITO_USER_POOL_ID = os.getenv('COGNITO_USER_POOL_ID', '')
-COGNITO_CLIENT_ID = os.getenv('COGNITO_CLIENT_ID', '')
-COGNITO_CLIENT_SECRET = os.getenv('COGNITO_CLIENT_SECRET', '')
-COGNITO_DOMAIN = os.getenv('COGNITO_DOMAIN', '')
+# Mirrors the after_user_insert trigger in schema.sql. Guests see these as
+# virtual categories (negative ids) until their first write creates the user row.
+DEFAULT_CATEGORIES = [
+    ('Personal', '#6366f1'),
+    ('Work', '#10b981'),
+    ('Ideas', '#f59e0b'),
+]
 
-# Check if Cognito is configured
-COGNITO_ENABLED = bool(COGNITO_USER_POOL_ID and COGNITO_CLIENT_ID and COGNITO_DOMAIN)
+# Guests' last_seen_at is refreshed at most this often (seconds); see guest_reaper.py
+LAST_SEEN_INTERVAL = int(os.getenv('GUEST_LAST_SEEN_INTERVAL', 300))
 
-
-def get_db_connection():
-    """Import from app to avoid circular imports."""
-    from app import get_db_connection as db_conn
-    return db_conn()
+# Operators allowed to use the /api/admin endpoints (comma-separated Cognito emails)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv('ADMIN_EMAILS', '').split(',') if e.strip()}
 
 
 def login_required(f):
     """Decorator to require authentication (Cognito or Guest)."""
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if 'user_id' not in session and not session.get('is_guest'):
             flash('Please log in or continue as guest.', 'error')
             return redirect(url_for('auth.login'))
         
-        # Check if profile setup is needed (skip for profile routes)
-        if request.endpoint not in ['profile_setup', 'save_profile']:
+        if session.get('is_guest'):
+            touch_last_seen()
+        
+        # Check if profile setup is needed (skip for profile routes and guests)
+        if request.endpoint not in ['profile_setup', 'save_profile'] and not session.get('is_guest'):
             user = get_current_user()
             if user and not user.get('profile_complete') and not user.get('is_guest'):
                 return redirect(url_for('profile_setup'))
@@ -47,12 +54,138 @@ def login_required(f):
     return decorated_function
 
 
+def admin_required(f):
+    """Decorator for operator-only API endpoints (signed-in users in ADMIN_EMAILS)."""
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        user = get_current_user() if ADMIN_EMAILS and not session.get('is_guest') else None
+        if not user or (user.get('email') or '').lower() not in ADMIN_EMAILS:
+            # Do not advertise that the endpoint exists
+            return jsonify({'error': 'Not found'}), 404
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def touch_last_seen():
+    """Record guest activity, throttled through the session to one write per interval."""
+    now = int(time.time())
+    if 'user_id' not in session or now - session.get('last_seen', 0) < LAST_SEEN_INTERVAL:
+        return
+    
+    connection = get_db_connection()
+    if not connection:
+        return
+    
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            'UPDATE users SET last_seen_at = CURRENT_TIMESTAMP, updated_at = updated_at WHERE id = %s',
+            (session['user_id'],)
+        )
+        connection.commit()
+        session['last_seen'] = now
+    except Error as e:
+        # Only bookkeeping; the next request after the interval tries again
+        print(f"Error updating last_seen_at: {e}")
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def is_lazy_guest():
+    """True for a guest whose user row has not been created yet."""
+    return 'user_id' not in session and bool(session.get('is_guest'))
+
+
+def virtual_guest_user():
+    """User dict for a guest that only exists in the signed session."""
+    return {
+        'id': None,
+        'display_name': session.get('display_name'),
+        'email': '',
+        'first_name': None,
+        'last_name': None,
+        'bio': None,
+        'avatar_url': None,
+        'timezone': 'UTC',
+        'profile_complete': False,
+        'is_guest': True
+    }
+
+
+def virtual_categories():
+    """Default categories for a lazy guest, ordered by name like the real query."""
+    categories = [
+        {'id': -(i + 1), 'user_id': None, 'name': name, 'color': color}
+        for i, (name, color) in enumerate(DEFAULT_CATEGORIES)
+    ]
+    return sorted(categories, key=lambda c: c['name'])
+
+
+def ensure_user():
+    """Return the session's user id, creating the guest's row on first write."""
+    if 'user_id' in session:
+        return session['user_id']
+    if not session.get('is_guest'):
+        return None
+    
+    try:
+        new_id = allocate_user_id()
+        connection = get_db_connection(user_id=new_id)
+    except Exception as e:
+        print(f"Error allocating guest user: {e}")
+        return None
+    if not connection:
+        return None
+    
+    cursor = connection.cursor()
+    try:
+        # The after_user_insert trigger adds the default categories
+        cursor.execute(
+            'INSERT INTO users (id, display_name, is_guest) VALUES (%s, %s, TRUE)',
+            (new_id, session.get('display_name'))
+        )
+        connection.commit()
+        session['user_id'] = new_id or cursor.lastrowid
+        session['last_seen'] = int(time.time())
+        return session['user_id']
+    except Exception as e:
+        print(f"Error creating guest user: {e}")
+        return None
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def resolve_category_id(cursor, user_id, category_id):
+    """Map a virtual (negative) category id from a guest form to the real row."""
+    try:
+        index = -int(category_id) - 1
+    except (TypeError, ValueError):
+        return category_id
+    if index < 0:
+        return category_id
+    if index >= len(DEFAULT_CATEGORIES):
+        return None
+    
+    cursor.execute(
+        'SELECT id FROM categories WHERE user_id = %s AND name = %s ORDER BY id LIMIT 1',
+        (user_id, DEFAULT_CATEGORIES[index][0])
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return row['id'] if isinstance(row, dict) else row[0]
+
+
 def get_current_user():
     """Get the current user from session."""
+    if is_lazy_guest():
+        return virtual_guest_user()
     if 'user_id' not in session:
         return None
     
-    connection = get_db_connection()
+    connection = get_db_connection(read_only=True)
     if not connection:
         return None
     
@@ -70,42 +203,26 @@ def get_current_user():
 def login():
     """Show login page."""
     from flask import render_template
-    if 'user_id' in session:
+    if 'user_id' in session or session.get('is_guest'):
         return redirect(url_for('index'))
     return render_template('login.html', cognito_enabled=COGNITO_ENABLED)
 
 
 @auth_bp.route('/guest', methods=['GET', 'POST'])
+@limited('guest', per_ip='30/3600')
 def guest_login():
-    """Create a guest session with full functionality."""
-    connection = get_db_connection()
-    if not connection:
-        flash('Database connection failed.', 'error')
-        return redirect(url_for('auth.login'))
+    """Start a guest session.
+
+    The guest lives only in the signed session until the first write
+    (see ensure_user), so browsing as a guest never touches the database.
+    """
+    guest_name = f"Guest_{secrets.token_hex(4)}"
+    session.pop('user_id', None)
+    session['display_name'] = guest_name
+    session['is_guest'] = True
     
-    try:
-        cursor = connection.cursor()
-        # Create guest user
-        guest_name = f"Guest_{secrets.token_hex(4)}"
-        cursor.execute(
-            'INSERT INTO users (display_name, is_guest) VALUES (%s, TRUE)',
-            (guest_name,)
-        )
-        connection.commit()
-        
-        # Set session
-        session['user_id'] = cursor.lastrowid
-        session['display_name'] = guest_name
-        session['is_guest'] = True
-        
-        flash(f'Welcome, {guest_name}! Create an account to save your notes permanently.', 'info')
-        return redirect(url_for('index'))
-    except Exception as e:
-        flash(f'Error creating guest session: {e}', 'error')
-        return redirect(url_for('auth.login'))
-    finally:
-        cursor.close()
-        connection.close()
+    flash(f'Welcome, {guest_name}! Create an account to save your notes permanently.', 'info')
+    return redirect(url_for('index'))
 
 
 @auth_bp.route('/cognito')
@@ -118,7 +235,7 @@ def cognito_login():
     # Build Cognito authorization URL
     callback_url = url_for('auth.cognito_callback', _external=True)
     auth_url = (
-        f"https://{COGNITO_DOMAIN}/login?"
+        f"{COGNITO_BASE_URL}/login?"
         f"client_id={COGNITO_CLIENT_ID}&"
         f"response_type=code&"
         f"scope=openid+email+profile&"
@@ -139,40 +256,30 @@ def cognito_callback():
         return redirect(url_for('auth.login'))
     
     try:
-        import requests
-        from jose import jwt
-        
-        # Exchange code for tokens
+        # Exchange code for tokens; the ID token is verified against the pool's keys
         callback_url = url_for('auth.cognito_callback', _external=True)
-        token_url = f"https://{COGNITO_DOMAIN}/oauth2/token"
-        
-        response = requests.post(token_url, data={
-            'grant_type': 'authorization_code',
-            'client_id': COGNITO_CLIENT_ID,
-            'client_secret': COGNITO_CLIENT_SECRET,
-            'code': code,
-            'redirect_uri': callback_url
-        }, headers={'Content-Type': 'application/x-www-form-urlencoded'})
-        
-        if response.status_code != 200:
-            flash('Token exchange failed.', 'error')
+        try:
+            claims = get_token_service().exchange_code(code, callback_url)
+        except TokenError as e:
+            print(f"Cognito login failed: {e}")
+            flash('Authentication failed.', 'error')
             return redirect(url_for('auth.login'))
-        
-        tokens = response.json()
-        id_token = tokens.get('id_token')
-        
-        # Decode token (skip verification for simplicity - add in production)
-        claims = jwt.get_unverified_claims(id_token)
+
         cognito_sub = claims.get('sub')
         email = claims.get('email', '')
         name = claims.get('name', email.split('@')[0] if email else 'User')
         
-        # Find or create user
-        connection = get_db_connection()
-        cursor = connection.cursor(dictionary=True)
-        
-        cursor.execute('SELECT * FROM users WHERE cognito_sub = %s', (cognito_sub,))
-        user = cursor.fetchone()
+        # Find or create user (the directory knows the shard when sharded)
+        existing_id = find_user_id_by_cognito_sub(cognito_sub)
+        user = None
+        if existing_id:
+            connection = get_db_connection(user_id=existing_id)
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute('SELECT * FROM users WHERE id = %s', (existing_id,))
+            user = cursor.fetchone()
+        else:
+            connection = get_db_connection()
+            cursor = connection.cursor(dictionary=True)
         
         if not user:
             # Check if guest user exists in session to migrate
@@ -186,15 +293,22 @@ def cognito_callback():
                 )
                 connection.commit()
                 user_id = session['user_id']
+                register_cognito_sub(user_id, cognito_sub)
                 flash('Your guest notes have been saved to your account!', 'success')
             else:
-                # Create new user
+                # Create new user on the shard chosen by the directory
+                new_id = allocate_user_id(cognito_sub)
+                if new_id:
+                    cursor.close()
+                    connection.close()
+                    connection = get_db_connection(user_id=new_id)
+                    cursor = connection.cursor(dictionary=True)
                 cursor.execute(
-                    'INSERT INTO users (cognito_sub, email, display_name) VALUES (%s, %s, %s)',
-                    (cognito_sub, email, name)
+                    'INSERT INTO users (id, cognito_sub, email, display_name) VALUES (%s, %s, %s, %s)',
+                    (new_id, cognito_sub, email, name)
                 )
                 connection.commit()
-                user_id = cursor.lastrowid
+                user_id = new_id or cursor.lastrowid
         else:
             user_id = user['id']
         
@@ -220,6 +334,8 @@ def cognito_callback():
         session['display_name'] = name
         session['email'] = email
         session['is_guest'] = False
+        # This GET may have created the user row; keep the next reads on the primary
+        session['last_write_at'] = time.time()
         
         flash(f'Welcome back, {greeting_name}!', 'success')
         return redirect(url_for('index'))
@@ -243,6 +359,7 @@ def logout():
                 cursor = connection.cursor()
                 cursor.execute('DELETE FROM users WHERE id = %s AND is_guest = TRUE', (user_id,))
                 connection.commit()
+                forget_users([user_id])
             finally:
                 cursor.close()
                 connection.close()
@@ -253,7 +370,7 @@ def logout():
     if COGNITO_ENABLED and not is_guest:
         # Redirect to Cognito logout
         logout_url = (
-            f"https://{COGNITO_DOMAIN}/logout?"
+            f"{COGNITO_BASE_URL}/logout?"
             f"client_id={COGNITO_CLIENT_ID}&"
             f"logout_uri={url_for('auth.login', _external=True)}"
         )
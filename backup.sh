@@ -1,14 +1,27 @@
 #!/bin/bash
 # =====================================================
-# MariaDB Backup Script for Note-Taking App
-# Run via cron: 0 2 * * * /path/to/backup.sh
+# MariaDB + Attachments Backup Script for Note-Taking App
+# Run via cron (see scripts/07_setup_backup.sh):
+#   0 2 * * *   backup.sh                 # full snapshot + uploads
+#   30 * * * *  backup.sh --incremental   # binlogs since last run + uploads
+#   0 4 * * 0   backup.sh --verify        # test-restore the latest snapshot
+#
+# Layout under $BACKUP_DIR:
+#   full/<timestamp>/     consistent snapshot: per-table .sql.gz files
+#                         (mydumper, parallel) or one dump.sql.gz (mysqldump),
+#                         plus meta (binlog position) and SHA256SUMS
+#   binlog/               compressed binlog files, for point-in-time restore
+#   uploads/<timestamp>/  copy of static/uploads, hardlinked to the previous one
+#   s3/                   mirror of the attachment bucket (BACKUP_S3=1)
+#
+# Dumps are streamed through the compressor in one pass and never hold
+# table locks (--single-transaction / --trx-consistency-only).
 # =====================================================
 
 # Configuration
 # Dynamic directory detection
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"
 APP_DIR="${SCRIPT_DIR}"
-BACKUP_DIR="/backup"
 LOG_FILE="${APP_DIR}/backup.log"
 
 # Load settings from .env if it exists
@@ -16,16 +29,92 @@ if [ -f "${APP_DIR}/.env" ]; then
     export $(grep -v '^#' "${APP_DIR}/.env" | xargs)
 fi
 
+BACKUP_DIR="${BACKUP_DIR:-/backup}"
 DB_NAME="${DB_NAME:-notes_db}"
-DB_USER="${DB_USER:-notes_user}"
-DB_PASSWORD="${DB_PASSWORD:-your_password_here}"
-RETENTION_DAYS=7
+DB_HOST="${DB_HOST:-localhost}"
+DB_PORT="${DB_PORT:-3306}"
+# Backups need RELOAD and REPLICATION privileges the app user does not have;
+# by default they run as root over the local socket (cron runs as root)
+BACKUP_DB_USER="${BACKUP_DB_USER:-root}"
+BACKUP_DB_PASSWORD="${BACKUP_DB_PASSWORD:-}"
+BACKUP_THREADS="${BACKUP_THREADS:-4}"
+RETENTION_DAYS="${BACKUP_RETENTION_DAYS:-7}"
+UPLOADS_DIR="${APP_DIR}/static/uploads"
+
+FULL_DIR="${BACKUP_DIR}/full"
+BINLOG_DIR="${BACKUP_DIR}/binlog"
+UPLOADS_BACKUP_DIR="${BACKUP_DIR}/uploads"
+TIMESTAMP=$(date +%Y%m%d_%H%M%S)
+
+# pigz compresses on all cores; same format as gzip
+if command -v pigz &> /dev/null; then
+    COMPRESS="pigz -p ${BACKUP_THREADS}"
+else
+    COMPRESS="gzip"
+fi
 
 # Function to log messages
 log_message() {
     echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1" | tee -a "$LOG_FILE"
 }
 
+# These scripts snapshot and replay a single server. A sharded install
+# (several DB_SHARDS entries, or a separate DB_DIRECTORY_HOST) holds users on
+# other hosts too, so refuse instead of silently covering only part of it.
+SHARD_ENTRIES=$(echo "${DB_SHARDS:-}" | tr ',' '\n' | tr -d '[:blank:]' | grep -v '^$')
+if [ "$(echo -n "$SHARD_ENTRIES" | grep -c '')" -gt 1 ] || [ -n "${DB_DIRECTORY_HOST:-}" ]; then
+    log_message "Error: DB_SHARDS / DB_DIRECTORY_HOST configure more than one database server; $(basename "$0") only handles one. Run a separate backup on each shard and on the directory host, with DB_SHARDS and DB_DIRECTORY_HOST unset there."
+    exit 1
+fi
+if [ -n "$SHARD_ENTRIES" ]; then
+    # A single DB_SHARDS entry ("host[:port][/database]") is the database
+    SHARD_ADDRESS="${SHARD_ENTRIES%%/*}"
+    [ "$SHARD_ADDRESS" != "$SHARD_ENTRIES" ] && DB_NAME="${SHARD_ENTRIES#*/}"
+    DB_HOST="${SHARD_ADDRESS%%:*}"
+    [ "$DB_HOST" != "$SHARD_ADDRESS" ] && DB_PORT="${SHARD_ADDRESS#*:}"
+fi
+
+# Client credentials go in a private option file, not on the command line
+CLIENT_CNF=$(mktemp)
+trap 'rm -f "$CLIENT_CNF"' EXIT
+chmod 600 "$CLIENT_CNF"
+{
+    echo "[client]"
+    echo "user=${BACKUP_DB_USER}"
+    [ -n "$BACKUP_DB_PASSWORD" ] && echo "password=${BACKUP_DB_PASSWORD}"
+    if [ "$DB_HOST" != "localhost" ]; then
+        echo "host=${DB_HOST}"
+        echo "port=${DB_PORT}"
+    fi
+} > "$CLIENT_CNF"
+
+mysql_query() {
+    mysql --defaults-extra-file="$CLIENT_CNF" -N -B -e "$1"
+}
+
+# Value of a key in a snapshot's meta file
+meta_value() {
+    sed -n "s/^$2=//p" "$1/meta" 2>/dev/null | head -n 1
+}
+
+# Completed snapshots, oldest first
+list_snapshots() {
+    ls -1d "$FULL_DIR"/*/ 2>/dev/null | grep -v '\.partial/$' | sed 's:/$::' | sort
+}
+
+# Binlog file of the oldest snapshot taken with binary logging on:
+# binlogs before it can no longer be replayed
+first_needed_binlog() {
+    local snapshot file
+    for snapshot in $(list_snapshots); do
+        file=$(meta_value "$snapshot" binlog_file)
+        if [ -n "$file" ]; then
+            echo "$file"
+            return
+        fi
+    done
+}
+
 # Ensure backup directory exists
 if [ ! -d "$BACKUP_DIR" ]; then
     log_message "Error: Backup directory $BACKUP_DIR does not exist! attempting to create..."
@@ -35,37 +124,199 @@ if [ ! -d "$BACKUP_DIR" ]; then
         exit 1
     fi
 fi
+mkdir -p "$FULL_DIR" "$BINLOG_DIR" "$UPLOADS_BACKUP_DIR"
 
-# Create timestamp
-TIMESTAMP=$(date +%Y%m%d_%H%M%S)
-BACKUP_FILE="${BACKUP_DIR}/notes_backup_${TIMESTAMP}.sql"
-
-# Perform backup
-log_message "Starting backup for database: $DB_NAME"
-mysqldump -u "$DB_USER" -p"$DB_PASSWORD" "$DB_NAME" > "$BACKUP_FILE" 2>> "$LOG_FILE"
-
-# Check if backup was successful
-if [ $? -eq 0 ]; then
-    log_message "Backup successful: $BACKUP_FILE"
-    
-    # Compress the backup
-    gzip "$BACKUP_FILE"
-    if [ $? -eq 0 ]; then
-        log_message "Compressed to: ${BACKUP_FILE}.gz"
+# =====================================================
+# Full snapshot
+# =====================================================
+full_backup() {
+    local dest="${FULL_DIR}/${TIMESTAMP}"
+    local work="${dest}.partial"
+    local log_bin binlog_file binlog_pos tool
+
+    log_bin=$(mysql_query 'SELECT @@log_bin')
+    if [ "$log_bin" != "1" ]; then
+        log_message "Warning: binary logging is off; incremental and point-in-time restore unavailable (run scripts/07_setup_backup.sh)."
+    fi
+
+    log_message "Starting full backup for database: $DB_NAME"
+    # The snapshot is consistent as of its start
+    local started_at
+    started_at=$(date '+%Y-%m-%d %H:%M:%S')
+    if command -v mydumper &> /dev/null; then
+        # Consistent across threads: the threads' transactions are opened
+        # together, and large tables are split into row chunks
+        tool="mydumper"
+        mydumper --defaults-file="$CLIENT_CNF" --database "$DB_NAME" --outputdir "$work" \
+            --threads "$BACKUP_THREADS" --rows 50000 --trx-consistency-only \
+            --compress --triggers --routines --events >> "$LOG_FILE" 2>&1
+        if [ $? -ne 0 ] || [ ! -f "$work/metadata" ]; then
+            log_message "Error: mydumper failed!"
+            rm -rf "$work"
+            return 1
+        fi
+        # metadata format differs between mydumper versions (Log:/Pos: or File =/Position =)
+        binlog_file=$(awk -F'[:=]' '/^[[:space:]]*(Log|File)[[:space:]]*[:=]/ {gsub(/[[:space:]"]/, "", $2); print $2; exit}' "$work/metadata")
+        binlog_pos=$(awk -F'[:=]' '/^[[:space:]]*(Pos|Position)[[:space:]]*[:=]/ {gsub(/[[:space:]"]/, "", $2); print $2; exit}' "$work/metadata")
     else
-        log_message "Warning: Gzip compression failed."
+        # Single consistent stream (install mydumper for parallel per-table dumps)
+        tool="mysqldump"
+        local master_data=""
+        [ "$log_bin" == "1" ] && master_data="--master-data=2"
+        mkdir -p "$work"
+        mysqldump --defaults-extra-file="$CLIENT_CNF" --single-transaction --quick $master_data \
+            --routines --triggers --events --hex-blob "$DB_NAME" 2>> "$LOG_FILE" | $COMPRESS > "$work/dump.sql.gz"
+        local status=("${PIPESTATUS[@]}")
+        if [ "${status[0]}" -ne 0 ] || [ "${status[1]}" -ne 0 ]; then
+            log_message "Error: Backup failed! Check MySQL credentials and permissions."
+            rm -rf "$work"
+            return 1
+        fi
+        if [ -n "$master_data" ]; then
+            read -r binlog_file binlog_pos < <(gunzip -c "$work/dump.sql.gz" | head -n 100 | \
+                sed -n "s/.*MASTER_LOG_FILE='\([^']*\)', MASTER_LOG_POS=\([0-9]*\).*/\1 \2/p")
+        fi
+    fi
+
+    {
+        echo "created_at=${started_at}"
+        echo "database=${DB_NAME}"
+        echo "tool=${tool}"
+        echo "binlog_file=${binlog_file}"
+        echo "binlog_pos=${binlog_pos}"
+    } > "$work/meta"
+    (cd "$work" && sha256sum $(ls | grep -v '^SHA256SUMS$') > SHA256SUMS)
+
+    mv "$work" "$dest"
+    log_message "Full backup successful: $dest ($(du -sh "$dest" | awk '{print $1}'), binlog ${binlog_file:-n/a}:${binlog_pos:-n/a})"
+}
+
+# =====================================================
+# Incremental: binlogs since the last run
+# =====================================================
+fetch_binlogs() {
+    if [ "$(mysql_query 'SELECT @@log_bin')" != "1" ]; then
+        log_message "Warning: binary logging is off; skipping incremental backup."
+        return 0
+    fi
+    local first_needed
+    first_needed=$(first_needed_binlog)
+    if [ -z "$first_needed" ]; then
+        log_message "No full snapshot with a binlog position yet; run a full backup first."
+        return 0
+    fi
+
+    # Close the current binlog so everything written so far can be copied
+    mysql_query 'FLUSH BINARY LOGS' || return 1
+    # All but the last (still open) binlog
+    local closed=($(mysql_query 'SHOW BINARY LOGS' | awk '{print $1}' | head -n -1))
+    local count=0 file
+    for file in "${closed[@]}"; do
+        [[ "$file" < "$first_needed" ]] && continue
+        [ -f "${BINLOG_DIR}/${file}.gz" ] && continue
+        mysqlbinlog --defaults-extra-file="$CLIENT_CNF" --read-from-remote-server --raw \
+            --result-file="${BINLOG_DIR}/" "$file" 2>> "$LOG_FILE" && $COMPRESS "${BINLOG_DIR}/${file}"
+        if [ $? -ne 0 ]; then
+            log_message "Error: failed to copy binlog $file"
+            rm -f "${BINLOG_DIR}/${file}"
+            return 1
+        fi
+        count=$((count + 1))
+    done
+    log_message "Incremental backup: $count new binlog file(s) (up to ${closed[${#closed[@]}-1]:-none})"
+}
+
+# =====================================================
+# Attachments
+# =====================================================
+sync_uploads() {
+    if [ ! -d "$UPLOADS_DIR" ]; then
+        return 0
+    fi
+    if ! command -v rsync &> /dev/null; then
+        log_message "Warning: rsync not installed; uploads not backed up."
+        return 1
+    fi
+    local previous
+    previous=$(ls -1d "$UPLOADS_BACKUP_DIR"/*/ 2>/dev/null | grep -v '\.partial/$' | sort | tail -n 1)
+    # Nothing changed since the last copy: keep it
+    if [ -n "$previous" ] && [ -z "$(rsync -a --delete --dry-run --itemize-changes "$UPLOADS_DIR/" "$previous")" ]; then
+        return 0
+    fi
+    local dest="${UPLOADS_BACKUP_DIR}/${TIMESTAMP}"
+    # Unchanged files are hardlinks into the previous copy, so each copy only costs what changed
+    rsync -a --delete ${previous:+--link-dest="$previous"} "$UPLOADS_DIR/" "${dest}.partial/" 2>> "$LOG_FILE"
+    if [ $? -ne 0 ]; then
+        log_message "Error: uploads sync failed"
+        rm -rf "${dest}.partial"
+        return 1
+    fi
+    mv "${dest}.partial" "$dest"
+    log_message "Uploads copied: $dest"
+
+    # Attachments stored in S3: mirror the bucket (never deleting, so restores can find old files)
+    if [ "${BACKUP_S3:-0}" == "1" ] && [ -n "$S3_BUCKET_NAME" ] && command -v aws &> /dev/null; then
+        aws s3 sync "s3://${S3_BUCKET_NAME}" "${BACKUP_DIR}/s3/" --only-show-errors >> "$LOG_FILE" 2>&1 \
+            && log_message "S3 bucket mirrored: ${BACKUP_DIR}/s3/" \
+            || log_message "Warning: S3 mirror failed."
     fi
-    
-    # Remove old backups (older than RETENTION_DAYS)
+}
+
+# =====================================================
+# Retention
+# =====================================================
+prune() {
     log_message "Cleaning up backups older than $RETENTION_DAYS days..."
-    find "$BACKUP_DIR" -name "notes_backup_*.sql.gz" -mtime +$RETENTION_DAYS -delete
-    
+    local newest dir file
+    # Full snapshots and upload copies (the newest of each is always kept)
+    for base in "$FULL_DIR" "$UPLOADS_BACKUP_DIR"; do
+        newest=$(ls -1d "$base"/*/ 2>/dev/null | grep -v '\.partial/$' | sort | tail -n 1)
+        for dir in $(find "$base" -mindepth 1 -maxdepth 1 -type d -mtime +$RETENTION_DAYS); do
+            [ "$dir/" == "$newest" ] && continue
+            rm -rf "$dir"
+        done
+    done
+    # Binlogs older than the oldest snapshot can no longer be replayed
+    local first_needed
+    first_needed=$(first_needed_binlog)
+    if [ -n "$first_needed" ]; then
+        for file in "$BINLOG_DIR"/*.gz; do
+            [ -e "$file" ] || continue
+            [[ "$(basename "$file" .gz)" < "$first_needed" ]] && rm -f "$file"
+        done
+    fi
+    # Single-file backups from older versions of this script
+    find "$BACKUP_DIR" -maxdepth 1 -name "notes_backup_*.sql.gz" -mtime +$RETENTION_DAYS -delete
+}
+
+case "$1" in
+    --incremental)
+        fetch_binlogs
+        STATUS=$?
+        sync_uploads || STATUS=1
+        ;;
+    --verify)
+        # Restore the latest snapshot into a scratch database and check it
+        "${APP_DIR}/restore.sh" --verify-only
+        STATUS=$?
+        ;;
+    "")
+        full_backup
+        STATUS=$?
+        if [ $STATUS -eq 0 ]; then
+            sync_uploads || STATUS=1
+            prune
+        fi
+        ;;
+    *)
+        echo "Usage: $0 [--incremental | --verify]"
+        exit 1
+        ;;
+esac
+
+if [ $STATUS -eq 0 ]; then
     log_message "Backup process completed successfully."
 else
-    log_message "Error: Backup failed! Check MySQL credentials and permissions."
-    # Clean up empty file if dump failed
-    if [ -f "$BACKUP_FILE" ]; then
-        rm "$BACKUP_FILE"
-    fi
-    exit 1
+    log_message "Error: Backup process finished with errors."
 fi
+exit $STATUS
@@ -0,0 +1,95 @@
+"""
+Note excerpt backfill for Note-Taking App
+Stores the card excerpt and summary (rendering.make_excerpt) for notes saved
+before excerpts existed, or with --rebuild for every note (e.g. after
+changing NOTE_EXCERPT_CHARS or the markdown settings).
+
+Until it has run, the dashboard renders missing excerpts on the fly, so it
+is safe to run while the app is serving: rows are processed in small
+id-ordered batches, and a row whose version changed since it was read is
+skipped (the edit already stored its excerpt).
+
+    python build_excerpts.py --batch-size 500
+    python build_excerpts.py --rebuild
+"""
+import sys
+import time
+import argparse
+
+from db import shards
+from note_store import decode_note
+from rendering import make_excerpt
+
+
+def backfill_batch(connection, after_id, batch_size, rebuild=False):
+    """Process one batch of notes with id > after_id.
+
+    Returns (last_id, rows_updated), or None when there are no more rows.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        # Cold notes keep their excerpt in note_archive (note_archive.py)
+        where = 'AND is_cold = FALSE' if rebuild else 'AND excerpt_html IS NULL AND is_cold = FALSE'
+        cursor.execute(
+            f'''SELECT id, content, content_z, version FROM notes
+                WHERE id > %s {where} ORDER BY id LIMIT %s''',
+            (after_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        for row in rows:
+            # updated_at = updated_at: a derived column is not an edit
+            cursor.execute(
+                '''UPDATE notes SET excerpt_html = %s, summary = %s, updated_at = updated_at
+                   WHERE id = %s AND version = %s''',
+                (*make_excerpt(decode_note(row)['content']), row['id'], row['version'])
+            )
+        connection.commit()
+        return rows[-1]['id'], len(rows)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store card excerpts for existing notes.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.05,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='recompute excerpts for every note, not only missing ones')
+    args = parser.parse_args()
+
+    started = time.time()
+    total = 0
+    failed = False
+    for shard in shards:
+        connection = shard.connect()
+        if not connection:
+            print(f'Error: database connection failed (shard {shard.shard_id}).')
+            failed = True
+            continue
+        after_id = 0
+        try:
+            while True:
+                result = backfill_batch(connection, after_id, args.batch_size, args.rebuild)
+                if not result:
+                    break
+                after_id, count = result
+                total += count
+                time.sleep(args.pause)
+        finally:
+            connection.close()
+        print(f'Shard {shard.shard_id}: done (last id {after_id})')
+
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] excerpts stored for {total} notes "
+          f"elapsed={time.time() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
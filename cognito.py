@@ -0,0 +1,221 @@
+"""
+Cognito token service for Note-Taking App
+Turns the authorization code from the hosted UI into verified ID token
+claims (auth.cognito_callback):
+
+    claims = get_token_service().exchange_code(code, redirect_uri)
+
+Each worker keeps one requests session, so logins reuse keep-alive
+connections to the token endpoint instead of a TLS handshake apiece. Calls
+time out after COGNITO_HTTP_TIMEOUT seconds and are retried
+COGNITO_HTTP_RETRIES times: GETs on connection errors and 5xx, the token
+POST only when the connection failed (an authorization code can be used
+once, so a POST the IdP may have seen is not sent again).
+
+ID tokens are verified locally: RS256 signature against the user pool's
+JWKS, issuer, audience (COGNITO_CLIENT_ID), expiry, token_use and at_hash.
+The JWKS is fetched once and kept for COGNITO_JWKS_MAX_AGE seconds. A
+token signed with a key id it does not know (Cognito rotated its keys)
+refreshes it early, at most once per JWKS_MIN_REFRESH seconds, so tokens
+with made-up key ids cannot turn into a fetch per login. Threads that need
+a refresh at the same time wait for one fetch; if it fails, keys already
+known keep working.
+
+COGNITO_DOMAIN may be a full URL and COGNITO_ISSUER overrides the user
+pool's issuer, which points the whole login flow at a local stand-in IdP
+(see scripts/bench_cognito_login.py).
+"""
+import os
+import time
+import threading
+
+COGNITO_REGION = os.getenv('AWS_REGION', 'us-east-1')
+COGNITO_USER_POOL_ID = os.getenv('COGNITO_USER_POOL_ID', '')
+COGNITO_CLIENT_ID = os.getenv('COGNITO_CLIENT_ID', '')
+COGNITO_CLIENT_SECRET = os.getenv('COGNITO_CLIENT_SECRET', '')
+COGNITO_DOMAIN = os.getenv('COGNITO_DOMAIN', '')
+
+# Check if Cognito is configured
+COGNITO_ENABLED = bool(COGNITO_USER_POOL_ID and COGNITO_CLIENT_ID and COGNITO_DOMAIN)
+
+# "auth.example.com" is served over HTTPS; a full URL is used as given
+COGNITO_BASE_URL = (COGNITO_DOMAIN if '://' in COGNITO_DOMAIN else f'https://{COGNITO_DOMAIN}').rstrip('/')
+COGNITO_ISSUER = (os.getenv('COGNITO_ISSUER') or
+                  f'https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}').rstrip('/')
+
+COGNITO_HTTP_TIMEOUT = float(os.getenv('COGNITO_HTTP_TIMEOUT', 5))
+COGNITO_HTTP_RETRIES = int(os.getenv('COGNITO_HTTP_RETRIES', 2))
+COGNITO_JWKS_MAX_AGE = int(os.getenv('COGNITO_JWKS_MAX_AGE', 86400))
+JWKS_MIN_REFRESH = 30
+# Clock skew allowed on exp / iat (seconds)
+TOKEN_LEEWAY = 30
+HTTP_POOL_SIZE = 16
+
+
+class TokenError(Exception):
+    """The code could not be exchanged or the ID token is not valid."""
+
+
+class TokenService:
+    """Token endpoint client and ID token verifier for one user pool."""
+
+    def __init__(self, base_url=COGNITO_BASE_URL, issuer=COGNITO_ISSUER, client_id=COGNITO_CLIENT_ID,
+                 client_secret=COGNITO_CLIENT_SECRET, timeout=COGNITO_HTTP_TIMEOUT,
+                 retries=COGNITO_HTTP_RETRIES, jwks_max_age=COGNITO_JWKS_MAX_AGE,
+                 jwks_min_refresh=JWKS_MIN_REFRESH):
+        self.token_url = f'{base_url}/oauth2/token'
+        self.jwks_url = f'{issuer}/.well-known/jwks.json'
+        self.issuer = issuer
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.retries = retries
+        self.jwks_max_age = jwks_max_age
+        self.jwks_min_refresh = jwks_min_refresh
+        # Counted for the benchmark
+        self.jwks_fetches = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the session and keys; connection pools must not be shared across fork."""
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._keys = {}
+        self._keys_fetched_at = None
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The keep-alive requests session, created on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.retry import Retry
+
+                    # Connection errors are retried for every method, read
+                    # errors and 5xx answers only for GET
+                    retry = Retry(
+                        total=self.retries, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504),
+                        allowed_methods=frozenset({'GET'}), raise_on_status=False
+                    )
+                    session = requests.Session()
+                    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=HTTP_POOL_SIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def exchange_code(self, code, redirect_uri):
+        """Exchange an authorization code; returns the verified ID token's claims."""
+        import requests
+
+        try:
+            response = self.session.post(self.token_url, data={
+                'grant_type': 'authorization_code',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'code': code,
+                'redirect_uri': redirect_uri
+            }, timeout=self.timeout)
+            if response.status_code != 200:
+                raise TokenError(f'Token exchange failed ({response.status_code})')
+            tokens = response.json()
+        except requests.RequestException as e:
+            raise TokenError(f'Token endpoint unreachable: {e}') from e
+        except ValueError as e:
+            raise TokenError('Token endpoint sent invalid JSON') from e
+        if not tokens.get('id_token'):
+            raise TokenError('No ID token in the token response')
+        return self.verify(tokens['id_token'], access_token=tokens.get('access_token'))
+
+    def verify(self, id_token, access_token=None):
+        """Claims of a valid ID token; TokenError otherwise."""
+        from jose import jwt, JWTError
+
+        try:
+            header = jwt.get_unverified_header(id_token)
+            claims = jwt.decode(
+                id_token, self._key(header.get('kid')), algorithms=['RS256'], audience=self.client_id,
+                issuer=self.issuer, access_token=access_token, options={'leeway': TOKEN_LEEWAY}
+            )
+        except JWTError as e:
+            raise TokenError(f'Invalid ID token: {e}') from e
+        if claims.get('token_use') != 'id':
+            raise TokenError('Not an ID token')
+        return claims
+
+    # =========================================================================
+    # JWKS
+    # =========================================================================
+    def _fresh(self):
+        return (self._keys_fetched_at is not None and
+                time.monotonic() - self._keys_fetched_at < self.jwks_max_age)
+
+    def _key(self, kid):
+        """The public key for kid, refreshing the JWKS when it is stale or
+        does not have kid."""
+        key = self._keys.get(kid)
+        if key is not None and self._fresh():
+            return key
+        with self._refresh_lock:
+            # Another thread may have refreshed while this one waited
+            key = self._keys.get(kid)
+            if key is not None and self._fresh():
+                return key
+            fetched_at = self._keys_fetched_at
+            if fetched_at is None or time.monotonic() - fetched_at >= self.jwks_min_refresh:
+                try:
+                    self._fetch_keys()
+                except TokenError as e:
+                    if key is None:
+                        raise
+                    print(f"JWKS refresh failed, using cached keys: {e}")
+        key = self._keys.get(kid)
+        if key is None:
+            raise TokenError(f'Unknown signing key {kid!r}')
+        return key
+
+    def _fetch_keys(self):
+        import requests
+        from jose import jwk, JOSEError
+
+        try:
+            response = self.session.get(self.jwks_url, timeout=self.timeout)
+            response.raise_for_status()
+            keys = {
+                k['kid']: jwk.construct(k, k.get('alg', 'RS256'))
+                for k in response.json().get('keys', []) if k.get('use', 'sig') == 'sig'
+            }
+        except (requests.RequestException, ValueError, KeyError, JOSEError) as e:
+            raise TokenError(f'JWKS fetch failed: {e}') from e
+        self._keys = keys
+        self._keys_fetched_at = time.monotonic()
+        self.jwks_fetches += 1
+
+    def warm(self):
+        """Fetch the JWKS (and open a connection) before the first login."""
+        with self._refresh_lock:
+            if not self._fresh():
+                self._fetch_keys()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_token_service():
+    """The TokenService for the configured user pool."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TokenService()
+    return _service
+
+
+def reset_after_fork():
+    """Each gunicorn worker opens its own connections."""
+    if _service is not None:
+        _service.reset()
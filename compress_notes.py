@@ -0,0 +1,121 @@
+"""
+Note body compression migration for Note-Taking App
+Rewrites existing notes so large bodies are stored compressed (or, with
+--decompress, back as plain text) using the settings in note_store.py.
+
+Safe to run while the app is serving: rows are processed in small id-ordered
+batches, each locked with SELECT ... FOR UPDATE until it commits, so an edit
+to one of them waits for the batch instead of being overwritten by it.
+
+    python compress_notes.py --batch-size 500
+    python compress_notes.py --decompress     # before turning compression off
+"""
+import sys
+import time
+import argparse
+
+from db import shards
+from note_store import encode_content, decode_note, NOTE_COMPRESS_MIN_BYTES, NOTE_COMPRESSION
+
+
+def migrate_batch(connection, after_id, batch_size, decompress=False, dry_run=False):
+    """Process one batch of notes with id > after_id.
+
+    Returns (last_id, rows_seen, rows_rewritten, bytes_before, bytes_after),
+    or None when there are no more rows.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        if decompress:
+            where = 'content_z IS NOT NULL'
+            params = (after_id, batch_size)
+        else:
+            where = 'content_z IS NULL AND LENGTH(content) >= %s'
+            params = (after_id, NOTE_COMPRESS_MIN_BYTES, batch_size)
+        cursor.execute(
+            f'''SELECT id, content, content_z FROM notes
+                WHERE id > %s AND {where} ORDER BY id LIMIT %s FOR UPDATE''',
+            params
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            connection.rollback()
+            return None
+
+        rewritten = bytes_before = bytes_after = 0
+        for row in rows:
+            stored = len(row['content_z']) if row['content_z'] is not None else len(row['content'].encode('utf-8'))
+            text = decode_note(row)['content']
+            if decompress:
+                content, content_z, content_size = text, None, None
+            else:
+                content, content_z, content_size = encode_content(text)
+                if content_z is None:
+                    continue
+            bytes_before += stored
+            bytes_after += len(content_z) if content_z is not None else len(content.encode('utf-8'))
+            rewritten += 1
+            if dry_run:
+                continue
+            # updated_at = updated_at: a storage change is not an edit
+            cursor.execute(
+                '''UPDATE notes SET content = %s, content_z = %s, content_size = %s, updated_at = updated_at
+                   WHERE id = %s''',
+                (content, content_z, content_size, row['id'])
+            )
+        connection.commit()
+        return rows[-1]['id'], len(rows), rewritten, bytes_before, bytes_after
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compress (or decompress) stored note bodies.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.05,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--decompress', action='store_true',
+                        help='store every body as plain text again')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report savings without writing')
+    args = parser.parse_args()
+
+    if NOTE_COMPRESSION == 'off' and not args.decompress:
+        print('NOTE_COMPRESSION is off; nothing to compress (use --decompress to undo).')
+        return 0
+
+    started = time.time()
+    totals = [0, 0, 0, 0]
+    failed = False
+    for shard in shards:
+        connection = shard.connect()
+        if not connection:
+            print(f'Error: database connection failed (shard {shard.shard_id}).')
+            failed = True
+            continue
+        after_id = 0
+        try:
+            while True:
+                result = migrate_batch(connection, after_id, args.batch_size, args.decompress, args.dry_run)
+                if not result:
+                    break
+                after_id = result[0]
+                totals = [t + r for t, r in zip(totals, result[1:])]
+                time.sleep(args.pause)
+        finally:
+            connection.close()
+        print(f'Shard {shard.shard_id}: done (last id {after_id})')
+
+    seen, rewritten, before, after = totals
+    action = 'decompressed' if args.decompress else 'compressed'
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {action}{' (dry run)' if args.dry_run else ''}: "
+          f"{rewritten}/{seen} notes, {before / 1024:.0f}KB -> {after / 1024:.0f}KB "
+          f"elapsed={time.time() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+Database connection layer for Note-Taking App
+Routes each user to their shard, sends writes to the shard primary and
+read-only handlers to healthy replicas
+"""
+import os
+import time
+import random
+import threading
+
+import mysql.connector
+from mysql.connector import Error
+from flask import session, request, has_request_context
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Database configuration
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASSWORD', ''),
+    'database': os.getenv('DB_NAME', 'notes_db'),
+    'port': int(os.getenv('DB_PORT', 3306))
+}
+
+# Read replicas (optional): DB_REPLICA_HOSTS=10.0.0.11:3306,10.0.0.12
+# The monitoring account needs REPLICATION CLIENT (REPLICA MONITOR on 10.5+).
+DB_REPLICA_HOSTS = os.getenv('DB_REPLICA_HOSTS', '')
+REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 10))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', 2))
+
+# Sharding (optional): DB_SHARDS=db0.internal:3306,db1.internal:3306/notes_db
+# Shard i may list its own replicas in DB_SHARD_<i>_REPLICAS. The directory
+# (user -> shard, share token -> owner, cognito_sub -> user) lives on
+# DB_DIRECTORY_HOST, or on shard 0 when unset.
+DB_SHARDS = os.getenv('DB_SHARDS', '')
+DB_DIRECTORY_HOST = os.getenv('DB_DIRECTORY_HOST', '')
+ROUTE_CACHE_TTL = float(os.getenv('DB_ROUTE_CACHE_TTL', 30))
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Fail fast when a primary is slow to accept connections, and stop trying
+# for DB_BREAKER_COOLDOWN seconds after DB_BREAKER_FAILURES failures in a row
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 5))
+DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', 5))
+DB_BREAKER_COOLDOWN = float(os.getenv('DB_BREAKER_COOLDOWN', 10))
+
+
+class DatabaseUnavailable(Error):
+    """Raised instead of connecting while a shard's circuit breaker is open."""
+
+    def __init__(self, msg, retry_after):
+        super().__init__(msg=msg)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Per-worker circuit breaker for one database primary.
+
+    closed:    connections are attempted; DB_BREAKER_FAILURES consecutive
+               failures open the breaker
+    open:      check() raises DatabaseUnavailable at once for
+               DB_BREAKER_COOLDOWN seconds
+    half-open: after the cooldown one request at a time probes the
+               database; success closes the breaker, failure reopens it
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.opened_at is None:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.time()
+            waited = now - self.opened_at
+            # A probe that never reported back frees the slot after a cooldown
+            probing = self.probe_started is not None and now - self.probe_started < DB_BREAKER_COOLDOWN
+            if waited < DB_BREAKER_COOLDOWN or probing:
+                raise DatabaseUnavailable(f'{self.name}: circuit open',
+                                          max(DB_BREAKER_COOLDOWN - waited, 1))
+            self.probe_started = now
+
+    def success(self):
+        if self.failures == 0 and self.opened_at is None:
+            return
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"Database {self.name} is reachable again; circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.opened_at is not None or self.failures >= DB_BREAKER_FAILURES:
+                if self.opened_at is None:
+                    print(f"Database {self.name} failed {self.failures} times; circuit open "
+                          f"for {DB_BREAKER_COOLDOWN:.0f}s")
+                self.opened_at = time.time()
+
+
+class Replica:
+    """A read replica with a cached health and replication lag reading."""
+
+    def __init__(self, config):
+        self.config = config
+        self.healthy = False
+        self.lag = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return f"{self.config['host']}:{self.config['port']}"
+
+    def refresh(self):
+        """Re-check health if the last reading is older than the check interval.
+
+        Only one thread checks at a time; others keep using the last reading.
+        """
+        if time.time() - self.checked_at < REPLICA_CHECK_INTERVAL:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.check()
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """Read replication status; a stopped or broken replica is unhealthy."""
+        healthy, lag = False, None
+        connection = None
+        try:
+            connection = mysql.connector.connect(
+                **self.config, auth_plugin='mysql_native_password',
+                connection_timeout=REPLICA_CONNECT_TIMEOUT
+            )
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute('SHOW SLAVE STATUS')
+            status = cursor.fetchone()
+            cursor.close()
+            if status:
+                running = status.get('Slave_IO_Running') == 'Yes' and status.get('Slave_SQL_Running') == 'Yes'
+                lag = status.get('Seconds_Behind_Master')
+                healthy = running and lag is not None
+        except Error as e:
+            print(f"Replica {self.name} health check failed: {e}")
+        finally:
+            if connection:
+                connection.close()
+        self.healthy, self.lag, self.checked_at = healthy, lag, time.time()
+
+    def is_fresh_enough(self, since_write):
+        """Whether this replica has applied everything older than `since_write` seconds."""
+        if not self.healthy or self.lag is None or self.lag > REPLICA_MAX_LAG:
+            return False
+        # The reading is up to REPLICA_CHECK_INTERVAL old and the replica may
+        # have fallen behind since; Seconds_Behind_Master has one-second resolution
+        lag_now = self.lag + (time.time() - self.checked_at)
+        return lag_now + 1 < since_write
+
+    def connect(self):
+        try:
+            return mysql.connector.connect(
+                **self.config, auth_plugin='mysql_native_password',
+                connection_timeout=REPLICA_CONNECT_TIMEOUT
+            )
+        except Error as e:
+            print(f"Error connecting to replica {self.name}: {e}")
+            self.healthy = False
+            return None
+
+
+def _parse_endpoint(entry, base):
+    """Parse "host[:port][/database]" into a connection config based on `base`."""
+    address, _, database = entry.strip().partition('/')
+    host, _, port = address.partition(':')
+    return dict(base, host=host, port=int(port or base['port']), database=database or base['database'])
+
+
+def _parse_replicas(hosts, primary):
+    replicas = []
+    for entry in filter(None, (h.strip() for h in hosts.split(','))):
+        config = _parse_endpoint(entry, primary)
+        config['user'] = os.getenv('DB_REPLICA_USER', primary['user'])
+        config['password'] = os.getenv('DB_REPLICA_PASSWORD', primary['password'])
+        replicas.append(Replica(config))
+    return replicas
+
+
+class Backend:
+    """One database shard: a primary plus optional read replicas."""
+
+    def __init__(self, shard_id, config, replicas=()):
+        self.shard_id = shard_id
+        self.config = config
+        self.replicas = list(replicas)
+        self.breaker = CircuitBreaker(f'shard {shard_id}')
+
+    def connect_replica(self):
+        since_write = seconds_since_last_write()
+        for replica in self.replicas:
+            replica.refresh()
+        candidates = [r for r in self.replicas if r.is_fresh_enough(since_write)]
+        random.shuffle(candidates)
+        for replica in candidates:
+            connection = replica.connect()
+            if connection:
+                return connection
+        return None
+
+    def connect(self, read_only=False):
+        if read_only and self.replicas:
+            connection = self.connect_replica()
+            if connection:
+                return connection
+        self.breaker.check()
+        try:
+            # Explicitly set auth_plugin for MariaDB compatibility
+            connection = mysql.connector.connect(**self.config, auth_plugin='mysql_native_password',
+                                                 connection_timeout=DB_CONNECT_TIMEOUT)
+        except Error as e:
+            print(f"Error connecting to MariaDB (shard {self.shard_id}): {e}")
+            self.breaker.failure()
+            return None
+        self.breaker.success()
+        return connection
+
+
+def _build_shards():
+    entries = [e for e in DB_SHARDS.split(',') if e.strip()]
+    if not entries:
+        return [Backend(0, DB_CONFIG, _parse_replicas(DB_REPLICA_HOSTS, DB_CONFIG))]
+    shards = []
+    for shard_id, entry in enumerate(entries):
+        config = _parse_endpoint(entry, DB_CONFIG)
+        default_replicas = DB_REPLICA_HOSTS if shard_id == 0 else ''
+        hosts = os.getenv(f'DB_SHARD_{shard_id}_REPLICAS', default_replicas)
+        shards.append(Backend(shard_id, config, _parse_replicas(hosts, config)))
+    return shards
+
+
+shards = _build_shards()
+SHARDING_ENABLED = len(shards) > 1
+directory = Backend('directory', _parse_endpoint(DB_DIRECTORY_HOST, DB_CONFIG)) if DB_DIRECTORY_HOST else shards[0]
+
+
+def seconds_since_last_write():
+    """Seconds since this session's last mutation (infinite outside a request)."""
+    if not has_request_context():
+        return float('inf')
+    last_write = session.get('last_write_at')
+    return time.time() - last_write if last_write else float('inf')
+
+
+def record_write(response):
+    """after_request hook: remember when this session last changed data.
+
+    Reads after a write are only routed to replicas that are known to have
+    caught up past that moment (read-your-writes).
+    """
+    if request.method not in SAFE_METHODS and response.status_code < 400 and 'user_id' in session:
+        session['last_write_at'] = time.time()
+    return response
+
+
+# =============================================================================
+# SHARD DIRECTORY
+# =============================================================================
+_route_cache = {}
+_route_lock = threading.Lock()
+
+
+def reset_after_fork():
+    """Drop state inherited from the gunicorn master (preload_app).
+
+    Locks may have been held mid-check at fork time and cached routes may be
+    stale by the time the worker serves traffic.
+    """
+    global _route_lock
+    _route_cache.clear()
+    _route_lock = threading.Lock()
+    for shard in list(shards) + [directory]:
+        shard.breaker = CircuitBreaker(shard.breaker.name)
+        for replica in shard.replicas:
+            replica._lock = threading.Lock()
+            replica.checked_at = 0.0
+
+
+def get_directory_connection():
+    """Connection to the global directory database."""
+    return directory.connect()
+
+
+def _directory_query(sql, params, fetch=True):
+    connection = get_directory_connection()
+    if not connection:
+        raise Error('Directory database unavailable')
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        if fetch:
+            return cursor.fetchone()
+        connection.commit()
+        return cursor.lastrowid
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def route_user(user_id):
+    """Return (shard, is_moving) for a user, cached for DB_ROUTE_CACHE_TTL seconds."""
+    if not SHARDING_ENABLED or user_id is None:
+        return shards[0], False
+    now = time.time()
+    cached = _route_cache.get(user_id)
+    if cached and cached[2] > now:
+        return shards[cached[0]], cached[1]
+
+    row = _directory_query('SELECT shard_id, is_moving FROM user_directory WHERE user_id = %s', (user_id,))
+    shard_id, moving = (row['shard_id'], bool(row['is_moving'])) if row else (0, False)
+    with _route_lock:
+        if len(_route_cache) > 100000:
+            _route_cache.clear()
+        _route_cache[user_id] = (shard_id, moving, now + ROUTE_CACHE_TTL)
+    return shards[shard_id], moving
+
+
+def allocate_user_id(cognito_sub=None):
+    """Reserve a globally unique user id and place the user on a shard.
+
+    Returns None when sharding is off, so `INSERT INTO users (id, ...)
+    VALUES (NULL, ...)` falls back to the table's AUTO_INCREMENT.
+    """
+    if not SHARDING_ENABLED:
+        return None
+    shard_id = random.randrange(len(shards))
+    return _directory_query(
+        'INSERT INTO user_directory (shard_id, cognito_sub) VALUES (%s, %s)',
+        (shard_id, cognito_sub), fetch=False
+    )
+
+
+def find_user_id_by_cognito_sub(cognito_sub):
+    """Look up a user id by Cognito subject (directory when sharded)."""
+    if SHARDING_ENABLED:
+        row = _directory_query('SELECT user_id FROM user_directory WHERE cognito_sub = %s', (cognito_sub,))
+    else:
+        row = _directory_query('SELECT id AS user_id FROM users WHERE cognito_sub = %s', (cognito_sub,))
+    return row['user_id'] if row else None
+
+
+def register_cognito_sub(user_id, cognito_sub):
+    """Record a guest's new Cognito subject in the directory."""
+    if SHARDING_ENABLED:
+        _directory_query('UPDATE user_directory SET cognito_sub = %s WHERE user_id = %s',
+                         (cognito_sub, user_id), fetch=False)
+
+
+def register_share_token(share_token, user_id, note_id):
+    """Record which user owns a share token so /shared/<token> can be routed."""
+    if SHARDING_ENABLED:
+        _directory_query(
+            'INSERT INTO share_directory (share_token, user_id, note_id) VALUES (%s, %s, %s) '
+            'ON DUPLICATE KEY UPDATE user_id = VALUES(user_id), note_id = VALUES(note_id)',
+            (share_token, user_id, note_id), fetch=False
+        )
+
+
+def find_share_owner(share_token):
+    """Owner of a share token; None when unknown or when sharding is off."""
+    if not SHARDING_ENABLED:
+        return None
+    row = _directory_query('SELECT user_id FROM share_directory WHERE share_token = %s', (share_token,))
+    return row['user_id'] if row else None
+
+
+def forget_users(user_ids):
+    """Drop deleted users (and their share tokens) from the directory."""
+    if not SHARDING_ENABLED or not user_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(user_ids))
+    _directory_query(f'DELETE FROM share_directory WHERE user_id IN ({placeholders})', list(user_ids), fetch=False)
+    _directory_query(f'DELETE FROM user_directory WHERE user_id IN ({placeholders})', list(user_ids), fetch=False)
+
+
+def get_db_connection(read_only=False, user_id=None):
+    """Create and return a database connection for a user's shard.
+
+    `user_id` defaults to the logged-in user. With read_only=True the
+    connection may come from a replica that is healthy, within
+    DB_REPLICA_MAX_LAG, and fresh enough for this session's last write;
+    otherwise (and as fallback) it comes from the shard primary. Writes are
+    refused while the user is being moved between shards. Raises
+    DatabaseUnavailable while the primary's circuit breaker is open.
+    """
+    if user_id is None and has_request_context():
+        user_id = session.get('user_id')
+    try:
+        shard, moving = route_user(user_id)
+    except DatabaseUnavailable:
+        raise
+    except Error as e:
+        print(f"Error resolving shard for user {user_id}: {e}")
+        return None
+    if moving and not read_only:
+        print(f"User {user_id} is being moved between shards; refusing write connection")
+        return None
+    return shard.connect(read_only=read_only)
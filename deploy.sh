@@ -56,6 +56,10 @@ echo ""
 bash "${SCRIPTS_DIR}/07_setup_backup.sh"
 echo ""
 
+# Step 8: Guest Reaper
+bash "${SCRIPTS_DIR}/08_setup_reaper.sh"
+echo ""
+
 echo "====================================================="
 echo "  Deployment Complete!"
 echo "====================================================="
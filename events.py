@@ -0,0 +1,311 @@
+"""
+Live note updates for Note-Taking App
+Every change to a user's notes is recorded in note_events, inside the
+transaction that made it (record_event). Open dashboards subscribe to
+GET /api/events (server-sent events) and patch their note cards as events
+arrive, so other tabs and devices stay current without reloading.
+
+Each worker runs one bus thread while it has subscribers. The thread polls
+note_events for just those users every EVENTS_POLL_SECONDS, on every shard,
+and fans events out to the worker's streams; a request that recorded an
+event wakes its own worker's bus at once. The database is the broker, so
+events reach every worker and host without extra infrastructure.
+
+Event ids are AUTO_INCREMENT values, which can commit out of order, so the
+bus re-reads the last EVENTS_SETTLE_SECONDS of events and drops repeats.
+A reconnecting stream sends Last-Event-ID and is replayed what it missed.
+
+A stream holds a Gunicorn thread for up to EVENTS_STREAM_SECONDS (then
+the browser reconnects), so streams are served by their own Gunicorn
+instance, notes-events.service (GUNICORN_ROLE=events: EVENTS_WORKERS x
+EVENTS_THREADS threads), which nginx sends /api/events to. Each worker
+serves at most EVENTS_MAX_STREAMS at once, so the whole site serves
+EVENTS_WORKERS x EVENTS_MAX_STREAMS open dashboards (one per tab). Where
+the app workers serve streams themselves (no events service), each keeps
+half of its GUNICORN_THREADS for requests: GUNICORN_WORKERS x
+GUNICORN_THREADS / 2 streams in all. A stream over the limit gets a 503
+and the page retries with backoff. Events are kept for EVENTS_KEEP_HOURS.
+"""
+import os
+import json
+import time
+import queue
+import threading
+
+from flask import g, has_app_context
+
+from db import route_user
+
+EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', 'true').lower() == 'true'
+EVENTS_POLL_SECONDS = float(os.getenv('EVENTS_POLL_SECONDS', 1))
+EVENTS_SETTLE_SECONDS = int(os.getenv('EVENTS_SETTLE_SECONDS', 10))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', 20))
+EVENTS_STREAM_SECONDS = float(os.getenv('EVENTS_STREAM_SECONDS', 300))
+# Streams hold a worker thread each: in the events service all but a few
+# (for the 503s), in app workers half of them
+if os.getenv('GUNICORN_ROLE') == 'events':
+    _default_streams = max(1, int(os.getenv('EVENTS_THREADS') or 256) - 4)
+else:
+    _default_streams = max(1, int(os.getenv('GUNICORN_THREADS') or 4) // 2)
+EVENTS_MAX_STREAMS = int(os.getenv('EVENTS_MAX_STREAMS') or _default_streams)
+EVENTS_KEEP_HOURS = int(os.getenv('EVENTS_KEEP_HOURS', 24))
+EVENTS_PRUNE_SECONDS = 600
+EVENTS_REPLAY_LIMIT = 200
+EVENTS_QUEUE_SIZE = 200
+
+# Event kinds: a note was created or changed, a note was deleted, or
+# something the cards cannot be patched for (categories, imports) changed
+SAVED = 'saved'
+DELETED = 'deleted'
+RELOAD = 'reload'
+
+
+def record_event(cursor, user_id, kind, note_id=None):
+    """Record a change in the caller's transaction (before it commits)."""
+    if not EVENTS_ENABLED:
+        return
+    cursor.execute(
+        'INSERT INTO note_events (user_id, note_id, kind) VALUES (%s, %s, %s)',
+        (user_id, note_id, kind)
+    )
+    if has_app_context():
+        # Woken after the response, once the transaction is committed
+        g.events_recorded = True
+
+
+def format_event(event):
+    data = json.dumps({'note_id': event['note_id']})
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {data}\n\n"
+
+
+def load_events(connection, user_id, after_id, limit=EVENTS_REPLAY_LIMIT):
+    """A user's events after after_id, oldest first."""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            '''SELECT id, user_id, note_id, kind FROM note_events
+               WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s''',
+            (user_id, after_id, limit)
+        )
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def replay_events(connection, user_id, after_id):
+    """Events a reconnecting stream missed; None when not all of them are kept."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT COALESCE(MIN(id), 0) FROM note_events')
+        oldest = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if oldest > after_id + 1:
+        return None
+    events = load_events(connection, user_id, after_id, EVENTS_REPLAY_LIMIT + 1)
+    return events if len(events) <= EVENTS_REPLAY_LIMIT else None
+
+
+def last_event_id(connection, user_id):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM note_events WHERE user_id = %s', (user_id,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def purge_events(connection, keep_hours=EVENTS_KEEP_HOURS, batch_size=5000):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            'DELETE FROM note_events WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT %s',
+            (keep_hours, batch_size)
+        )
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+# =============================================================================
+# BUS
+# =============================================================================
+class Subscription:
+    """One open stream's queue of events."""
+
+    def __init__(self, user_id, after_id):
+        self.user_id = user_id
+        self.after_id = after_id
+        self.events = queue.Queue(EVENTS_QUEUE_SIZE)
+        self.delivered = set()
+        # Set when the stream fell too far behind; it then asks for a reload
+        self.overflowed = False
+
+    def put(self, event):
+        if event['id'] <= self.after_id or event['id'] in self.delivered:
+            return
+        self.delivered.add(event['id'])
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class EventBus:
+    """Per-worker fan-out from note_events to open streams."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._wake = threading.Event()
+        self._thread = None
+        # shard id -> [floor id, ids above the floor already delivered]
+        self._cursors = {}
+        self._next_prune = 0.0
+
+    def subscribe(self, user_id, after_id):
+        """Register a stream, or None when this worker has no stream left."""
+        subscription = Subscription(user_id, after_id)
+        with self._lock:
+            if sum(len(subs) for subs in self._subscribers.values()) >= EVENTS_MAX_STREAMS:
+                return None
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscribers.get(subscription.user_id)
+            if subs:
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscribers[subscription.user_id]
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(EVENTS_POLL_SECONDS)
+            self._wake.clear()
+            with self._lock:
+                users = list(self._subscribers)
+                if not users:
+                    self._thread = None
+                    return
+            try:
+                self._poll(users)
+            except Exception as e:
+                print(f"Event bus poll failed: {e}")
+                time.sleep(EVENTS_POLL_SECONDS)
+
+    def _poll(self, users):
+        by_shard = {}
+        for user_id in users:
+            shard = route_user(user_id)[0]
+            by_shard.setdefault(shard.shard_id, (shard, []))[1].append(user_id)
+        prune = time.monotonic() >= self._next_prune
+        if prune:
+            self._next_prune = time.monotonic() + EVENTS_PRUNE_SECONDS
+
+        for shard_id, (shard, user_ids) in by_shard.items():
+            connection = shard.connect()
+            if not connection:
+                continue
+            try:
+                for event in self._fetch(connection, shard_id, user_ids):
+                    with self._lock:
+                        subs = list(self._subscribers.get(event['user_id'], ()))
+                    for subscription in subs:
+                        subscription.put(event)
+                if prune:
+                    purge_events(connection)
+            finally:
+                connection.close()
+
+    def _fetch(self, connection, shard_id, user_ids):
+        """New events for user_ids, re-reading ones that may not have settled."""
+        cursor = connection.cursor(dictionary=True)
+        try:
+            if shard_id not in self._cursors:
+                cursor.execute(
+                    'SELECT COALESCE(MAX(id), 0) AS id FROM note_events WHERE created_at < NOW() - INTERVAL %s SECOND',
+                    (EVENTS_SETTLE_SECONDS,)
+                )
+                self._cursors[shard_id] = [cursor.fetchone()['id'], set()]
+            floor, seen = self._cursors[shard_id]
+            placeholders = ', '.join(['%s'] * len(user_ids))
+            cursor.execute(
+                f'''SELECT id, user_id, note_id, kind,
+                           created_at < NOW() - INTERVAL %s SECOND AS settled
+                    FROM note_events WHERE id > %s AND user_id IN ({placeholders}) ORDER BY id''',
+                [EVENTS_SETTLE_SECONDS, floor, *user_ids]
+            )
+            rows = cursor.fetchall()
+            # Commits are over for settled events; nothing below them can still appear
+            settled = [row['id'] for row in rows if row['settled']]
+            if settled:
+                floor = max(settled)
+                seen = {event_id for event_id in seen if event_id > floor}
+            fresh = [row for row in rows if row['id'] not in seen]
+            seen.update(row['id'] for row in fresh)
+            self._cursors[shard_id] = [floor, seen]
+            connection.commit()
+            return fresh
+        finally:
+            cursor.close()
+
+
+_bus = EventBus()
+
+
+def get_bus():
+    return _bus
+
+
+def reset_after_fork():
+    """Each gunicorn worker starts its own bus thread."""
+    global _bus
+    _bus = EventBus()
+
+
+def stream(subscription, replay):
+    """SSE body: the replayed events, then live ones until the stream times out.
+
+    replay=None means events were missed that can no longer be replayed.
+    """
+    bus = get_bus()
+    try:
+        yield f'retry: {int(EVENTS_POLL_SECONDS * 3000)}\n\n'
+        if replay is None:
+            yield f'event: {RELOAD}\ndata: {{}}\n\n'
+            return
+        for event in replay:
+            subscription.put(event)
+        deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                event = subscription.events.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                # Keeps proxies from timing out and notices closed connections
+                yield ': keepalive\n\n'
+                continue
+            if subscription.overflowed:
+                yield f'event: {RELOAD}\ndata: {{}}\n\n'
+                return
+            yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def init_app(app):
+    """Wake this worker's bus as soon as a request has recorded an event."""
+    @app.after_request
+    def wake_event_bus(response):
+        if g.pop('events_recorded', False):
+            get_bus().wake()
+        return response
@@ -0,0 +1,61 @@
+"""
+Template fragment cache for Note-Taking App
+A Jinja extension that keeps the rendered HTML of a template block, so
+pages built from many similar pieces (the dashboard's note cards) only
+render the pieces that changed:
+
+    {% cache note.user_id, note.id, note.version, note.updated_at %}
+        ... card markup ...
+    {% endcache %}
+
+The key is the listed values plus the template name and a hash of the
+block's own markup, so editing the template invalidates its entries. List
+everything the block shows: a value left out of the key is served stale.
+Entries live in a per-worker LRU bounded by FRAGMENT_CACHE_ENTRIES and
+FRAGMENT_CACHE_BYTES; FRAGMENT_CACHE_ENTRIES=0 turns caching off.
+"""
+import os
+import hashlib
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from rendering import BlockCache
+
+FRAGMENT_CACHE_ENTRIES = int(os.getenv('FRAGMENT_CACHE_ENTRIES', 20000))
+FRAGMENT_CACHE_BYTES = int(os.getenv('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+
+fragment_cache = BlockCache(FRAGMENT_CACHE_ENTRIES, FRAGMENT_CACHE_BYTES)
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key, ... %} ... {% endcache %}"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        # The parsed block's repr changes whenever its markup does
+        version = hashlib.sha1(f'{parser.name}:{body!r}'.encode('utf-8')).hexdigest()[:16]
+        call = self.call_method('_render', [nodes.Const(version), nodes.Tuple(key, 'load')])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, version, key, caller):
+        if not FRAGMENT_CACHE_ENTRIES:
+            return caller()
+        key = (version, *key)
+        html = fragment_cache.get(key)
+        if html is None:
+            html = Markup(caller())
+            fragment_cache.put(key, html)
+        return html
+
+
+def init_app(app):
+    """Enable {% cache %} in the app's templates."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,153 @@
+"""
+Guest reaper for Note-Taking App
+Deletes guest accounts that have been inactive longer than a TTL, together
+with their categories, notes, attachments and uploaded files.
+
+Run via cron (see scripts/08_setup_reaper.sh):
+    python guest_reaper.py --ttl-hours 168 --batch-size 200
+"""
+import os
+import sys
+import time
+import argparse
+
+from app import delete_files_from_storage, storage_key_from_url
+from db import shards, forget_users
+
+GUEST_TTL_HOURS = int(os.getenv('GUEST_TTL_HOURS', 168))
+REAPER_BATCH_SIZE = int(os.getenv('GUEST_REAPER_BATCH_SIZE', 200))
+
+
+def reap_batch(connection, ttl_hours, batch_size, dry_run=False):
+    """Delete one batch of expired guests in a single short transaction.
+
+    Returns a dict of reclaimed row counts and the storage keys of files
+    that belonged to the deleted guests.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        connection.start_transaction()
+        # Lock the batch so a guest that signs up mid-run is not deleted
+        cursor.execute(
+            '''SELECT id, avatar_url FROM users
+               WHERE is_guest = TRUE AND last_seen_at < NOW() - INTERVAL %s HOUR
+               ORDER BY last_seen_at LIMIT %s FOR UPDATE''',
+            (ttl_hours, batch_size)
+        )
+        guests = cursor.fetchall()
+        if not guests:
+            connection.rollback()
+            return None
+
+        ids = [g['id'] for g in guests]
+        placeholders = ', '.join(['%s'] * len(ids))
+
+        cursor.execute(
+            f'''SELECT a.s3_key FROM attachments a JOIN notes n ON a.note_id = n.id
+                WHERE n.user_id IN ({placeholders})''',
+            ids
+        )
+        attachment_keys = [row['s3_key'] for row in cursor.fetchall()]
+        avatar_keys = [k for k in (storage_key_from_url(g['avatar_url']) for g in guests) if k]
+
+        cursor.execute(f'SELECT COUNT(*) AS count FROM notes WHERE user_id IN ({placeholders})', ids)
+        notes = cursor.fetchone()['count']
+        cursor.execute(f'SELECT COUNT(*) AS count FROM categories WHERE user_id IN ({placeholders})', ids)
+        categories = cursor.fetchone()['count']
+
+        if dry_run:
+            connection.rollback()
+        else:
+            # Categories, notes and attachments go with the user (ON DELETE CASCADE)
+            cursor.execute(f'DELETE FROM users WHERE id IN ({placeholders})', ids)
+            connection.commit()
+
+        return {
+            'ids': ids,
+            'users': len(ids),
+            'notes': notes,
+            'categories': categories,
+            'attachments': len(attachment_keys),
+            'files': attachment_keys + avatar_keys
+        }
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def write_metrics(path, totals, elapsed):
+    """Write totals in Prometheus textfile-collector format."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        for name in ('users', 'notes', 'categories', 'attachments', 'files'):
+            f.write(f'notes_app_guest_reaper_{name}_reclaimed {totals[name]}\n')
+        f.write(f'notes_app_guest_reaper_duration_seconds {elapsed:.3f}\n')
+        f.write(f'notes_app_guest_reaper_last_run_timestamp {int(time.time())}\n')
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete inactive guest accounts.')
+    parser.add_argument('--ttl-hours', type=int, default=GUEST_TTL_HOURS,
+                        help='delete guests not seen for this many hours')
+    parser.add_argument('--batch-size', type=int, default=REAPER_BATCH_SIZE,
+                        help='guests deleted per transaction')
+    parser.add_argument('--max-batches', type=int, default=0,
+                        help='stop after this many batches (0 = until done)')
+    parser.add_argument('--pause', type=float, default=0.1,
+                        help='seconds to sleep between batches')
+    parser.add_argument('--metrics-file', default=os.getenv('GUEST_REAPER_METRICS_FILE', ''),
+                        help='write Prometheus textfile metrics here')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be deleted without deleting')
+    args = parser.parse_args()
+
+    started = time.time()
+    totals = {'users': 0, 'notes': 0, 'categories': 0, 'attachments': 0, 'files': 0}
+    batches = 0
+    failed = False
+    for shard in shards:
+        connection = shard.connect()
+        if not connection:
+            print(f'Error: database connection failed (shard {shard.shard_id}).')
+            failed = True
+            continue
+
+        shard_batches = 0
+        try:
+            while not args.max_batches or shard_batches < args.max_batches:
+                result = reap_batch(connection, args.ttl_hours, args.batch_size, args.dry_run)
+                if not result:
+                    break
+                shard_batches += 1
+
+                # Files and directory entries are removed only after the rows are gone for good
+                if not args.dry_run:
+                    forget_users(result['ids'])
+                    delete_files_from_storage(result['files'])
+
+                for name in ('users', 'notes', 'categories', 'attachments'):
+                    totals[name] += result[name]
+                totals['files'] += len(result['files'])
+
+                if args.dry_run:
+                    break
+                time.sleep(args.pause)
+        finally:
+            connection.close()
+        batches += shard_batches
+
+    elapsed = time.time() - started
+    summary = ' '.join(f'{name}={count}' for name, count in totals.items())
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] guest reaper{' (dry run)' if args.dry_run else ''}: "
+          f"{summary} batches={batches} elapsed={elapsed:.2f}s")
+
+    if args.metrics_file:
+        write_metrics(args.metrics_file, totals, elapsed)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
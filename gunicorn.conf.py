@@ -0,0 +1,111 @@
+"""
+Gunicorn configuration for Note-Taking App
+Used by notes-app.service: gunicorn -c gunicorn.conf.py app:app
+
+The app is loaded once in the master (preload_app) so imports, templates and
+module-level setup are shared copy-on-write between workers. Anything that
+holds sockets or locks is rebuilt per worker in post_fork, and each worker
+warms up before it accepts connections.
+
+Every setting can be overridden from the environment (see .env.example).
+
+GUNICORN_ROLE=events (notes-events.service) runs a second instance that nginx
+sends only /api/events to: one worker with EVENTS_THREADS threads, so
+long-lived live-update streams never take the app workers' request threads.
+"""
+import os
+import multiprocessing
+
+cpu_count = multiprocessing.cpu_count()
+
+
+def env_int(name, default):
+    # Empty values in .env mean "use the default"
+    return int(os.getenv(name) or default)
+
+
+role = os.getenv('GUNICORN_ROLE', 'app')
+
+# Requests mostly wait on MariaDB, S3 and Cognito, so a few threads per
+# worker serve more requests per MB than extra processes would.
+worker_class = 'gthread'
+if role == 'events':
+    # An idle stream is a thread blocked on a queue: cheap, so many per
+    # worker. One worker means one event bus polling the database.
+    bind = os.getenv('EVENTS_BIND', '127.0.0.1:5001')
+    workers = env_int('EVENTS_WORKERS', 1)
+    threads = env_int('EVENTS_THREADS', 256)
+else:
+    bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
+    workers = env_int('GUNICORN_WORKERS', max(2, cpu_count))
+    threads = env_int('GUNICORN_THREADS', 4)
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers periodically to contain slow leaks; jitter keeps them from
+# all restarting at the same moment.
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 200)
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+# nginx keeps upstream connections open to 127.0.0.1
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Rebuild clients inherited from the master process."""
+    import db
+    import cognito
+    import events
+    import ratelimit
+    import render_pool
+    import storage
+
+    db.reset_after_fork()
+    ratelimit.reset_after_fork()
+    events.reset_after_fork()
+    storage.reset_after_fork()
+    cognito.reset_after_fork()
+    render_pool.reset_after_fork()
+
+
+def post_worker_init(worker):
+    """Warm the worker before it starts accepting connections."""
+    if role == 'events':
+        # Streams only touch the database; no render helpers or S3 client
+        return
+    import app as notes_app
+
+    try:
+        notes_app.warmup()
+    except Exception as e:
+        # A cold worker is better than no worker
+        worker.log.warning(f"Worker warmup failed: {e}")
+
+
+def when_ready(server):
+    # markdown, bleach, boto3 (storage.py), requests / jose (cognito.py) and
+    # numpy (related.py) are imported lazily; with preload_app, load them once
+    # here so workers share the pages instead of importing per worker
+    if preload_app:
+        import cognito
+        import related
+        import storage
+        import markdown  # noqa: F401
+        import bleach  # noqa: F401
+        if storage.STORAGE_BACKEND == 's3':
+            import boto3  # noqa: F401
+        if cognito.COGNITO_ENABLED:
+            import requests  # noqa: F401
+            import jose.jwt  # noqa: F401
+        if related.RELATED_ENABLED:
+            import numpy  # noqa: F401
+    server.log.info(
+        f"Serving {role} with {workers} {worker_class} workers x {threads} threads "
+        f"(preload={preload_app}, max_requests={max_requests}+{max_requests_jitter})"
+    )
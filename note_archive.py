@@ -0,0 +1,157 @@
+"""
+Cold tier for archived notes
+Notes archived for longer than NOTE_ARCHIVE_AFTER_DAYS have their body and
+card excerpt moved out of the hot notes table into note_archive, packed with
+note_store.pack_text (compressed when that pays off). The notes row stays,
+with is_cold = TRUE, an empty body and content_size kept for stats, so ids,
+foreign keys, listings, stats and share links keep working. Archived bodies
+stop taking up buffer-pool pages and full-text index entries that active
+listings and searches walk.
+
+Reads that need a body fill cold ones in from note_archive (fill_cold).
+Anything that changes a note, including unarchiving it, first moves the
+body back (warm_note). archive_notes.py moves notes to the cold tier in
+small batches (cron).
+"""
+import os
+
+from note_store import encode_content, decode_note, decompress, pack_text
+
+NOTE_ARCHIVE_AFTER_DAYS = int(os.getenv('NOTE_ARCHIVE_AFTER_DAYS', 30))
+# Smaller bodies are stored plain (compression would not pay off)
+NOTE_ARCHIVE_COMPRESS_MIN_BYTES = int(os.getenv('NOTE_ARCHIVE_COMPRESS_MIN_BYTES', 64))
+FILL_BATCH = 500
+
+
+def fill_cold(connection, notes):
+    """Load the body (and excerpt, if selected) of cold rows from note_archive.
+
+    Rows need their id and is_cold; other rows are left alone.
+    """
+    cold = {note['id']: note for note in notes if note.get('is_cold')}
+    if not cold:
+        return notes
+    cursor = connection.cursor(dictionary=True)
+    try:
+        ids = list(cold)
+        for start in range(0, len(ids), FILL_BATCH):
+            batch = ids[start:start + FILL_BATCH]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(
+                f'SELECT note_id, body, excerpt_html FROM note_archive WHERE note_id IN ({placeholders})',
+                batch
+            )
+            for row in cursor.fetchall():
+                note = cold[row['note_id']]
+                note.pop('content_z', None)
+                note['content'] = decompress(row['body'])
+                if 'excerpt_html' in note:
+                    note['excerpt_html'] = row['excerpt_html']
+    finally:
+        cursor.close()
+    return notes
+
+
+def warm_note(connection, note_id, user_id):
+    """Move a cold note's body back into notes, in the caller's transaction.
+
+    Returns True if the note was cold. Not an edit: version and updated_at
+    are left alone.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            '''SELECT a.body, a.excerpt_html FROM note_archive a
+               JOIN notes n ON n.id = a.note_id
+               WHERE a.note_id = %s AND n.user_id = %s FOR UPDATE''',
+            (note_id, user_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return False
+        content, content_z, content_size = encode_content(decompress(row['body']))
+        cursor.execute(
+            '''UPDATE notes SET content = %s, content_z = %s, content_size = %s, excerpt_html = %s,
+                                is_cold = FALSE, updated_at = updated_at
+               WHERE id = %s''',
+            (content, content_z, content_size, row['excerpt_html'], note_id)
+        )
+        cursor.execute('DELETE FROM note_archive WHERE note_id = %s', (note_id,))
+        return True
+    finally:
+        cursor.close()
+
+
+def cool_batch(connection, batch_size, after_days=NOTE_ARCHIVE_AFTER_DAYS, user_id=None, dry_run=False):
+    """Move one batch of notes archived more than after_days ago to note_archive.
+
+    Returns (rows_moved, bytes_before, bytes_after), or None when nothing is
+    left to move.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        # Archiving touches updated_at, so it is the archive date until the next edit
+        where = 'AND user_id = %s' if user_id is not None else ''
+        params = [after_days] + ([user_id] if user_id is not None else []) + [batch_size]
+        cursor.execute(
+            f'''SELECT id, content, content_z, excerpt_html FROM notes
+                WHERE is_archived = TRUE AND is_cold = FALSE
+                  AND updated_at < NOW() - INTERVAL %s DAY {where}
+                ORDER BY id LIMIT %s FOR UPDATE''',
+            params
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            connection.rollback()
+            return None
+
+        bytes_before = bytes_after = 0
+        for row in rows:
+            bytes_before += (len(row['content_z']) if row['content_z'] is not None
+                             else len(row['content'].encode('utf-8'))) + len((row['excerpt_html'] or '').encode('utf-8'))
+            text = decode_note(row)['content']
+            body = pack_text(text, NOTE_ARCHIVE_COMPRESS_MIN_BYTES)
+            bytes_after += len(body)
+            if dry_run:
+                continue
+            cursor.execute(
+                '''INSERT INTO note_archive (note_id, body, excerpt_html) VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE body = VALUES(body), excerpt_html = VALUES(excerpt_html)''',
+                (row['id'], body, row['excerpt_html'])
+            )
+            cursor.execute(
+                '''UPDATE notes SET content = '', content_z = NULL, content_size = %s, excerpt_html = NULL,
+                                    is_cold = TRUE, updated_at = updated_at
+                   WHERE id = %s''',
+                (len(text.encode('utf-8')), row['id'])
+            )
+        if dry_run:
+            connection.rollback()
+        else:
+            connection.commit()
+        return len(rows), bytes_before, bytes_after
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def warm_batch(connection, batch_size):
+    """Move one batch of cold notes back (e.g. before dropping the tier).
+
+    Returns the number of notes warmed, 0 when none are left.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute('SELECT id, user_id FROM notes WHERE is_cold = TRUE ORDER BY id LIMIT %s', (batch_size,))
+        rows = cursor.fetchall()
+        for row in rows:
+            warm_note(connection, row['id'], row['user_id'])
+        connection.commit()
+        return len(rows)
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,96 @@
+"""
+Note body storage for Note-Taking App
+Bodies above a size threshold are stored compressed in notes.content_z
+(MEDIUMBLOB) with notes.content left empty; everything that reads or writes
+note bodies goes through this module so callers always see plain text.
+
+content_z format: one marker byte followed by the payload
+    b'z' - zlib
+    b's' - zstd (needs the zstandard package)
+    b'p' - plain UTF-8 (only in pack_text() blobs, e.g. note_revisions.body)
+"""
+import os
+import zlib
+
+# NOTE_COMPRESSION: zlib, zstd or off (off still reads compressed rows)
+NOTE_COMPRESSION = os.getenv('NOTE_COMPRESSION', 'zlib').lower()
+NOTE_COMPRESS_MIN_BYTES = int(os.getenv('NOTE_COMPRESS_MIN_BYTES', 4096))
+ZLIB_LEVEL = int(os.getenv('NOTE_ZLIB_LEVEL', 6))
+ZSTD_LEVEL = int(os.getenv('NOTE_ZSTD_LEVEL', 3))
+
+MARKER_ZLIB = b'z'
+MARKER_ZSTD = b's'
+MARKER_PLAIN = b'p'
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if NOTE_COMPRESSION == 'zstd' and zstandard is None:
+    print("\u26a0\ufe0f NOTE_COMPRESSION=zstd but zstandard is not installed; using zlib")
+    NOTE_COMPRESSION = 'zlib'
+
+
+def compress(data):
+    """Compress UTF-8 bytes with the configured codec; returns marker + payload."""
+    if NOTE_COMPRESSION == 'zstd':
+        return MARKER_ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return MARKER_ZLIB + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(blob):
+    blob = bytes(blob)
+    marker, payload = blob[:1], blob[1:]
+    if marker == MARKER_PLAIN:
+        return payload.decode('utf-8')
+    if marker == MARKER_ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if marker == MARKER_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('Note body is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(payload).decode('utf-8')
+    raise ValueError(f'Unknown note body format {marker!r}')
+
+
+def encode_content(text):
+    """Return (content, content_z, content_size) column values for a note body.
+
+    Bodies under NOTE_COMPRESS_MIN_BYTES, or that do not shrink, stay plain.
+    """
+    data = text.encode('utf-8')
+    if NOTE_COMPRESSION != 'off' and len(data) >= NOTE_COMPRESS_MIN_BYTES:
+        blob = compress(data)
+        if len(blob) < len(data):
+            return '', blob, len(data)
+    return text, None, None
+
+
+def pack_text(text, min_bytes=NOTE_COMPRESS_MIN_BYTES):
+    """Encode text as a single blob, compressed when that pays off."""
+    data = text.encode('utf-8')
+    if NOTE_COMPRESSION != 'off' and len(data) >= min_bytes:
+        blob = compress(data)
+        if len(blob) < len(data):
+            return blob
+    return MARKER_PLAIN + data
+
+
+def decode_note(note):
+    """Replace a row's stored body with plain text in note['content']."""
+    blob = note.pop('content_z', None)
+    if blob is not None:
+        note['content'] = decompress(blob)
+    return note
+
+
+def decode_notes(notes):
+    for note in notes:
+        decode_note(note)
+    return notes
+
+
+def matches_search(note, term):
+    """Post-filter for rows whose body SQL could not search (compressed)."""
+    term = term.lower()
+    return term in (note.get('title') or '').lower() or term in note['content'].lower()
@@ -0,0 +1,433 @@
+"""
+On-demand request profiling for Note-Taking App
+A sampling profiler for finding where a slow request spends its time in
+production. A request is profiled when either
+    - profiling is armed for the next N requests matching a route (endpoint
+      name such as "index", or a path prefix such as "/api/import") and/or a
+      user id: POST /api/admin/profile, or `python profiler.py arm`
+    - it carries a signed X-Profile header (`python profiler.py token`,
+      or POST /api/admin/profile/token), which profiles just that request
+
+While a request is profiled, a helper thread samples its stack every
+PROFILE_INTERVAL_MS and the result is written to PROFILE_DIR as speedscope
+JSON (open at https://www.speedscope.app) or collapsed stacks (for
+flamegraph.pl / inferno). The response carries the file name in
+X-Profile-File. Streamed response bodies are not included.
+
+When nothing is armed the cost per request is a clock comparison and a
+header lookup; workers re-read the shared arm file at most once per
+PROFILE_POLL_SECONDS. The admin endpoints are limited to ADMIN_EMAILS.
+"""
+import os
+import sys
+import json
+import hmac
+import time
+import hashlib
+import argparse
+import itertools
+import threading
+from collections import defaultdict
+
+from flask import Blueprint, request, session, jsonify, g, send_from_directory
+
+from auth import admin_required
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(APP_DIR, 'profiles')
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+PROFILE_POLL_SECONDS = float(os.getenv('PROFILE_POLL_SECONDS', 1))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'speedscope')
+
+FORMATS = {'speedscope': '.speedscope.json', 'collapsed': '.collapsed.txt'}
+HEADER = 'X-Profile'
+MAX_ARM_COUNT = 100
+MAX_TOKEN_TTL = 3600
+
+ARM_FILE = os.path.join(PROFILE_DIR, 'armed.json')
+LOCK_FILE = os.path.join(PROFILE_DIR, 'armed.lock')
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) concurrent workers may overshoot the count
+    fcntl = None
+
+# Per-process file name suffix
+_sequence = itertools.count(1)
+
+profiler_bp = Blueprint('profiler', __name__, url_prefix='/api/admin/profile')
+
+
+# =============================================================================
+# SAMPLER
+# =============================================================================
+class Sampler(threading.Thread):
+    """Samples one thread's stack until stopped."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        # root-to-leaf stack -> [samples, seconds]
+        self.stacks = defaultdict(lambda: [0, 0.0])
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.done = threading.Event()
+
+    def run(self):
+        last = self.started
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            entry = self.stacks[tuple(reversed(stack))]
+            entry[0] += 1
+            # Sampling can run late under GIL contention; weight by real time
+            entry[1] += now - last
+            last = now
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.elapsed = time.perf_counter() - self.started
+
+
+def _short_path(filename):
+    if filename.startswith(APP_DIR + os.sep):
+        return os.path.relpath(filename, APP_DIR)
+    return os.path.join(*filename.split(os.sep)[-2:]) if os.sep in filename else filename
+
+
+def to_collapsed(sampler):
+    """One "frame;frame;frame count" line per distinct stack."""
+    lines = []
+    for stack, (count, _) in sorted(sampler.stacks.items()):
+        frames = ';'.join(f'{name} ({_short_path(file)}:{line})'.replace(';', ',') for name, file, line in stack)
+        lines.append(f'{frames} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def to_speedscope(sampler, name):
+    """speedscope's "sampled" file format, weighted in milliseconds."""
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, (_, seconds) in sampler.stacks.items():
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': _short_path(frame[1]), 'line': frame[2]})
+            ids.append(index[frame])
+        samples.append(ids)
+        weights.append(round(seconds * 1000, 3))
+    return json.dumps({
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'notes-app profiler',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled', 'name': name, 'unit': 'milliseconds',
+            'startValue': 0, 'endValue': round(sum(weights), 3),
+            'samples': samples, 'weights': weights,
+        }],
+    })
+
+
+def save_profile(sampler, fmt, title, slug):
+    """Write a finished profile to PROFILE_DIR; returns the file name."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in slug)[:80]
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{os.getpid()}-{next(_sequence)}{FORMATS[fmt]}"
+    data = to_speedscope(sampler, title) if fmt == 'speedscope' else to_collapsed(sampler)
+    with open(os.path.join(PROFILE_DIR, name), 'w') as f:
+        f.write(data)
+    prune_profiles()
+    return name
+
+
+def list_profiles():
+    """Profile files, newest first."""
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.endswith(tuple(FORMATS.values()))]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
+
+
+def prune_profiles():
+    for name in list_profiles()[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+# =============================================================================
+# ARMING (shared by all workers through ARM_FILE)
+# =============================================================================
+class _ArmLock:
+    def __enter__(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+
+
+def read_arm():
+    """The armed request filter, or None when disarmed, used up or expired."""
+    try:
+        with open(ARM_FILE) as f:
+            arm = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if arm.get('remaining', 0) <= 0 or arm.get('expires_at', 0) < time.time():
+        return None
+    return arm
+
+
+def _write_arm(arm):
+    tmp = f'{ARM_FILE}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(arm, f)
+    os.replace(tmp, ARM_FILE)
+
+
+def arm(route=None, user_id=None, count=10, fmt=PROFILE_FORMAT, ttl=3600):
+    """Profile the next `count` requests matching route and/or user_id."""
+    if fmt not in FORMATS:
+        raise ValueError(f'format must be one of: {", ".join(FORMATS)}')
+    if not 1 <= count <= MAX_ARM_COUNT:
+        raise ValueError(f'count must be between 1 and {MAX_ARM_COUNT}')
+    armed = {
+        'route': route or None,
+        'user_id': int(user_id) if user_id not in (None, '') else None,
+        'remaining': count,
+        'format': fmt,
+        'armed_at': time.time(),
+        'expires_at': time.time() + ttl,
+    }
+    with _ArmLock():
+        _write_arm(armed)
+    return armed
+
+
+def disarm():
+    with _ArmLock():
+        try:
+            os.remove(ARM_FILE)
+        except FileNotFoundError:
+            pass
+
+
+_cached_arm = None
+_next_poll = 0.0
+
+
+def _polled_arm():
+    """read_arm(), re-read at most every PROFILE_POLL_SECONDS per worker."""
+    global _cached_arm, _next_poll
+    now = time.monotonic()
+    if now >= _next_poll:
+        _next_poll = now + PROFILE_POLL_SECONDS
+        _cached_arm = read_arm()
+    return _cached_arm
+
+
+def _matches(armed):
+    route = armed.get('route')
+    if route and route != request.endpoint and not (route.startswith('/') and request.path.startswith(route)):
+        return False
+    user_id = armed.get('user_id')
+    return user_id is None or session.get('user_id') == user_id
+
+
+def _claim():
+    """Take one of the armed profiles; the format to use, or None if used up."""
+    global _cached_arm
+    with _ArmLock():
+        armed = read_arm()
+        if not armed:
+            _cached_arm = None
+            return None
+        armed['remaining'] -= 1
+        _write_arm(armed)
+    _cached_arm = armed if armed['remaining'] > 0 else None
+    return armed['format']
+
+
+# =============================================================================
+# SIGNED HEADER
+# =============================================================================
+def make_token(ttl=300, fmt=PROFILE_FORMAT):
+    """X-Profile header value that profiles any single request for ttl seconds."""
+    if not PROFILE_SECRET:
+        raise ValueError('PROFILE_SECRET is not set')
+    payload = f'{int(time.time() + min(ttl, MAX_TOKEN_TTL))}.{fmt}'
+    signature = hmac.new(PROFILE_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return f'{payload}.{signature}'
+
+
+def check_token(token):
+    """The format a valid, unexpired token asks for, else None."""
+    if not PROFILE_SECRET:
+        return None
+    payload, _, signature = token.rpartition('.')
+    expected = hmac.new(PROFILE_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    expires, _, fmt = payload.partition('.')
+    if not expires.isdigit() or int(expires) < time.time() or fmt not in FORMATS:
+        return None
+    return fmt
+
+
+# =============================================================================
+# FLASK INTEGRATION
+# =============================================================================
+def start_profile():
+    token = request.headers.get(HEADER)
+    armed = _polled_arm()
+    if token is None and armed is None:
+        return
+    fmt = check_token(token) if token else None
+    if fmt is None and armed is not None and _matches(armed):
+        fmt = _claim()
+    if fmt is None:
+        return
+    g.profile_format = fmt
+    g.profiler = Sampler(threading.get_ident())
+    g.profiler.start()
+
+
+def finish_profile(response=None):
+    sampler = g.pop('profiler', None)
+    if sampler is None:
+        return None
+    sampler.stop()
+    status = response.status_code if response is not None else 500
+    label = f'{request.method} {request.path} {status} user {session.get("user_id", "-")}'
+    try:
+        name = save_profile(sampler, g.profile_format, label, f'{request.endpoint or "unknown"}-{status}')
+    except OSError as e:
+        print(f'Error saving profile: {e}')
+        return None
+    print(f'Profiled {label}: {sampler.elapsed * 1000:.0f}ms, '
+          f'{sum(c for c, _ in sampler.stacks.values())} samples -> {name}')
+    if response is not None:
+        response.headers['X-Profile-File'] = name
+    return name
+
+
+def init_app(app):
+    """Profile armed or signed requests."""
+    app.before_request(start_profile)
+
+    @app.after_request
+    def profile_response(response):
+        finish_profile(response)
+        return response
+
+    @app.teardown_request
+    def profile_teardown(exc):
+        # after_request does not run when the view raised
+        finish_profile()
+
+    app.register_blueprint(profiler_bp)
+
+
+@profiler_bp.route('', methods=['GET'])
+@admin_required
+def profile_status():
+    return jsonify({'armed': read_arm(), 'profiles': list_profiles(), 'header_enabled': bool(PROFILE_SECRET)})
+
+
+@profiler_bp.route('', methods=['POST'])
+@admin_required
+def profile_arm():
+    data = request.get_json(silent=True) or {}
+    try:
+        armed = arm(route=data.get('route'), user_id=data.get('user_id'), count=int(data.get('count', 10)),
+                    fmt=data.get('format', PROFILE_FORMAT), ttl=int(data.get('ttl', 3600)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'armed': armed})
+
+
+@profiler_bp.route('', methods=['DELETE'])
+@admin_required
+def profile_disarm():
+    disarm()
+    return jsonify({'armed': None})
+
+
+@profiler_bp.route('/token', methods=['POST'])
+@admin_required
+def profile_token():
+    data = request.get_json(silent=True) or {}
+    try:
+        token = make_token(int(data.get('ttl', 300)), data.get('format', PROFILE_FORMAT))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'header': HEADER, 'value': token})
+
+
+@profiler_bp.route('/<path:name>', methods=['GET'])
+@admin_required
+def profile_download(name):
+    if name not in list_profiles():
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+# =============================================================================
+# COMMAND LINE
+# =============================================================================
+def main():
+    parser = argparse.ArgumentParser(description='Arm request profiling or mint an X-Profile header.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    arm_parser = commands.add_parser('arm', help='profile the next matching requests')
+    arm_parser.add_argument('--route', help='endpoint name (e.g. index) or path prefix (e.g. /api/import)')
+    arm_parser.add_argument('--user', type=int, help='only requests by this user id')
+    arm_parser.add_argument('--count', type=int, default=10)
+    arm_parser.add_argument('--format', choices=sorted(FORMATS), default=PROFILE_FORMAT)
+    arm_parser.add_argument('--ttl', type=int, default=3600, help='give up after this many seconds')
+    commands.add_parser('disarm', help='stop profiling')
+    commands.add_parser('status', help='show what is armed and the saved profiles')
+    token_parser = commands.add_parser('token', help='print an X-Profile header for single requests')
+    token_parser.add_argument('--ttl', type=int, default=300)
+    token_parser.add_argument('--format', choices=sorted(FORMATS), default=PROFILE_FORMAT)
+    args = parser.parse_args()
+
+    if args.command == 'arm':
+        print(json.dumps(arm(args.route, args.user, args.count, args.format, args.ttl)))
+    elif args.command == 'disarm':
+        disarm()
+        print('Disarmed.')
+    elif args.command == 'status':
+        print(json.dumps({'armed': read_arm(), 'dir': PROFILE_DIR, 'profiles': list_profiles()[:20]}, indent=2))
+    else:
+        try:
+            print(f'{HEADER}: {make_token(args.ttl, args.format)}')
+        except ValueError as e:
+            print(f'Error: {e}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Admission control for Note-Taking App
+Turns overload into fast 429/503 responses instead of queued requests:
+    - token bucket rate limits per client IP and per user on every request,
+      plus tighter per-endpoint limits on expensive views (@limited)
+    - caps on how many expensive views run at once across all workers
+    - a 503 with Retry-After while a database circuit breaker is open
+      (see db.CircuitBreaker)
+
+Buckets live in a small memory-mapped file under /dev/shm shared by every
+Gunicorn worker on the host; concurrency slots are flock()ed lock files, so
+a slot is released even when its worker dies. Limits are "count/seconds"
+(e.g. "600/60": bursts of up to 600, refilled at 10 per second) and can be
+overridden from the environment; RATE_LIMIT_ENABLED=false turns it all off.
+"""
+import os
+import math
+import mmap
+import time
+import random
+import struct
+import hashlib
+import tempfile
+import threading
+import functools
+
+from flask import request, session, jsonify, Response
+
+from db import DatabaseUnavailable
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) limits are per worker process
+    fcntl = None
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+RATE_LIMIT_PREFIX = f'notes-app-{os.getuid() if hasattr(os, "getuid") else 0}'
+# Every request, before the endpoint's own limits
+RATE_LIMIT_IP = os.getenv('RATE_LIMIT_IP', '600/60')
+RATE_LIMIT_USER = os.getenv('RATE_LIMIT_USER', '300/60')
+
+# Bucket table: (key hash, tokens, last update) slots, open addressing
+BUCKET_SLOTS = 16384
+BUCKET = struct.Struct('<Qdd')
+PROBE_SLOTS = 8
+EXEMPT_ENDPOINTS = ('static', 'favicon')
+
+
+def parse_limit(value):
+    """"count/seconds" -> (capacity, tokens per second); None if disabled."""
+    if not value or value == '0':
+        return None
+    count, _, seconds = value.partition('/')
+    return float(count), float(count) / float(seconds or 1)
+
+
+# =============================================================================
+# SHARED STORE
+# =============================================================================
+class Buckets:
+    """Token buckets in a memory-mapped file shared by the host's workers."""
+
+    def __init__(self, path, slots=BUCKET_SLOTS):
+        self.slots = slots
+        size = slots * BUCKET.size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        # lockf excludes other processes, the thread lock other threads
+        self.lock = threading.Lock()
+
+    def take(self, key, limit, cost=1.0):
+        """Take cost tokens from key's bucket. Returns seconds to wait (0 = allowed)."""
+        capacity, per_second = limit
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        start = key_hash % self.slots
+        now = time.time()
+        with self.lock:
+            if fcntl:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                victim, victim_updated = None, float('inf')
+                for i in range(PROBE_SLOTS):
+                    offset = ((start + i) % self.slots) * BUCKET.size
+                    slot_hash, tokens, updated = BUCKET.unpack_from(self.map, offset)
+                    if slot_hash == key_hash:
+                        tokens = min(capacity, tokens + (now - updated) * per_second)
+                        break
+                    # Reuse an empty slot, else the one idle longest
+                    if updated < victim_updated:
+                        victim, victim_updated = offset, updated
+                else:
+                    offset, tokens = victim, capacity
+
+                wait = 0.0
+                if tokens >= cost:
+                    tokens -= cost
+                else:
+                    wait = (cost - tokens) / per_second
+                BUCKET.pack_into(self.map, offset, key_hash, tokens, now)
+            finally:
+                if fcntl:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        return wait
+
+
+class Slots:
+    """At most `count` holders at once across all workers."""
+
+    def __init__(self, name, count):
+        self.paths = [os.path.join(RATE_LIMIT_DIR, f'{RATE_LIMIT_PREFIX}-{name}.{i}.lock') for i in range(count)]
+        self.semaphore = threading.BoundedSemaphore(count)
+
+    def acquire(self):
+        """Return a handle for release(), or None when all slots are busy."""
+        if not fcntl:
+            return self if self.semaphore.acquire(blocking=False) else None
+        for path in random.sample(self.paths, len(self.paths)):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, handle):
+        if handle is self:
+            self.semaphore.release()
+            return
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        os.close(handle)
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    """The shared bucket table, opened on first use in each process."""
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                _buckets = Buckets(os.path.join(RATE_LIMIT_DIR, f'{RATE_LIMIT_PREFIX}-ratelimit'))
+    return _buckets
+
+
+def reset_after_fork():
+    """Each gunicorn worker maps the file itself and gets fresh locks."""
+    global _buckets, _buckets_lock
+    _buckets = None
+    _buckets_lock = threading.Lock()
+
+
+# =============================================================================
+# CHECKS
+# =============================================================================
+def client_ip():
+    # ProxyFix has already replaced remote_addr with the address nginx saw
+    return request.remote_addr or 'unknown'
+
+
+def reject(status, message, retry_after):
+    """Fast refusal: JSON for API calls, plain text for pages."""
+    retry_after = max(1, math.ceil(retry_after))
+    if request.path.startswith('/api/') or request.is_json:
+        response = jsonify({'error': message, 'retry_after': retry_after})
+    else:
+        response = Response(f'{message}. Please try again in {retry_after} seconds.\n', mimetype='text/plain')
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def check_limits(name, per_user=None, per_ip=None):
+    """Take a token from each applicable bucket; a 429 response if one is empty."""
+    buckets = get_buckets()
+    user_id = session.get('user_id')
+    wait = 0.0
+    if per_ip:
+        wait = max(wait, buckets.take(f'ip:{client_ip()}:{name}', per_ip))
+    if per_user and user_id is not None:
+        wait = max(wait, buckets.take(f'user:{user_id}:{name}', per_user))
+    if wait:
+        return reject(429, 'Too many requests', wait)
+    return None
+
+
+def limited(name, per_user=None, per_ip=None, concurrent=0):
+    """Decorator: endpoint rate limits plus a cap on simultaneous runs.
+
+    Defaults can be overridden with RATE_LIMIT_<NAME>_USER, _IP and
+    _CONCURRENT (e.g. RATE_LIMIT_IMPORT_USER=10/60).
+    """
+    prefix = f'RATE_LIMIT_{name.upper()}'
+    per_user = parse_limit(os.getenv(f'{prefix}_USER', per_user))
+    per_ip = parse_limit(os.getenv(f'{prefix}_IP', per_ip))
+    concurrent = int(os.getenv(f'{prefix}_CONCURRENT', concurrent))
+    slots = Slots(name, concurrent) if concurrent else None
+
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return f(*args, **kwargs)
+            denied = check_limits(name, per_user, per_ip)
+            if denied:
+                return denied
+            if slots is None:
+                return f(*args, **kwargs)
+            handle = slots.acquire()
+            if handle is None:
+                return reject(503, 'Server busy', 1)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                slots.release(handle)
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    """Apply the global per-IP / per-user limits and the circuit breaker's 503."""
+    per_ip = parse_limit(RATE_LIMIT_IP)
+    per_user = parse_limit(RATE_LIMIT_USER)
+
+    @app.before_request
+    def global_limits():
+        if not RATE_LIMIT_ENABLED or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        return check_limits('all', per_user, per_ip)
+
+    @app.errorhandler(DatabaseUnavailable)
+    def database_unavailable(e):
+        return reject(503, 'Database temporarily unavailable', e.retry_after)
@@ -0,0 +1,484 @@
+"""
+Related notes for Note-Taking App
+The note view lists the user's notes most similar to the one open
+(get_note_api). Nothing leaves the server: every note is a hashed TF-IDF
+vector over its title and body, and similarity is cosine.
+
+Per user, each worker keeps a NumPy matrix with one row per note and
+RELATED_DIMENSIONS columns. Words are hashed to a column and a sign
+(crc32), a row holds 1 + log(term frequency) per word, and title words
+count TITLE_WEIGHT more. IDF weights come from per-column document
+frequencies; they are applied at query time and only re-derived (cheaply,
+with no database access) when the note count drifts by REWEIGHT_DRIFT, so
+adding a note never rewrites the other rows. One query is one
+matrix-vector product over all rows plus a top-k selection.
+
+Indexes are loaded or built in a background thread on a user's first note
+view (the view shows no related notes until then), updated in place by the
+app's write paths, and evicted least-recently-used to stay under
+RELATED_MAX_BYTES. Built indexes are saved under RELATED_DIR as .npy files
+and memory-mapped copy-on-write when loaded, so workers share the pages
+and a restart does not re-read every note. A loaded or stale index catches
+up by comparing note (id, version) pairs with the database and
+re-vectorizing only what differs. The files are a per-host cache; deleting
+them is safe.
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import threading
+import importlib.util
+from collections import Counter, OrderedDict
+
+from db import get_db_connection
+from note_store import decode_note
+from search_index import tokenize, INDEX_MAX_CHARS, TITLE_WEIGHT
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# numpy is only imported when the first index is built or loaded
+RELATED_ENABLED = (os.getenv('RELATED_ENABLED', 'true').lower() == 'true' and
+                   importlib.util.find_spec('numpy') is not None)
+RELATED_DIMENSIONS = int(os.getenv('RELATED_DIMENSIONS', 512))
+RELATED_DIR = os.getenv('RELATED_DIR') or os.path.join(APP_DIR, 'related_index')
+RELATED_MAX_BYTES = int(os.getenv('RELATED_MAX_BYTES', 256 * 1024 * 1024))
+RELATED_REFRESH_SECONDS = float(os.getenv('RELATED_REFRESH_SECONDS', 10))
+RELATED_LIMIT = 5
+MIN_SCORE = 0.1
+REWEIGHT_DRIFT = 0.1
+# A catch-up touching this many notes saves a new snapshot
+SAVE_MIN_CHANGES = 50
+# More changed notes than this share of the index: rebuild instead
+REBUILD_SHARE = 0.5
+BATCH = 1000
+HASH_CACHE_ENTRIES = 200000
+
+
+# =============================================================================
+# FEATURES
+# =============================================================================
+_hashes = {}
+
+
+def _signed_columns(words, dimensions):
+    """column + 1, negated for a negative sign, per word (crc32, so every
+    process agrees)."""
+    cache = _hashes.setdefault(dimensions, {})
+    if len(cache) > HASH_CACHE_ENTRIES:
+        cache.clear()
+    signed = []
+    for word in words:
+        value = cache.get(word)
+        if value is None:
+            hashed = zlib.crc32(word.encode('utf-8'))
+            value = cache[word] = ((hashed >> 1) % dimensions + 1) * (1 if hashed & 1 else -1)
+        signed.append(value)
+    return signed
+
+
+def features(title, content, dimensions):
+    """A note's hashed term-frequency vector (float32, `dimensions` long)."""
+    import numpy as np
+
+    counts = Counter(tokenize((content or '')[:INDEX_MAX_CHARS]))
+    titled = set(tokenize(title or ''))
+    words = list(counts.keys() | titled)
+    if not words:
+        return np.zeros(dimensions, dtype=np.float32)
+    signed = np.array(_signed_columns(words, dimensions), dtype=np.int64)
+    tf = np.array([counts[word] for word in words], dtype=np.float32)
+    weights = np.log(tf, out=np.zeros_like(tf), where=tf > 0) + (tf > 0)
+    weights += TITLE_WEIGHT * np.array([word in titled for word in words])
+    vector = np.bincount(np.abs(signed) - 1, weights * np.sign(signed), minlength=dimensions)
+    return vector.astype(np.float32)
+
+
+# =============================================================================
+# PER-USER INDEX
+# =============================================================================
+class UserVectors:
+    """Hashed term-frequency rows for one user's notes, plus IDF weights."""
+
+    def __init__(self, dimensions=RELATED_DIMENSIONS, capacity=0):
+        import numpy as np
+
+        self.dimensions = dimensions
+        self.count = 0
+        self.matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.norms = np.zeros(capacity, dtype=np.float32)    # row norm under the IDF weights
+        self.df = np.zeros(dimensions, dtype=np.int64)       # notes with a non-zero column
+        self.idf = np.ones(dimensions, dtype=np.float32)
+        self.weighted_count = 0                              # notes the IDF was derived from
+        self.rows = {}                                       # note id -> row
+        self.changes = 0                                     # since loaded / saved
+        self.checked_at = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return self.matrix.nbytes + self.ids.nbytes * 3
+
+    def stamp(self):
+        """What the notes table should report for this user if the index is current."""
+        if not self.count:
+            return 0, 0, 0
+        return self.count, int(self.versions[:self.count].sum()), int(self.ids[:self.count].max())
+
+    def _grow(self, needed):
+        import numpy as np
+
+        capacity = max(needed, 64, len(self.ids) * 2)
+        for name in ('matrix', 'ids', 'versions', 'norms'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def _set_row(self, row, note_id, version, vector):
+        import numpy as np
+
+        self.matrix[row] = vector
+        self.df[np.flatnonzero(vector)] += 1
+        self.ids[row] = note_id
+        self.versions[row] = version
+        self.norms[row] = np.sqrt(np.dot(vector * vector, self.idf * self.idf))
+
+    def add(self, note_id, title, content, version):
+        row = self.rows.get(note_id)
+        if row is None:
+            if self.count == len(self.ids):
+                self._grow(self.count + 1)
+            row = self.rows[note_id] = self.count
+            self.count += 1
+        else:
+            self.df[self.matrix[row].nonzero()[0]] -= 1
+        self._set_row(row, note_id, version, features(title, content, self.dimensions))
+        self.changes += 1
+        self._maybe_reweight()
+
+    def remove(self, note_id):
+        """Drop a note; returns its version (None if it was not indexed)."""
+        row = self.rows.pop(note_id, None)
+        if row is None:
+            return None
+        version = int(self.versions[row])
+        self.df[self.matrix[row].nonzero()[0]] -= 1
+        last = self.count - 1
+        if row != last:
+            # Keep rows contiguous: the last one moves into the gap
+            for array in (self.matrix, self.ids, self.versions, self.norms):
+                array[row] = array[last]
+            self.rows[int(self.ids[row])] = row
+        self.matrix[last] = 0
+        self.count = last
+        self.changes += 1
+        self._maybe_reweight()
+        return version
+
+    def version(self, note_id):
+        row = self.rows.get(note_id)
+        return None if row is None else int(self.versions[row])
+
+    def _maybe_reweight(self):
+        if abs(self.count - self.weighted_count) > REWEIGHT_DRIFT * max(self.weighted_count, 100):
+            self.reweight()
+
+    def reweight(self):
+        """Derive IDF weights from the current document frequencies and
+        recompute the row norms under them."""
+        import numpy as np
+
+        self.idf = (np.log((1 + self.count) / (1 + self.df)) + 1).astype(np.float32)
+        squared = self.idf * self.idf
+        for start in range(0, self.count, BATCH * 10):
+            block = self.matrix[start:start + BATCH * 10]
+            self.norms[start:start + len(block)] = np.sqrt((block * block) @ squared)
+        self.weighted_count = self.count
+
+    def related(self, note_id, limit=RELATED_LIMIT, min_score=MIN_SCORE):
+        """[(note id, cosine similarity)] of the notes most like note_id."""
+        import numpy as np
+
+        row = self.rows.get(note_id)
+        if row is None or not self.norms[row] or self.count < 2:
+            return []
+        count = self.count
+        query = self.matrix[row] * (self.idf * self.idf)
+        scores = self.matrix[:count] @ query
+        norms = self.norms[:count] * self.norms[row]
+        np.divide(scores, norms, out=scores, where=norms > 0)
+        scores[norms == 0] = 0
+        scores[row] = -1
+        limit = min(limit, count - 1)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), round(float(scores[i]), 4)) for i in top if scores[i] >= min_score]
+
+    # =========================================================================
+    # SNAPSHOTS
+    # =========================================================================
+    ARRAYS = ('matrix', 'ids', 'versions', 'norms', 'df', 'idf')
+
+    def save(self, directory, user_id):
+        """Write the index under a new generation, then point the user's
+        meta file at it (atomic rename)."""
+        import numpy as np
+
+        os.makedirs(directory, exist_ok=True)
+        generation = uuid.uuid4().hex[:12]
+        # Room to add notes to the memory-mapped copy before it has to grow
+        capacity = self.count + max(64, self.count // 8)
+        arrays = {
+            'matrix': self.matrix[:self.count], 'ids': self.ids[:self.count],
+            'versions': self.versions[:self.count], 'norms': self.norms[:self.count],
+            'df': self.df, 'idf': self.idf
+        }
+        for name, array in arrays.items():
+            path = os.path.join(directory, f'u{user_id}.{generation}.{name}.npy')
+            if name in ('matrix', 'ids', 'versions', 'norms'):
+                out = np.lib.format.open_memmap(path, mode='w+', dtype=array.dtype,
+                                                shape=(capacity,) + array.shape[1:])
+                out[:self.count] = array
+                out.flush()
+                del out
+            else:
+                np.save(path, array)
+        meta = {'generation': generation, 'count': self.count, 'dimensions': self.dimensions,
+                'weighted_count': self.weighted_count}
+        meta_path = os.path.join(directory, f'u{user_id}.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        _remove_generations(directory, user_id, keep=generation)
+        self.changes = 0
+
+    @classmethod
+    def load(cls, directory, user_id, dimensions=RELATED_DIMENSIONS):
+        """The saved index, memory-mapped copy-on-write; None if there is none."""
+        import numpy as np
+
+        try:
+            with open(os.path.join(directory, f'u{user_id}.json')) as f:
+                meta = json.load(f)
+            if meta['dimensions'] != dimensions:
+                return None
+            index = cls(dimensions)
+            for name in cls.ARRAYS:
+                path = os.path.join(directory, f"u{user_id}.{meta['generation']}.{name}.npy")
+                setattr(index, name, np.load(path, mmap_mode='c'))
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Related notes snapshot for user {user_id} unreadable: {e}")
+            return None
+        index.count = meta['count']
+        index.weighted_count = meta['weighted_count']
+        index.rows = {int(note_id): row for row, note_id in enumerate(index.ids[:index.count])}
+        return index
+
+
+def _remove_generations(directory, user_id, keep):
+    """Delete a user's older snapshot files (open memory maps keep working)."""
+    prefix = f'u{user_id}.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.npy') and name.split('.')[1] != keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+# =============================================================================
+# INDEX CACHE
+# =============================================================================
+_indexes = OrderedDict()
+_lock = threading.Lock()
+_jobs = set()
+
+
+def _db_stamp(cursor, user_id):
+    cursor.execute(
+        '''SELECT COUNT(*) AS notes, COALESCE(SUM(version), 0) AS versions, COALESCE(MAX(id), 0) AS max_id
+           FROM notes WHERE user_id = %s''',
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    return int(row['notes']), int(row['versions']), int(row['max_id'])
+
+
+def _add_notes(index, cursor):
+    """Vectorize the notes a query selected, in batches."""
+    added = 0
+    while True:
+        notes = cursor.fetchmany(BATCH)
+        if not notes:
+            return added
+        with index.lock:
+            for note in notes:
+                # Cold (long-archived) notes have an empty body here, so only their title counts
+                decode_note(note)
+                index.add(note['id'], note['title'], note['content'], note['version'])
+        added += len(notes)
+
+
+def _build(cursor, user_id):
+    index = UserVectors()
+    cursor.execute('SELECT id, title, content, content_z, version FROM notes WHERE user_id = %s', (user_id,))
+    _add_notes(index, cursor)
+    index.reweight()
+    return index
+
+
+def _catch_up(cursor, index, user_id):
+    """Re-vectorize notes whose version differs from the database's and
+    drop deleted ones. Returns how many changed, or None if a rebuild is
+    cheaper."""
+    cursor.execute('SELECT id, version FROM notes WHERE user_id = %s', (user_id,))
+    current = {row['id']: row['version'] for row in cursor.fetchall()}
+    with index.lock:
+        deleted = [note_id for note_id in index.rows if note_id not in current]
+        changed = [note_id for note_id, version in current.items() if index.version(note_id) != version]
+    if len(changed) > REBUILD_SHARE * max(len(current), 1) and len(changed) > BATCH:
+        return None
+    with index.lock:
+        for note_id in deleted:
+            index.remove(note_id)
+    for start in range(0, len(changed), BATCH):
+        batch = changed[start:start + BATCH]
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(
+            f'''SELECT id, title, content, content_z, version FROM notes
+                WHERE user_id = %s AND id IN ({placeholders})''',
+            [user_id, *batch]
+        )
+        _add_notes(index, cursor)
+    return len(deleted) + len(changed)
+
+
+def _refresh(user_id, index):
+    """Background job: load (or build) the user's index, or bring a loaded
+    one up to date, then cache it."""
+    started = time.time()
+    connection = get_db_connection(read_only=True, user_id=user_id)
+    if not connection:
+        return
+    cursor = connection.cursor(dictionary=True)
+    try:
+        how = 'caught up'
+        if index is None:
+            index = UserVectors.load(RELATED_DIR, user_id)
+            how = 'loaded'
+        changed = None
+        if index is not None:
+            changed = _catch_up(cursor, index, user_id)
+        if changed is None:
+            index = _build(cursor, user_id)
+            how, changed = 'built', index.count
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+    index.checked_at = time.time()
+    if changed >= SAVE_MIN_CHANGES:
+        try:
+            with index.lock:
+                index.save(RELATED_DIR, user_id)
+        except OSError as e:
+            print(f"Related notes snapshot for user {user_id} not saved: {e}")
+    print(f"Related notes index {how} for user {user_id}: {index.count} notes, {changed} changed, "
+          f"{index.bytes / 1024:.0f}KB in {(time.time() - started) * 1000:.0f}ms")
+
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        _evict()
+
+
+def _run_refresh(user_id, index):
+    try:
+        _refresh(user_id, index)
+    except Exception as e:
+        print(f"Related notes index for user {user_id} failed: {e}")
+    finally:
+        with _lock:
+            _jobs.discard(user_id)
+
+
+def _schedule(user_id, index=None):
+    with _lock:
+        if user_id in _jobs:
+            return
+        _jobs.add(user_id)
+    threading.Thread(target=_run_refresh, args=(user_id, index), daemon=True,
+                     name=f'related-{user_id}').start()
+
+
+def _evict():
+    """Drop least recently used indexes until under budget (caller holds _lock)."""
+    total = sum(index.bytes for index in _indexes.values())
+    while len(_indexes) > 1 and total > RELATED_MAX_BYTES:
+        _, index = _indexes.popitem(last=False)
+        total -= index.bytes
+
+
+def related_notes(connection, user_id, note_id, limit=RELATED_LIMIT):
+    """[(note id, score)] like note_id, or None while the user's index is
+    being prepared."""
+    if not RELATED_ENABLED:
+        return None
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+    if index is None:
+        _schedule(user_id)
+        return None
+
+    if time.time() - index.checked_at >= RELATED_REFRESH_SECONDS:
+        index.checked_at = time.time()
+        cursor = connection.cursor(dictionary=True)
+        try:
+            stamp = _db_stamp(cursor, user_id)
+        finally:
+            cursor.close()
+        with index.lock:
+            current = index.stamp() == stamp
+        if not current:
+            # Answer from what is loaded; other workers' writes arrive shortly
+            _schedule(user_id, index)
+    with index.lock:
+        return index.related(note_id, limit)
+
+
+# =============================================================================
+# WRITE HOOKS (call after commit)
+# =============================================================================
+def _loaded(user_id):
+    with _lock:
+        return _indexes.get(user_id)
+
+
+def note_saved(user_id, note_id, title, content):
+    """A note was created or edited (its version went up by one)."""
+    index = _loaded(user_id)
+    if index is None:
+        return
+    with index.lock:
+        index.add(note_id, title, content, (index.version(note_id) or 0) + 1)
+
+
+def note_deleted(user_id, note_id):
+    index = _loaded(user_id)
+    if index is None:
+        return
+    with index.lock:
+        index.remove(note_id)
+
+
+def forget(user_id):
+    """Drop a user's index (bulk changes); the next view catches up from the snapshot."""
+    with _lock:
+        _indexes.pop(user_id, None)
@@ -0,0 +1,291 @@
+"""
+Isolated markdown rendering for Note-Taking App
+rendering.render_markdown sends documents that could be slow to render to
+a small pool of helper processes, so one huge or hostile note cannot pin a
+worker thread (and with it the GIL) for seconds. Each render takes one of
+these paths:
+
+    inline     small, ordinary documents: rendered in the request thread
+    pool       large ones (RENDER_INLINE_MAX_CHARS), many "[" (link parsing
+               is quadratic in unmatched brackets), big tables or deep
+               nesting: rendered in a helper process
+    timeout    the helper took longer than RENDER_TIMEOUT seconds; it is
+               killed and replaced
+    memory     the helper went over RENDER_MEMORY_MB; it is replaced
+    crashed    the helper died; it is replaced
+    busy       every helper stayed busy until the timeout
+    too_large  over RENDER_MAX_CHARS; not rendered at all
+    error      the renderer raised
+
+All but inline and pool return the text escaped in a <pre class="plain-text">,
+and a document that timed out or ran out of memory goes straight to that
+the next time. busy, crashed and error say nothing lasting about the
+document (TEMPORARY), so their fallback must not be cached or stored: the
+next render may well succeed. Counts and times per path are kept per worker (stats(),
+GET /api/admin/render-stats) and fallbacks are logged (the first time, for
+a document that failed before).
+
+Each gunicorn worker starts up to RENDER_PROCESSES helpers, forked from a
+server process that has markdown and bleach loaded. RENDER_PROCESSES=0
+renders everything inline, as before.
+"""
+import os
+import re
+import html
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    # Without resource (Windows) helpers have no memory limit
+    resource = None
+
+RENDER_PROCESSES = int(os.getenv('RENDER_PROCESSES', 2))
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', 5))
+RENDER_MEMORY_MB = int(os.getenv('RENDER_MEMORY_MB', 512))
+RENDER_INLINE_MAX_CHARS = int(os.getenv('RENDER_INLINE_MAX_CHARS', 16000))
+RENDER_MAX_CHARS = 2 * 1024 * 1024
+
+# Below these a document renders inline in well under 100ms
+INLINE_MAX_BRACKETS = 200
+INLINE_MAX_PIPES = 400
+DEEP_NESTING_RE = re.compile(r'^(?:[ \t]*>){16}|^[ \t]{64}', re.M)
+FAILED_CACHE_ENTRIES = 1024
+
+PATHS = ('inline', 'pool', 'timeout', 'memory', 'crashed', 'busy', 'too_large', 'error')
+TEMPORARY = ('busy', 'crashed', 'error')
+
+
+def needs_isolation(text):
+    """Cheap checks (linear scans in C) for documents that may render slowly."""
+    return (len(text) > RENDER_INLINE_MAX_CHARS or
+            text.count('[') > INLINE_MAX_BRACKETS or
+            text.count('|') > INLINE_MAX_PIPES or
+            DEEP_NESTING_RE.search(text) is not None)
+
+
+def plain_text(text):
+    """The fallback: the markdown source, escaped."""
+    return f'<pre class="plain-text">{html.escape(text)}</pre>'
+
+
+# =============================================================================
+# METRICS
+# =============================================================================
+_stats_lock = threading.Lock()
+_stats = {path: {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0} for path in PATHS}
+
+
+def _record(path, started, text, log=True):
+    elapsed = time.perf_counter() - started
+    with _stats_lock:
+        entry = _stats[path]
+        entry['count'] += 1
+        entry['seconds'] += elapsed
+        entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+    if log and path not in ('inline', 'pool'):
+        print(f"Render fell back to plain text ({path}, {len(text)} chars, {elapsed * 1000:.0f}ms)")
+
+
+def stats():
+    """Renders per path in this worker, with total and slowest time."""
+    with _stats_lock:
+        paths = {
+            path: {'count': entry['count'], 'avg_ms': round(entry['seconds'] * 1000 / entry['count'], 2)
+                   if entry['count'] else 0, 'max_ms': round(entry['max_seconds'] * 1000, 2)}
+            for path, entry in _stats.items()
+        }
+    return {'pid': os.getpid(), 'processes': RENDER_PROCESSES, 'paths': paths}
+
+
+# Hashes of documents that timed out or ran out of memory
+_failed = OrderedDict()
+_failed_lock = threading.Lock()
+
+
+def _text_hash(text):
+    return hashlib.sha1(text.encode('utf-8', 'surrogatepass')).digest()
+
+
+# =============================================================================
+# HELPER PROCESSES
+# =============================================================================
+def _serve(conn, memory_mb):
+    """Helper process: render each text received, send back (status, html)."""
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    import rendering
+
+    while True:
+        try:
+            text = conn.recv()
+        except (EOFError, OSError):
+            # The worker exited
+            return
+        try:
+            result = ('ok', rendering.render_html(text))
+        except MemoryError:
+            result = ('memory', None)
+        except RecursionError:
+            result = ('error', None)
+        except Exception as e:
+            result = ('error', repr(e)[:200])
+        conn.send(result)
+
+
+class _Helper:
+    """One helper process and the pipe to it."""
+
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, RENDER_MEMORY_MB), daemon=True,
+                                       name='render-helper')
+        self.process.start()
+        child.close()
+
+    def render(self, text, timeout):
+        """(status, html) with status ok, error, memory, timeout or crashed."""
+        try:
+            self.conn.send(text)
+            if not self.conn.poll(timeout):
+                return 'timeout', None
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return 'crashed', None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class RenderPool:
+    """Up to `processes` helpers, started on demand; a helper that timed out
+    or died is killed and started again on next use."""
+
+    def __init__(self, processes=RENDER_PROCESSES, timeout=RENDER_TIMEOUT):
+        self.processes = processes
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(processes)
+        self._context = None
+
+    def _get_context(self):
+        if self._context is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                # Forking this (threaded) worker directly is unsafe; the fork
+                # server is a clean process with the renderer imported once
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['markdown', 'bleach', 'rendering'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            self._context = context
+        return self._context
+
+    def _take(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _Helper(self._get_context())
+
+    def render(self, text):
+        """(path, html or None) for one document."""
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            return 'busy', None
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return 'busy', None
+            helper = self._take()
+            status, result = helper.render(text, remaining)
+            if status in ('timeout', 'memory', 'crashed'):
+                helper.kill()
+            else:
+                with self._lock:
+                    self._idle.append(helper)
+            if status == 'ok':
+                return 'pool', result
+            if status == 'error' and result:
+                print(f"Render helper error: {result}")
+            return status, None
+        finally:
+            self._slots.release()
+
+    def start(self):
+        """Start every helper now rather than on the first large render."""
+        helpers = []
+        with self._lock:
+            missing = self.processes - len(self._idle)
+        for _ in range(max(0, missing)):
+            helpers.append(_Helper(self._get_context()))
+        with self._lock:
+            self._idle.extend(helpers)
+
+    def forget(self):
+        """Drop helpers without touching them (they belong to another process)."""
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.processes)
+
+
+pool = RenderPool() if RENDER_PROCESSES > 0 else None
+
+
+# =============================================================================
+# RENDERING
+# =============================================================================
+def render(text, render_inline):
+    """(path, HTML) for text: render_inline(text) here, or the same in a
+    helper process, or escaped plain text when that fails. Callers that
+    cache or store the HTML skip TEMPORARY paths."""
+    started = time.perf_counter()
+    if pool is None:
+        html_out = render_inline(text)
+        _record('inline', started, text)
+        return 'inline', html_out
+    if len(text) > RENDER_MAX_CHARS:
+        _record('too_large', started, text)
+        return 'too_large', plain_text(text)
+    if not needs_isolation(text):
+        html_out = render_inline(text)
+        _record('inline', started, text)
+        return 'inline', html_out
+
+    key = _text_hash(text)
+    with _failed_lock:
+        known = _failed.get(key)
+        if known:
+            _failed.move_to_end(key)
+    if known:
+        _record(known, started, text, log=False)
+        return known, plain_text(text)
+
+    path, html_out = pool.render(text)
+    _record(path, started, text)
+    if path == 'pool':
+        return path, html_out
+    if path in ('timeout', 'memory'):
+        with _failed_lock:
+            _failed[key] = path
+            while len(_failed) > FAILED_CACHE_ENTRIES:
+                _failed.popitem(last=False)
+    return path, plain_text(text)
+
+
+def warm():
+    """Start the helpers (worker warmup)."""
+    if pool is not None:
+        pool.start()
+
+
+def reset_after_fork():
+    """Helpers started before fork belong to the master process."""
+    if pool is not None:
+        pool.forget()
@@ -0,0 +1,266 @@
+"""
+Markdown rendering for Note-Taking App
+Sanitized rendering, a block-level cache for the live preview, and the
+excerpts stored with each note for the dashboard cards
+"""
+import os
+import re
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+
+import render_pool
+
+# Allowed HTML tags for markdown
+ALLOWED_TAGS = [
+    'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'strong', 'em', 'ul', 'ol', 'li',
+    'code', 'pre', 'blockquote', 'a', 'br', 'hr',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td', 'img',
+    'del', 'ins', 'sup', 'sub', 'mark'
+]
+ALLOWED_ATTRS = {
+    'a': ['href', 'title'],
+    'img': ['src', 'alt', 'title', 'width', 'height'],
+    '*': ['class']
+}
+MARKDOWN_EXTENSIONS = [
+    'extra',        # Tables, fenced code, footnotes, attrib, def types
+    'nl2br',        # Newlines to <br>
+    'sane_lists',   # Better list handling
+    'smarty'        # Smart quotes
+]
+
+# Preview block cache limits
+PREVIEW_CACHE_ENTRIES = int(os.getenv('PREVIEW_CACHE_ENTRIES', 4096))
+PREVIEW_CACHE_BYTES = int(os.getenv('PREVIEW_CACHE_BYTES', 8 * 1024 * 1024))
+PREVIEW_MAX_BLOCKS = 2000
+
+# Stored excerpts (notes.excerpt_html / notes.summary)
+EXCERPT_MAX_CHARS = int(os.getenv('NOTE_EXCERPT_CHARS', 600))
+SUMMARY_MAX_CHARS = 200
+
+# Touches every extension once so worker warmup loads them all
+WARMUP_MARKDOWN = """# Warmup
+
+Some *emphasis*, **strong**, `code` and a [link](https://example.com) -- "quoted".
+
+- item
+- item
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+```python
+print("hi")
+```
+
+Term
+: Definition[^1]
+
+[^1]: Footnote.
+"""
+
+
+def render_html(text):
+    """Convert markdown to sanitized HTML, in this thread and without limits."""
+    # Imported on first render: scripts importing the app rarely render
+    import markdown
+    import bleach
+    html = markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+    return bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRS)
+
+
+def render_markdown(text):
+    """Convert markdown to sanitized HTML; documents that may be slow render
+    in a helper process, with escaped plain text if that fails (render_pool.py)."""
+    return render_pool.render(text, render_html)[1]
+
+
+def _render_lasting(text):
+    """(HTML, lasting): not lasting when the HTML is the plain-text fallback
+    for a temporary failure, which must not be cached or stored."""
+    path, html = render_pool.render(text, render_html)
+    return html, path not in render_pool.TEMPORARY
+
+
+# =============================================================================
+# BLOCK SPLITTING
+# =============================================================================
+# Keep in sync with splitMarkdownBlocks() in static/app.js - the client splits
+# the editor content the same way and only sends blocks it has not seen yet.
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+LIST_ITEM_RE = re.compile(r'^ {0,3}([*+-]|\d+[.)])\s')
+# Reference links, footnotes and abbreviations resolve across the whole document
+DOCUMENT_SCOPED_RE = re.compile(r'^ {0,3}(\[[^\]]+\]:|\*\[[^\]]+\]:)|\[\^', re.M)
+
+
+def _continues_block(previous, first_line):
+    """Whether a chunk after a blank line still belongs to the previous block."""
+    if first_line[:1] in (' ', '\t'):
+        # Indented: list continuation or indented code following a paragraph
+        return True
+    return bool(LIST_ITEM_RE.match(previous.split('\n', 1)[0]) and LIST_ITEM_RE.match(first_line))
+
+
+def split_blocks(text):
+    """Split markdown into top-level blocks that render independently.
+
+    Blocks are separated by blank lines outside fenced code. Indented chunks
+    and consecutive list items are kept with the block before them so loose
+    lists and nested content render the same as in the full document.
+    Documents using reference-style links or footnotes are returned whole.
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if DOCUMENT_SCOPED_RE.search(text):
+        return [text] if text.strip() else []
+
+    blocks = []
+    current = []
+    fence = None
+
+    def flush():
+        if not current:
+            return
+        chunk = '\n'.join(current)
+        if blocks and _continues_block(blocks[-1], current[0]):
+            blocks[-1] = blocks[-1] + '\n\n' + chunk
+        else:
+            blocks.append(chunk)
+        current.clear()
+
+    for line in text.split('\n'):
+        match = FENCE_RE.match(line)
+        if fence:
+            current.append(line)
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+            continue
+        if match:
+            fence = match.group(1)
+            current.append(line)
+        elif line.strip():
+            current.append(line)
+        else:
+            flush()
+    flush()
+    return blocks
+
+
+# =============================================================================
+# BLOCK CACHE
+# =============================================================================
+class BlockCache:
+    """Thread-safe LRU of rendered HTML keyed by block content hash."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._items.get(key)
+            if html is not None:
+                self._items.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return
+            self._items[key] = html
+            self._bytes += len(html)
+            while self._items and (len(self._items) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+preview_cache = BlockCache(PREVIEW_CACHE_ENTRIES, PREVIEW_CACHE_BYTES)
+
+
+def block_hash(text):
+    """Stable content hash for a markdown block."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def render_block(text):
+    """Render a single block, reusing cached HTML for unchanged content."""
+    key = block_hash(text)
+    html = preview_cache.get(key)
+    if html is None:
+        html, lasting = _render_lasting(text)
+        if lasting:
+            preview_cache.put(key, html)
+    return key, html
+
+
+# =============================================================================
+# EXCERPTS
+# =============================================================================
+# Note cards only show the top of a note (.note-content is clipped at 200px),
+# so every write stores a rendered excerpt and a plain-text summary and the
+# dashboard never renders or loads full bodies.
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _close_fence(lines):
+    """Append a closing fence if the lines end inside fenced code."""
+    fence = None
+    for line in lines:
+        match = FENCE_RE.match(line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+        elif match:
+            fence = match.group(1)
+    if fence:
+        lines.append(fence)
+    return lines
+
+
+def excerpt_source(text):
+    """The leading markdown of a note, cut at a block (or else line) boundary."""
+    text = text.replace('\r\n', '\n').replace('\r', '\n').strip()
+    if len(text) <= EXCERPT_MAX_CHARS:
+        return text
+
+    kept = []
+    size = 0
+    for block in split_blocks(text):
+        if size + len(block) > EXCERPT_MAX_CHARS:
+            break
+        kept.append(block)
+        size += len(block) + 2
+    if kept:
+        return '\n\n'.join(kept)
+
+    # The first block alone is too long: keep whole lines of it
+    lines = []
+    size = 0
+    for line in text.split('\n'):
+        if lines and size + len(line) > EXCERPT_MAX_CHARS:
+            break
+        lines.append(line[:EXCERPT_MAX_CHARS])
+        size += len(line) + 1
+    return '\n'.join(_close_fence(lines))
+
+
+def make_excerpt(text):
+    """Return (excerpt_html, summary) column values for a note body.
+
+    Both are None when the excerpt could not be rendered just now (a
+    temporary render_pool fallback): the columns stay NULL and the dashboard
+    renders the excerpt again, as for notes saved before excerpts existed.
+    """
+    excerpt_html, lasting = _render_lasting(excerpt_source(text))
+    if not lasting:
+        return None, None
+    summary = ' '.join(html.unescape(TAG_RE.sub(' ', excerpt_html)).split())
+    if len(summary) > SUMMARY_MAX_CHARS:
+        summary = summary[:SUMMARY_MAX_CHARS].rsplit(' ', 1)[0] + '\u2026'
+    return excerpt_html, summary
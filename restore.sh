@@ -1,15 +1,22 @@
 #!/bin/bash
 # =====================================================
 # MariaDB Restore Script for Note-Taking App
-# Restores from a backup in /backup
-# Usage: sudo ./restore.sh [backup_file]
-# If no file specified, lists available and prompts
+# Restores a backup made by backup.sh, optionally rolled forward to a point
+# in time with the saved binlogs, and verifies the result.
+# Usage:
+#   sudo ./restore.sh                                  # list backups and prompt
+#   sudo ./restore.sh <snapshot|backup_file>           # restore that backup
+#   sudo ./restore.sh --until "2026-02-15 14:30:00"    # point in time (newest
+#                                                      # snapshot before it + binlogs)
+#   sudo ./restore.sh --verify-only [snapshot] [--until ...]
+#                                                      # restore into a scratch
+#                                                      # database, check it, drop it
+# Add --with-uploads to also put back static/uploads as of the same time.
 # =====================================================
 
 # Configuration
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" &> /dev/null && pwd )"
 APP_DIR="${SCRIPT_DIR}"
-BACKUP_DIR="/backup"
 LOG_FILE="${APP_DIR}/backup.log"
 
 # Load settings from .env if it exists
@@ -17,36 +24,153 @@ if [ -f "${APP_DIR}/.env" ]; then
     export $(grep -v '^#' "${APP_DIR}/.env" | xargs)
 fi
 
+BACKUP_DIR="${BACKUP_DIR:-/backup}"
 DB_NAME="${DB_NAME:-notes_db}"
-DB_USER="${DB_USER:-notes_user}"
-DB_PASSWORD="${DB_PASSWORD:-your_password_here}"
+DB_HOST="${DB_HOST:-localhost}"
+DB_PORT="${DB_PORT:-3306}"
+# Replaying binlogs needs admin rights; by default root over the local socket
+RESTORE_DB_USER="${RESTORE_DB_USER:-${BACKUP_DB_USER:-root}}"
+RESTORE_DB_PASSWORD="${RESTORE_DB_PASSWORD:-${BACKUP_DB_PASSWORD:-}}"
+RESTORE_THREADS="${BACKUP_THREADS:-4}"
+UPLOADS_DIR="${APP_DIR}/static/uploads"
+SERVICE="notes-app"
+
+FULL_DIR="${BACKUP_DIR}/full"
+BINLOG_DIR="${BACKUP_DIR}/binlog"
+UPLOADS_BACKUP_DIR="${BACKUP_DIR}/uploads"
 
 # Function to log messages
 log_message() {
     echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1" | tee -a "$LOG_FILE"
 }
 
+usage() {
+    echo "Usage: sudo $0 [snapshot|backup_file] [--until 'YYYY-MM-DD HH:MM:SS'] [--verify-only] [--with-uploads]"
+}
+
 # Root check
 if [ "$EUID" -ne 0 ]; then
     echo "ERROR: Please run as root (sudo ./restore.sh)"
     exit 1
 fi
 
+# Parse arguments
+BACKUP_ARG=""
+UNTIL=""
+VERIFY_ONLY=0
+WITH_UPLOADS=0
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --until)
+            UNTIL="$2"
+            shift 2
+            ;;
+        --verify-only)
+            VERIFY_ONLY=1
+            shift
+            ;;
+        --with-uploads)
+            WITH_UPLOADS=1
+            shift
+            ;;
+        -h|--help)
+            usage
+            exit 0
+            ;;
+        -*)
+            usage
+            exit 1
+            ;;
+        *)
+            BACKUP_ARG="$1"
+            shift
+            ;;
+    esac
+done
+
+if [ -n "$UNTIL" ]; then
+    UNTIL=$(date -d "$UNTIL" '+%Y-%m-%d %H:%M:%S' 2>/dev/null)
+    if [ -z "$UNTIL" ]; then
+        echo "[ERROR] Invalid --until time (use 'YYYY-MM-DD HH:MM:SS')."
+        exit 1
+    fi
+fi
+
 # Check backup directory
 if [ ! -d "$BACKUP_DIR" ]; then
     echo "[ERROR] Backup directory $BACKUP_DIR does not exist."
     exit 1
 fi
 
+# These scripts snapshot and replay a single server. A sharded install
+# (several DB_SHARDS entries, or a separate DB_DIRECTORY_HOST) holds users on
+# other hosts too, so refuse instead of silently covering only part of it.
+SHARD_ENTRIES=$(echo "${DB_SHARDS:-}" | tr ',' '\n' | tr -d '[:blank:]' | grep -v '^$')
+if [ "$(echo -n "$SHARD_ENTRIES" | grep -c '')" -gt 1 ] || [ -n "${DB_DIRECTORY_HOST:-}" ]; then
+    log_message "Error: DB_SHARDS / DB_DIRECTORY_HOST configure more than one database server; $(basename "$0") only handles one. Run a separate backup on each shard and on the directory host, with DB_SHARDS and DB_DIRECTORY_HOST unset there."
+    exit 1
+fi
+if [ -n "$SHARD_ENTRIES" ]; then
+    # A single DB_SHARDS entry ("host[:port][/database]") is the database
+    SHARD_ADDRESS="${SHARD_ENTRIES%%/*}"
+    [ "$SHARD_ADDRESS" != "$SHARD_ENTRIES" ] && DB_NAME="${SHARD_ENTRIES#*/}"
+    DB_HOST="${SHARD_ADDRESS%%:*}"
+    [ "$DB_HOST" != "$SHARD_ADDRESS" ] && DB_PORT="${SHARD_ADDRESS#*:}"
+fi
+
+# Client credentials go in a private option file, not on the command line
+CLIENT_CNF=$(mktemp)
+REPLAY_DIR=""
+trap 'rm -f "$CLIENT_CNF"; [ -n "$REPLAY_DIR" ] && rm -rf "$REPLAY_DIR"' EXIT
+chmod 600 "$CLIENT_CNF"
+{
+    echo "[client]"
+    echo "user=${RESTORE_DB_USER}"
+    [ -n "$RESTORE_DB_PASSWORD" ] && echo "password=${RESTORE_DB_PASSWORD}"
+    if [ "$DB_HOST" != "localhost" ]; then
+        echo "host=${DB_HOST}"
+        echo "port=${DB_PORT}"
+    fi
+} > "$CLIENT_CNF"
+
+# Scratch restores must not reach the binlog (and so the replicas)
+MYSQL_OPTS=()
+if [ "$VERIFY_ONLY" -eq 1 ]; then
+    MYSQL_OPTS=(--init-command="SET sql_log_bin = 0")
+fi
+
+mysql_query() {
+    mysql --defaults-extra-file="$CLIENT_CNF" -N -B -e "$1"
+}
+
+meta_value() {
+    sed -n "s/^$2=//p" "$1/meta" 2>/dev/null | head -n 1
+}
+
+list_snapshots() {
+    ls -1d "$FULL_DIR"/*/ 2>/dev/null | grep -v '\.partial/$' | sed 's:/$::' | sort
+}
+
+# Backups newest first: snapshot directories, then single-file backups
+available_backups() {
+    list_snapshots | sort -r
+    ls -t "$BACKUP_DIR"/notes_backup_*.sql.gz "$BACKUP_DIR"/pre_restore_*.sql.gz 2>/dev/null
+}
+
 # List available backups
 list_backups() {
     echo ""
     echo "Available backups:"
     echo "-------------------------------------------"
-    local i=1
-    for f in $(ls -t "$BACKUP_DIR"/notes_backup_*.sql.gz 2>/dev/null); do
-        local size=$(du -h "$f" | awk '{print $1}')
-        local date=$(stat -c '%y' "$f" 2>/dev/null | cut -d'.' -f1)
+    local i=1 f
+    for f in $(available_backups); do
+        local size=$(du -sh "$f" | awk '{print $1}')
+        local date
+        if [ -d "$f" ]; then
+            date="$(meta_value "$f" created_at) (binlog: $(meta_value "$f" binlog_file || true))"
+        else
+            date=$(stat -c '%y' "$f" 2>/dev/null | cut -d'.' -f1)
+        fi
         printf "  [%d] %s (%s) - %s\n" "$i" "$(basename "$f")" "$size" "$date"
         i=$((i + 1))
     done
@@ -57,18 +181,44 @@ list_backups() {
     echo "-------------------------------------------"
 }
 
-# If backup file provided as argument, use it
-if [ -n "$1" ]; then
-    BACKUP_FILE="$1"
-    # If just a filename, prepend backup dir
-    if [[ "$BACKUP_FILE" != /* ]]; then
-        BACKUP_FILE="${BACKUP_DIR}/${BACKUP_FILE}"
+# =====================================================
+# Choose the backup
+# =====================================================
+if [ -n "$BACKUP_ARG" ]; then
+    BACKUP="$BACKUP_ARG"
+    # If just a name, look in the backup directories
+    if [[ "$BACKUP" != /* ]]; then
+        if [ -d "${FULL_DIR}/${BACKUP}" ]; then
+            BACKUP="${FULL_DIR}/${BACKUP}"
+        else
+            BACKUP="${BACKUP_DIR}/${BACKUP}"
+        fi
+    fi
+    BACKUP="${BACKUP%/}"
+elif [ -n "$UNTIL" ]; then
+    # Newest snapshot taken before the target time
+    BACKUP=""
+    for snapshot in $(list_snapshots); do
+        created=$(meta_value "$snapshot" created_at)
+        if [[ ! "$created" > "$UNTIL" ]]; then
+            BACKUP="$snapshot"
+        fi
+    done
+    if [ -z "$BACKUP" ]; then
+        echo "[ERROR] No snapshot older than $UNTIL."
+        exit 1
+    fi
+elif [ "$VERIFY_ONLY" -eq 1 ]; then
+    BACKUP=$(list_snapshots | tail -n 1)
+    if [ -z "$BACKUP" ]; then
+        echo "[ERROR] No snapshots in $FULL_DIR."
+        exit 1
     fi
 else
     # Interactive mode: list and prompt
     list_backups
 
-    BACKUPS=($(ls -t "$BACKUP_DIR"/notes_backup_*.sql.gz 2>/dev/null))
+    BACKUPS=($(available_backups))
     TOTAL=${#BACKUPS[@]}
 
     echo ""
@@ -84,21 +234,207 @@ else
         exit 1
     fi
 
-    BACKUP_FILE="${BACKUPS[$((CHOICE - 1))]}"
+    BACKUP="${BACKUPS[$((CHOICE - 1))]}"
 fi
 
-# Validate file exists
-if [ ! -f "$BACKUP_FILE" ]; then
-    echo "[ERROR] Backup file not found: $BACKUP_FILE"
+# Validate backup exists
+if [ ! -e "$BACKUP" ]; then
+    echo "[ERROR] Backup not found: $BACKUP"
+    exit 1
+fi
+if [ -n "$UNTIL" ] && [ ! -d "$BACKUP" ]; then
+    echo "[ERROR] Point-in-time restore needs a snapshot from backup.sh, not a single-file backup."
     exit 1
 fi
 
+# =====================================================
+# Steps
+# =====================================================
+check_integrity() {
+    log_message "Checking backup integrity: $(basename "$BACKUP")"
+    if [ -d "$BACKUP" ]; then
+        (cd "$BACKUP" && sha256sum --quiet -c SHA256SUMS) >> "$LOG_FILE" 2>&1
+    else
+        gzip -t "$BACKUP" >> "$LOG_FILE" 2>&1
+    fi
+    if [ $? -ne 0 ]; then
+        log_message "[ERROR] Backup is damaged (checksum mismatch); not restoring it."
+        return 1
+    fi
+}
+
+# Load the backup into database $1 (streamed, no temporary files)
+load_backup() {
+    local target="$1"
+    log_message "Restoring database '$target' from $(basename "$BACKUP")..."
+    if [ -d "$BACKUP" ] && [ "$(meta_value "$BACKUP" tool)" == "mydumper" ]; then
+        if ! command -v myloader &> /dev/null; then
+            log_message "[ERROR] This snapshot was made with mydumper; install myloader to restore it."
+            return 1
+        fi
+        local binlog_opt="--enable-binlog"
+        [ "$VERIFY_ONLY" -eq 1 ] && binlog_opt=""
+        myloader --defaults-file="$CLIENT_CNF" --directory "$BACKUP" --database "$target" \
+            --overwrite-tables --threads "$RESTORE_THREADS" $binlog_opt >> "$LOG_FILE" 2>&1
+        return $?
+    fi
+    local file="$BACKUP"
+    [ -d "$BACKUP" ] && file="$BACKUP/dump.sql.gz"
+    gunzip -c "$file" | mysql --defaults-extra-file="$CLIENT_CNF" "${MYSQL_OPTS[@]}" "$target" 2>> "$LOG_FILE"
+    local status=("${PIPESTATUS[@]}")
+    [ "${status[0]}" -eq 0 ] && [ "${status[1]}" -eq 0 ]
+}
+
+# Roll database $1 forward from the snapshot's binlog position to $UNTIL
+replay_binlogs() {
+    local target="$1"
+    local start_file start_pos
+    start_file=$(meta_value "$BACKUP" binlog_file)
+    start_pos=$(meta_value "$BACKUP" binlog_pos)
+    if [ -z "$start_file" ] || [ -z "$start_pos" ]; then
+        log_message "[ERROR] Snapshot has no binlog position (binary logging was off)."
+        return 1
+    fi
+
+    # Collect what the server has written since the last incremental run, if it is up
+    "${APP_DIR}/backup.sh" --incremental > /dev/null 2>&1 || \
+        log_message "[WARN] Could not fetch the latest binlogs; using the ones already saved."
+
+    local files=() expected="" file name number
+    for file in $(ls -1 "$BINLOG_DIR"/*.gz 2>/dev/null | sort); do
+        name=$(basename "$file" .gz)
+        [[ "$name" < "$start_file" ]] && continue
+        number=$((10#${name##*.}))
+        if [ -n "$expected" ] && [ "$number" -ne "$expected" ]; then
+            log_message "[ERROR] Binlog sequence has a gap before $name; cannot roll forward past it."
+            return 1
+        fi
+        expected=$((number + 1))
+        files+=("$file")
+    done
+    if [ ${#files[@]} -eq 0 ] || [ "$(basename "${files[0]}" .gz)" != "$start_file" ]; then
+        log_message "[ERROR] Binlog $start_file is not in $BINLOG_DIR; run backup.sh --incremental."
+        return 1
+    fi
+
+    REPLAY_DIR=$(mktemp -d "${BACKUP_DIR}/replay.XXXXXX")
+    for file in "${files[@]}"; do
+        gunzip -c "$file" > "${REPLAY_DIR}/$(basename "$file" .gz)" || return 1
+    done
+
+    local args=(--start-position="$start_pos")
+    [ -n "$UNTIL" ] && args+=(--stop-datetime="$UNTIL")
+    # --database filters on the rewritten name, keeping other schemas out
+    [ "$target" != "$DB_NAME" ] && args+=(--rewrite-db="${DB_NAME}->${target}")
+    args+=(--database="$target")
+    [ "$VERIFY_ONLY" -eq 1 ] && args+=(--disable-log-bin)
+
+    log_message "Replaying ${#files[@]} binlog file(s) from ${start_file}:${start_pos} to ${UNTIL:-the end of the last saved binlog}..."
+    mysqlbinlog "${args[@]}" "$REPLAY_DIR"/* 2>> "$LOG_FILE" | \
+        mysql --defaults-extra-file="$CLIENT_CNF" "${MYSQL_OPTS[@]}" 2>> "$LOG_FILE"
+    local status=("${PIPESTATUS[@]}")
+    rm -rf "$REPLAY_DIR"
+    REPLAY_DIR=""
+    [ "${status[0]}" -eq 0 ] && [ "${status[1]}" -eq 0 ]
+}
+
+# Check that database $1 is complete and consistent
+verify_database() {
+    local target="$1"
+    local failed=0 table exists count
+    log_message "Verifying database '$target'..."
+    echo "-------------------------------------------"
+    for table in $(sed -n 's/^CREATE TABLE IF NOT EXISTS \([a-z_]*\).*/\1/p' "${APP_DIR}/schema.sql"); do
+        exists=$(mysql_query "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = '${target}' AND table_name = '${table}'")
+        if [ "$exists" != "1" ]; then
+            printf "  %-20s MISSING\n" "$table"
+            failed=1
+            continue
+        fi
+        # CHECK TABLE rows: table, op, msg_type, msg_text
+        if mysql_query "CHECK TABLE \`${target}\`.\`${table}\`" | awk -F'\t' '$3 == "error" || ($3 == "status" && $4 != "OK") {bad = 1} END {exit !bad}'; then
+            printf "  %-20s CHECK TABLE FAILED\n" "$table"
+            failed=1
+            continue
+        fi
+        count=$(mysql_query "SELECT COUNT(*) FROM \`${target}\`.\`${table}\`")
+        printf "  %-20s %10s rows  OK\n" "$table" "$count"
+    done
+
+    # Dumps load with foreign key checks off, so look for rows that lost their parent
+    local orphans
+    orphans=$(mysql_query "
+        SELECT (SELECT COUNT(*) FROM \`${target}\`.notes n LEFT JOIN \`${target}\`.users u ON n.user_id = u.id WHERE u.id IS NULL)
+             + (SELECT COUNT(*) FROM \`${target}\`.attachments a LEFT JOIN \`${target}\`.notes n ON a.note_id = n.id WHERE n.id IS NULL)
+             + (SELECT COUNT(*) FROM \`${target}\`.note_revisions r LEFT JOIN \`${target}\`.notes n ON r.note_id = n.id WHERE n.id IS NULL)" 2>> "$LOG_FILE")
+    if [ "$orphans" != "0" ]; then
+        echo "  Orphaned rows (notes/attachments/revisions without parent): ${orphans:-query failed}"
+        failed=1
+    fi
+    echo "-------------------------------------------"
+
+    if [ $failed -eq 0 ]; then
+        log_message "[OK] Verification passed for '$target'."
+    else
+        log_message "[ERROR] Verification failed for '$target'."
+    fi
+    return $failed
+}
+
+# Put back static/uploads as of the restored point in time
+restore_uploads() {
+    local point copy="" dir
+    point=$(date -d "${UNTIL:-$(meta_value "$BACKUP" created_at)}" '+%Y%m%d_%H%M%S' 2>/dev/null)
+    for dir in $(ls -1d "$UPLOADS_BACKUP_DIR"/*/ 2>/dev/null | grep -v '\.partial/$' | sort); do
+        [[ ! "$(basename "$dir")" > "$point" ]] && copy="$dir"
+    done
+    if [ -z "$copy" ]; then
+        log_message "[WARN] No uploads copy from before the restore point; leaving static/uploads as is."
+        return 0
+    fi
+    # Files that would be removed or replaced are kept aside
+    local aside="${BACKUP_DIR}/pre_restore_uploads_$(date +%Y%m%d_%H%M%S)"
+    rsync -a --delete --backup --backup-dir="$aside" "$copy" "$UPLOADS_DIR/" 2>> "$LOG_FILE"
+    if [ $? -eq 0 ]; then
+        log_message "[OK] Uploads restored from $(basename "$copy") (replaced files kept in $aside)"
+    else
+        log_message "[ERROR] Uploads restore failed."
+        return 1
+    fi
+}
+
+check_integrity || exit 1
+
+# =====================================================
+# Verify only: scratch database
+# =====================================================
+if [ "$VERIFY_ONLY" -eq 1 ]; then
+    SCRATCH_DB="${DB_NAME}_verify"
+    log_message "Test restore of $(basename "$BACKUP") into '$SCRATCH_DB'..."
+    mysql_query "DROP DATABASE IF EXISTS \`${SCRATCH_DB}\`; CREATE DATABASE \`${SCRATCH_DB}\`" || exit 1
+    STATUS=0
+    load_backup "$SCRATCH_DB" || STATUS=1
+    if [ $STATUS -eq 0 ] && [ -n "$UNTIL" ]; then
+        replay_binlogs "$SCRATCH_DB" || STATUS=1
+    fi
+    [ $STATUS -eq 0 ] && { verify_database "$SCRATCH_DB" || STATUS=1; }
+    mysql_query "DROP DATABASE IF EXISTS \`${SCRATCH_DB}\`"
+    if [ $STATUS -eq 0 ]; then
+        log_message "[OK] Test restore of $(basename "$BACKUP") succeeded."
+    else
+        log_message "[ERROR] Test restore of $(basename "$BACKUP") failed; see $LOG_FILE."
+    fi
+    exit $STATUS
+fi
+
 echo ""
 echo "====================================================="
 echo "  Database Restore"
 echo "====================================================="
-echo "  Backup:   $(basename "$BACKUP_FILE")"
+echo "  Backup:   $(basename "$BACKUP")"
 echo "  Database: $DB_NAME"
+[ -n "$UNTIL" ] && echo "  Roll forward to: $UNTIL"
+[ "$WITH_UPLOADS" -eq 1 ] && echo "  Uploads:  restored as of the same time"
 echo "====================================================="
 echo ""
 
@@ -109,53 +445,55 @@ if [ "$CONFIRM" != "y" ] && [ "$CONFIRM" != "Y" ]; then
     exit 0
 fi
 
-# Create a safety backup before restoring
+# No writes while the database is being replaced
+APP_WAS_RUNNING=0
+if systemctl is-active --quiet "$SERVICE" 2>/dev/null; then
+    APP_WAS_RUNNING=1
+    log_message "Stopping $SERVICE during the restore..."
+    systemctl stop "$SERVICE"
+fi
+
+# Create a safety backup before restoring (streamed through gzip)
 log_message "Creating safety backup before restore..."
-SAFETY_FILE="${BACKUP_DIR}/pre_restore_${DB_NAME}_$(date +%Y%m%d_%H%M%S).sql"
-mysqldump -u "$DB_USER" -p"$DB_PASSWORD" "$DB_NAME" > "$SAFETY_FILE" 2>> "$LOG_FILE"
-if [ $? -eq 0 ]; then
-    gzip "$SAFETY_FILE"
-    log_message "Safety backup created: ${SAFETY_FILE}.gz"
+SAFETY_FILE="${BACKUP_DIR}/pre_restore_${DB_NAME}_$(date +%Y%m%d_%H%M%S).sql.gz"
+mysqldump --defaults-extra-file="$CLIENT_CNF" --single-transaction --quick --routines --triggers --hex-blob \
+    "$DB_NAME" 2>> "$LOG_FILE" | gzip > "$SAFETY_FILE"
+if [ "${PIPESTATUS[0]}" -eq 0 ]; then
+    log_message "Safety backup created: $SAFETY_FILE"
 else
     log_message "[WARN] Safety backup failed. Proceeding anyway..."
     rm -f "$SAFETY_FILE"
 fi
 
-# Decompress if gzipped
-RESTORE_FILE="$BACKUP_FILE"
-if [[ "$BACKUP_FILE" == *.gz ]]; then
-    log_message "Decompressing backup..."
-    TEMP_FILE="/tmp/restore_$(date +%s).sql"
-    gunzip -c "$BACKUP_FILE" > "$TEMP_FILE"
-    if [ $? -ne 0 ]; then
-        echo "[ERROR] Failed to decompress backup."
-        rm -f "$TEMP_FILE"
-        exit 1
-    fi
-    RESTORE_FILE="$TEMP_FILE"
+STATUS=0
+load_backup "$DB_NAME" || STATUS=1
+if [ $STATUS -eq 0 ] && [ -n "$UNTIL" ]; then
+    replay_binlogs "$DB_NAME" || STATUS=1
+fi
+[ $STATUS -eq 0 ] && { verify_database "$DB_NAME" || STATUS=1; }
+if [ $STATUS -eq 0 ] && [ "$WITH_UPLOADS" -eq 1 ]; then
+    restore_uploads || STATUS=1
 fi
 
-# Restore
-log_message "Restoring database '$DB_NAME' from $(basename "$BACKUP_FILE")..."
-mysql -u "$DB_USER" -p"$DB_PASSWORD" "$DB_NAME" < "$RESTORE_FILE" 2>> "$LOG_FILE"
+if [ "$APP_WAS_RUNNING" -eq 1 ]; then
+    log_message "Starting $SERVICE..."
+    systemctl start "$SERVICE"
+fi
 
-if [ $? -eq 0 ]; then
+if [ $STATUS -eq 0 ]; then
     log_message "[OK] Database restored successfully."
     echo ""
     echo "====================================================="
     echo "  Restore Complete"
     echo "====================================================="
-    echo "  Restored from: $(basename "$BACKUP_FILE")"
-    echo "  Safety backup: $(basename "${SAFETY_FILE}.gz" 2>/dev/null)"
+    echo "  Restored from: $(basename "$BACKUP")${UNTIL:+ + binlogs to $UNTIL}"
+    echo "  Safety backup: $(basename "$SAFETY_FILE" 2>/dev/null)"
+    echo "  Take a new full backup now: sudo ./backup.sh"
     echo "====================================================="
 else
     log_message "[ERROR] Restore failed! Check credentials and backup file."
     echo ""
-    echo "Restore failed. Your safety backup is at: ${SAFETY_FILE}.gz"
-    echo "To roll back: sudo ./restore.sh ${SAFETY_FILE}.gz"
-fi
-
-# Cleanup temp file
-if [ -n "$TEMP_FILE" ] && [ -f "$TEMP_FILE" ]; then
-    rm -f "$TEMP_FILE"
+    echo "Restore failed. Your safety backup is at: $SAFETY_FILE"
+    echo "To roll back: sudo ./restore.sh $SAFETY_FILE"
+    exit 1
 fi
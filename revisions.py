@@ -0,0 +1,221 @@
+"""
+Note revision history for Note-Taking App
+Every save of a note is recorded in note_revisions. A revision is stored as a
+full snapshot every NOTE_REVISION_SNAPSHOT_EVERY revisions (or whenever the
+delta would not be smaller); revisions in between store a line delta against
+the previous revision. Any revision is rebuilt from the nearest snapshot at or
+before it plus at most SNAPSHOT_EVERY - 1 deltas.
+
+A save within NOTE_REVISION_COALESCE_SECONDS of when the latest revision was
+created replaces it instead of adding a new one, so bursts of saves produce
+one revision per window while long sessions still leave a trail.
+
+Delta format (JSON, packed with note_store.pack_text): a list of ops applied
+to the previous revision's lines (str.splitlines(keepends=True)):
+    n        keep the next n lines
+    -n       drop the next n lines
+    [lines]  insert these lines
+"""
+import os
+import json
+import difflib
+
+from note_store import pack_text, decompress, decode_note
+
+SNAPSHOT_EVERY = int(os.getenv('NOTE_REVISION_SNAPSHOT_EVERY', 20))
+COALESCE_SECONDS = int(os.getenv('NOTE_REVISION_COALESCE_SECONDS', 120))
+# Revision bodies are compressed from a lower size than note bodies: they are
+# read rarely, so the decompression cost does not matter
+REVISION_COMPRESS_MIN_BYTES = 256
+
+
+# =============================================================================
+# DELTAS
+# =============================================================================
+def make_delta(old, new):
+    """Line ops that turn `old` into `new`."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(b[j1:j2])
+    return ops
+
+
+def apply_delta(old, ops):
+    """Apply line ops to `old`; ValueError if they do not fit it exactly.
+
+    Also used for client-sent diffs (PATCH /api/note/<id>), so the ops are
+    validated rather than trusted.
+    """
+    if not isinstance(ops, list):
+        raise ValueError('delta must be a list')
+    lines = old.splitlines(keepends=True)
+    out = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, list):
+            if not all(isinstance(line, str) for line in op):
+                raise ValueError('inserted lines must be strings')
+            out.extend(op)
+        elif isinstance(op, int) and not isinstance(op, bool):
+            if pos + abs(op) > len(lines):
+                raise ValueError('delta runs past the end of the base text')
+            if op >= 0:
+                out.extend(lines[pos:pos + op])
+            pos += abs(op)
+        else:
+            raise ValueError(f'invalid delta op {op!r}')
+    if pos != len(lines):
+        raise ValueError('delta does not cover the whole base text')
+    return ''.join(out)
+
+
+def encode_revision(rev, snapshot_rev, base, text):
+    """Choose how to store revision `rev`; returns (kind, body blob).
+
+    `base` is the text of revision rev - 1 (None for the first revision) and
+    `snapshot_rev` the latest snapshot before `rev`.
+    """
+    snapshot = pack_text(text, REVISION_COMPRESS_MIN_BYTES)
+    if base is None or snapshot_rev is None or rev - snapshot_rev >= SNAPSHOT_EVERY:
+        return 'snapshot', snapshot
+    delta = pack_text(json.dumps(make_delta(base, text), ensure_ascii=False, separators=(',', ':')),
+                      REVISION_COMPRESS_MIN_BYTES)
+    if len(delta) >= len(snapshot):
+        return 'snapshot', snapshot
+    return 'delta', delta
+
+
+def replay(rows):
+    """Rebuild the text of the last row from a snapshot row and following deltas."""
+    text = None
+    for row in rows:
+        body = decompress(row['body'])
+        text = body if row['kind'] == 'snapshot' else apply_delta(text, json.loads(body))
+    return text
+
+
+def unified_diff(old, new, old_label, new_label):
+    return ''.join(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True),
+        fromfile=old_label, tofile=new_label
+    ))
+
+
+# =============================================================================
+# STORAGE
+# =============================================================================
+def load_revision(connection, note_id, rev):
+    """Return {'rev', 'title', 'content', 'created_at', 'updated_at'} or None."""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            '''SELECT rev, kind, title, body, created_at, updated_at FROM note_revisions
+               WHERE note_id = %s AND rev <= %s AND rev >= (
+                   SELECT MAX(rev) FROM note_revisions
+                   WHERE note_id = %s AND rev <= %s AND kind = 'snapshot')
+               ORDER BY rev''',
+            (note_id, rev, note_id, rev)
+        )
+        rows = cursor.fetchall()
+        if not rows or rows[-1]['rev'] != rev:
+            return None
+        last = rows[-1]
+        return {
+            'rev': rev,
+            'title': last['title'],
+            'content': replay(rows),
+            'created_at': last['created_at'],
+            'updated_at': last['updated_at'],
+        }
+    finally:
+        cursor.close()
+
+
+def _write_revision(cursor, note_id, rev, base, title, content, replace=False, stamp=None):
+    cursor.execute(
+        "SELECT MAX(rev) AS rev FROM note_revisions WHERE note_id = %s AND rev < %s AND kind = 'snapshot'",
+        (note_id, rev)
+    )
+    snapshot_rev = cursor.fetchone()['rev']
+    kind, body = encode_revision(rev, snapshot_rev, base, content)
+    size = len(content.encode('utf-8'))
+    if replace:
+        cursor.execute(
+            '''UPDATE note_revisions SET kind = %s, title = %s, body = %s, content_size = %s,
+               updated_at = CURRENT_TIMESTAMP WHERE note_id = %s AND rev = %s''',
+            (kind, title, body, size, note_id, rev)
+        )
+    else:
+        cursor.execute(
+            '''INSERT INTO note_revisions (note_id, rev, kind, title, body, content_size, created_at, updated_at)
+               VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), COALESCE(%s, CURRENT_TIMESTAMP))''',
+            (note_id, rev, kind, title, body, size, stamp, stamp)
+        )
+
+
+def record_revision(connection, note_id, user_id, title, content, coalesce=True):
+    """Record a save of a note; call in the saving transaction, before the UPDATE.
+
+    The first recorded save also snapshots the note as it was before, so
+    history starts from the pre-existing text. Returns the revision number,
+    or None when the note does not belong to the user.
+    """
+    cursor = connection.cursor(dictionary=True)
+    try:
+        # Locks the note row: concurrent saves of one note get distinct revisions
+        cursor.execute(
+            'SELECT title, content, content_z, updated_at FROM notes WHERE id = %s AND user_id = %s FOR UPDATE',
+            (note_id, user_id)
+        )
+        note = cursor.fetchone()
+        if not note:
+            return None
+
+        cursor.execute(
+            '''SELECT rev, TIMESTAMPDIFF(SECOND, created_at, NOW()) AS age
+               FROM note_revisions WHERE note_id = %s ORDER BY rev DESC LIMIT 1''',
+            (note_id,)
+        )
+        latest = cursor.fetchone()
+        if not latest:
+            # The pre-existing text is never coalesced away
+            decode_note(note)
+            _write_revision(cursor, note_id, 1, None, note['title'], note['content'], stamp=note['updated_at'])
+            latest = {'rev': 1, 'age': None}
+
+        current = load_revision(connection, note_id, latest['rev'])
+        if current['title'] == title and current['content'] == content:
+            return latest['rev']
+
+        if coalesce and latest['age'] is not None and latest['age'] < COALESCE_SECONDS:
+            rev = latest['rev']
+            base = load_revision(connection, note_id, rev - 1)['content'] if rev > 1 else None
+            _write_revision(cursor, note_id, rev, base, title, content, replace=True)
+        else:
+            rev = latest['rev'] + 1
+            _write_revision(cursor, note_id, rev, current['content'], title, content)
+        return rev
+    finally:
+        cursor.close()
+
+
+def list_revisions(connection, note_id, user_id):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            '''SELECT r.rev, r.kind, r.title, r.content_size, r.created_at, r.updated_at
+               FROM note_revisions r JOIN notes n ON r.note_id = n.id
+               WHERE r.note_id = %s AND n.user_id = %s ORDER BY r.rev DESC''',
+            (note_id, user_id)
+        )
+        return cursor.fetchall()
+    finally:
+        cursor.close()
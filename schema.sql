@@ -17,10 +17,12 @@ CREATE TABLE IF NOT EXISTS users (
     timezone VARCHAR(50) DEFAULT 'UTC',
     profile_complete BOOLEAN DEFAULT FALSE,
     is_guest BOOLEAN DEFAULT FALSE,
+    last_seen_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_cognito_sub (cognito_sub),
-    INDEX idx_email (email)
+    INDEX idx_email (email),
+    INDEX idx_guest_last_seen (is_guest, last_seen_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Categories for organizing notes
@@ -40,9 +42,15 @@ CREATE TABLE IF NOT EXISTS notes (
     user_id INT NOT NULL,
     category_id INT,
     title VARCHAR(255) DEFAULT '',
-    content TEXT NOT NULL,
+    content MEDIUMTEXT NOT NULL,
+    content_z MEDIUMBLOB NULL,          -- compressed body (see note_store.py); content is '' then
+    content_size INT NULL,              -- uncompressed byte length when content_z is set or the note is cold
+    excerpt_html TEXT NULL,             -- rendered card excerpt (rendering.make_excerpt)
+    summary VARCHAR(255) NULL,          -- plain-text summary of the excerpt
+    version INT NOT NULL DEFAULT 1,     -- bumped on every edit; PATCH /api/note/<id> checks it
     is_pinned BOOLEAN DEFAULT FALSE,
     is_archived BOOLEAN DEFAULT FALSE,
+    is_cold BOOLEAN NOT NULL DEFAULT FALSE, -- body and excerpt moved to note_archive (note_archive.py)
     is_public BOOLEAN DEFAULT FALSE,
     share_token VARCHAR(64) UNIQUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -52,6 +60,7 @@ CREATE TABLE IF NOT EXISTS notes (
     INDEX idx_user_id (user_id),
     INDEX idx_category_id (category_id),
     INDEX idx_share_token (share_token),
+    INDEX idx_user_listing (user_id, is_archived, is_pinned, updated_at),
     FULLTEXT idx_search (title, content)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
@@ -62,12 +71,109 @@ CREATE TABLE IF NOT EXISTS attachments (
     filename VARCHAR(255) NOT NULL,
     s3_key VARCHAR(512) NOT NULL,
     file_type VARCHAR(100),
-    file_size INT,
+    file_size BIGINT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE,
     INDEX idx_note_id (note_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- Note revision history (see revisions.py): periodic full snapshots plus
+-- line deltas against the previous revision
+CREATE TABLE IF NOT EXISTS note_revisions (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    note_id INT NOT NULL,
+    rev INT NOT NULL,
+    kind ENUM('snapshot', 'delta') NOT NULL,
+    title VARCHAR(255) DEFAULT '',
+    body MEDIUMBLOB NOT NULL,
+    content_size INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE,
+    UNIQUE KEY uniq_note_rev (note_id, rev)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Cold tier for long-archived notes (see note_archive.py): the body (packed
+-- with note_store.pack_text) and card excerpt, out of the hot notes table
+CREATE TABLE IF NOT EXISTS note_archive (
+    note_id INT PRIMARY KEY,
+    body MEDIUMBLOB NOT NULL,
+    excerpt_html TEXT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Resumable attachment uploads in progress (see uploads.py); the row is
+-- replaced by an attachments row when the upload finishes
+CREATE TABLE IF NOT EXISTS uploads (
+    id CHAR(32) PRIMARY KEY,
+    user_id INT NOT NULL,
+    note_id INT NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    file_type VARCHAR(100),
+    s3_key VARCHAR(512) NOT NULL,
+    total_size BIGINT NOT NULL,
+    received BIGINT NOT NULL DEFAULT 0,
+    checksum CHAR(64) NULL,
+    multipart_id VARCHAR(1024) NULL,
+    parts MEDIUMTEXT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (note_id) REFERENCES notes(id) ON DELETE CASCADE,
+    INDEX idx_updated_at (updated_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Change feed behind live dashboard updates (see events.py); rows older than
+-- EVENTS_KEEP_HOURS are pruned by the app. No FK to notes: deletions are events too.
+CREATE TABLE IF NOT EXISTS note_events (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    note_id INT NULL,
+    kind VARCHAR(16) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_user_event (user_id, id),
+    INDEX idx_created_at (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Shard directory (only used when DB_SHARDS lists more than one shard).
+-- Lives on DB_DIRECTORY_HOST, or on shard 0 when that is unset. User ids are
+-- allocated here; note/category/attachment ids stay per shard, so give every
+-- shard a disjoint sequence before moving users between them, e.g. on shard i
+-- of N: auto_increment_increment = N, auto_increment_offset = i + 1 (my.cnf).
+CREATE TABLE IF NOT EXISTS user_directory (
+    user_id INT AUTO_INCREMENT PRIMARY KEY,
+    shard_id SMALLINT NOT NULL,
+    cognito_sub VARCHAR(255) UNIQUE,
+    is_moving BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_shard_id (shard_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS share_directory (
+    share_token VARCHAR(64) PRIMARY KEY,
+    user_id INT NOT NULL,
+    note_id INT NOT NULL,
+    INDEX idx_user_id (user_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Upgrades for existing installs (safe to re-run)
+-- last_seen_at is added without a default so existing rows stay NULL for the backfill
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP NULL AFTER is_guest;
+UPDATE users SET last_seen_at = created_at, updated_at = updated_at WHERE last_seen_at IS NULL;
+ALTER TABLE users ALTER COLUMN last_seen_at SET DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_guest_last_seen ON users (is_guest, last_seen_at);
+ALTER TABLE notes MODIFY content MEDIUMTEXT NOT NULL;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS content_z MEDIUMBLOB NULL AFTER content;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS content_size INT NULL AFTER content_z;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS excerpt_html TEXT NULL AFTER content_size;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS summary VARCHAR(255) NULL AFTER excerpt_html;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1 AFTER summary;
+ALTER TABLE attachments MODIFY file_size BIGINT;
+ALTER TABLE notes ADD COLUMN IF NOT EXISTS is_cold BOOLEAN NOT NULL DEFAULT FALSE AFTER is_archived;
+CREATE INDEX IF NOT EXISTS idx_user_listing ON notes (user_id, is_archived, is_pinned, updated_at);
+
 -- Insert default categories for new users (trigger)
 DELIMITER //
 CREATE TRIGGER IF NOT EXISTS after_user_insert
@@ -20,6 +20,8 @@ sudo dnf install -y \
     mysql-devel \
     gcc \
     nginx \
-    mariadb-server
+    mariadb-server \
+    rsync \
+    pigz
 
 echo "[OK] System dependencies installed."
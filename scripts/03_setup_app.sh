@@ -25,6 +25,10 @@ source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Build fingerprinted, minified and precompressed static assets
+echo "Building static assets..."
+python assets.py
+
 # Setup .env file
 if [ ! -f ".env" ]; then
     if [ -f ".env.example" ]; then
@@ -5,30 +5,38 @@
 
 APP_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )/.." &> /dev/null && pwd )"
 SERVICE_FILE="${APP_DIR}/notes-app.service"
+EVENTS_SERVICE_FILE="${APP_DIR}/notes-events.service"
 
 echo "========================================="
 echo "Step 4: Setting Up Systemd Service"
 echo "========================================="
 
-if [ ! -f "$SERVICE_FILE" ]; then
-    echo "[ERROR] Service file not found: $SERVICE_FILE"
-    exit 1
-fi
+for file in "$SERVICE_FILE" "$EVENTS_SERVICE_FILE"; do
+    if [ ! -f "$file" ]; then
+        echo "[ERROR] Service file not found: $file"
+        exit 1
+    fi
+done
 
-# Copy service file to systemd
-echo "Installing systemd service..."
+# Copy service files to systemd: the app, and the live update streams
+echo "Installing systemd services..."
 sudo cp "$SERVICE_FILE" /etc/systemd/system/notes-app.service
+sudo cp "$EVENTS_SERVICE_FILE" /etc/systemd/system/notes-events.service
 
 # Reload and start
 sudo systemctl daemon-reload
-sudo systemctl start notes-app
-sudo systemctl enable notes-app
+for service in notes-app notes-events; do
+    sudo systemctl start "$service"
+    sudo systemctl enable "$service"
+done
 
 # Verify
-if sudo systemctl is-active --quiet notes-app; then
-    echo "[OK] notes-app service is running."
-else
-    echo "[ERROR] notes-app service failed to start."
-    sudo journalctl -u notes-app --no-pager -n 20
-    exit 1
-fi
+for service in notes-app notes-events; do
+    if sudo systemctl is-active --quiet "$service"; then
+        echo "[OK] $service service is running."
+    else
+        echo "[ERROR] $service service failed to start."
+        sudo journalctl -u "$service" --no-pager -n 20
+        exit 1
+    fi
+done
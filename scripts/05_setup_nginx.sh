@@ -12,6 +12,13 @@ NGINX_CONF="/etc/nginx/conf.d/notes-app.conf"
 # Create Nginx config
 echo "Writing Nginx configuration..."
 sudo tee "$NGINX_CONF" > /dev/null <<'EOF'
+# Live update streams go to notes-events.service; the app workers take them
+# only while it is down
+upstream notes_events {
+    server 127.0.0.1:5001;
+    server 127.0.0.1:5000 backup;
+}
+
 server {
     listen 80;
     server_name _;
@@ -23,12 +30,51 @@ server {
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
     }
 
+    # Resumable upload chunks (uploads.py). nginx spools each chunk to disk
+    # first, so slow clients do not hold a Gunicorn thread; keep this above
+    # UPLOAD_CHUNK_BYTES.
+    location /api/uploads/ {
+        client_max_body_size 16m;
+        proxy_pass http://127.0.0.1:5000;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+    }
+
+    # Live update streams (events.py): pass events through as they are sent
+    # and keep idle streams open between heartbeats
+    location = /api/events {
+        proxy_pass http://notes_events;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+    }
+
+    # Fingerprinted build output (python assets.py): names change with content
+    location /static/dist/ {
+        alias /opt/note-taking-app/static/dist/;
+        gzip_static on;
+        #BROTLI_STATIC#
+        add_header Cache-Control "public, max-age=31536000, immutable";
+        access_log off;
+    }
+
     location /static {
         alias /opt/note-taking-app/static;
     }
 }
 EOF
 
+# Serve precompressed .br files when nginx has the brotli module
+if nginx -V 2>&1 | grep -q brotli; then
+    sudo sed -i 's/#BROTLI_STATIC#/brotli_static on;/' "$NGINX_CONF"
+    echo "Brotli module found: enabling brotli_static."
+else
+    sudo sed -i '/#BROTLI_STATIC#/d' "$NGINX_CONF"
+fi
+
 # Test and restart
 echo "Testing Nginx configuration..."
 sudo nginx -t
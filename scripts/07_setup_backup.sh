@@ -6,7 +6,7 @@
 APP_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )/.." &> /dev/null && pwd )"
 BACKUP_SCRIPT="${APP_DIR}/backup.sh"
 BACKUP_DIR="/backup"
-CRON_SCHEDULE="0 2 * * *"
+BINLOG_CNF="/etc/my.cnf.d/notes-binlog.cnf"
 
 echo "========================================="
 echo "Step 7: Setting Up Automated Backup"
@@ -28,12 +28,35 @@ if id "$TARGET_USER" &>/dev/null; then
     chown "$TARGET_USER:$TARGET_USER" "$BACKUP_SCRIPT"
 fi
 
-# Setup cron job
-CRON_CMD="$BACKUP_SCRIPT >> ${APP_DIR}/backup.log 2>&1"
-(crontab -l 2>/dev/null | grep -F "$BACKUP_SCRIPT") && echo "Cron job already exists." || {
-    (crontab -l 2>/dev/null; echo "$CRON_SCHEDULE $CRON_CMD") | crontab -
-    echo "Cron job added: daily at 2:00 AM"
-}
+# Binary logging, needed for incremental backups and point-in-time restore
+BINLOG_CONFIG="[mysqld]
+log_bin = mysql-bin
+binlog_format = ROW
+server_id = 1
+expire_logs_days = 3
+"
+if [ "$(cat "$BINLOG_CNF" 2>/dev/null)" != "$(echo "$BINLOG_CONFIG")" ]; then
+    echo "$BINLOG_CONFIG" | sudo tee "$BINLOG_CNF" > /dev/null
+    sudo systemctl restart mariadb
+    echo "Binary logging enabled ($BINLOG_CNF), MariaDB restarted."
+else
+    echo "Binary logging already configured."
+fi
+
+# Setup cron jobs: full backup nightly, binlogs + uploads every hour, weekly test restore
+chmod +x "${APP_DIR}/restore.sh"
+CRON_LOG=">> ${APP_DIR}/backup.log 2>&1"
+CRON_JOBS=(
+    "0 2 * * * $BACKUP_SCRIPT $CRON_LOG"
+    "30 * * * * $BACKUP_SCRIPT --incremental $CRON_LOG"
+    "0 4 * * 0 $BACKUP_SCRIPT --verify $CRON_LOG"
+)
+for job in "${CRON_JOBS[@]}"; do
+    (crontab -l 2>/dev/null | grep -qF "$job") && echo "Cron job already exists: $job" || {
+        (crontab -l 2>/dev/null; echo "$job") | crontab -
+        echo "Cron job added: $job"
+    }
+done
 
 echo "[OK] Automated backup configured."
 echo "   Logs: ${APP_DIR}/backup.log"
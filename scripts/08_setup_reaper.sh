@@ -0,0 +1,45 @@
+#!/bin/bash
+# =====================================================
+# Step 8: Setup Guest Reaper (Cron)
+# Deletes guest accounts inactive past GUEST_TTL_HOURS and partial uploads
+# idle past UPLOAD_EXPIRE_HOURS; moves long-archived notes to the cold tier
+# =====================================================
+
+APP_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )/.." &> /dev/null && pwd )"
+REAPER_SCRIPT="${APP_DIR}/guest_reaper.py"
+UPLOAD_REAPER_SCRIPT="${APP_DIR}/upload_reaper.py"
+ARCHIVE_SCRIPT="${APP_DIR}/archive_notes.py"
+PYTHON="${APP_DIR}/venv/bin/python"
+CRON_SCHEDULE="15 * * * *"
+
+echo "========================================="
+echo "Step 8: Setting Up Guest Reaper"
+echo "========================================="
+
+if [ ! -f "$REAPER_SCRIPT" ]; then
+    echo "[ERROR] Reaper script not found: $REAPER_SCRIPT"
+    exit 1
+fi
+
+# Setup cron job (hourly, runs as the app user so it can read .env and uploads)
+TARGET_USER="ec2-user"
+CRON_CMD="cd ${APP_DIR} && ${PYTHON} ${REAPER_SCRIPT} >> ${APP_DIR}/reaper.log 2>&1"
+(crontab -u "$TARGET_USER" -l 2>/dev/null | grep -F "$REAPER_SCRIPT") && echo "Cron job already exists." || {
+    (crontab -u "$TARGET_USER" -l 2>/dev/null; echo "$CRON_SCHEDULE $CRON_CMD") | crontab -u "$TARGET_USER" -
+    echo "Cron job added: hourly at :15"
+}
+
+UPLOAD_CRON_CMD="cd ${APP_DIR} && ${PYTHON} ${UPLOAD_REAPER_SCRIPT} >> ${APP_DIR}/reaper.log 2>&1"
+(crontab -u "$TARGET_USER" -l 2>/dev/null | grep -F "$UPLOAD_REAPER_SCRIPT") && echo "Upload reaper cron job already exists." || {
+    (crontab -u "$TARGET_USER" -l 2>/dev/null; echo "45 * * * * $UPLOAD_CRON_CMD") | crontab -u "$TARGET_USER" -
+    echo "Cron job added: upload reaper hourly at :45"
+}
+
+ARCHIVE_CRON_CMD="cd ${APP_DIR} && ${PYTHON} ${ARCHIVE_SCRIPT} >> ${APP_DIR}/reaper.log 2>&1"
+(crontab -u "$TARGET_USER" -l 2>/dev/null | grep -F "$ARCHIVE_SCRIPT") && echo "Archive mover cron job already exists." || {
+    (crontab -u "$TARGET_USER" -l 2>/dev/null; echo "30 3 * * * $ARCHIVE_CRON_CMD") | crontab -u "$TARGET_USER" -
+    echo "Cron job added: cold-tier mover nightly at 03:30"
+}
+
+echo "[OK] Guest reaper configured."
+echo "   Logs: ${APP_DIR}/reaper.log"
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Cold-tier benchmark for Note-Taking App
+
+Creates a throwaway guest user with synthetic notes, most of them archived
+long ago, and measures before and after moving the archived ones to
+note_archive (note_archive.cool_batch):
+  - on-disk size of the notes and note_archive tables
+  - buffer-pool pages each table holds (--buffer-pages; scans the whole pool)
+  - p50 / p95 latency of the dashboard's active listing and stats queries
+  - InnoDB logical page reads per listing query
+
+Run against a staging database, not production: it rebuilds the notes table
+(OPTIMIZE TABLE) so freed pages are returned, and the InnoDB counters are
+server-wide, so other traffic skews them. The user is deleted afterwards.
+
+    venv/bin/python scripts/bench_archive_tier.py --notes 20000 --archived 0.7
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import allocate_user_id, get_db_connection, forget_users  # noqa: E402
+from note_store import encode_content  # noqa: E402
+from note_archive import cool_batch  # noqa: E402
+from rendering import make_excerpt  # noqa: E402
+
+WORDS = ('the note app stores markdown text with lists links code blocks and headings so that '
+         'people can write meeting minutes project plans reading notes recipes and todo items '
+         'quickly while the server keeps every version safe').split()
+
+# What index() runs for the dashboard (active notes, no search)
+LISTING_SQL = '''
+    SELECT n.id, n.title, n.excerpt_html, n.summary, n.category_id, n.is_pinned,
+           n.is_archived, n.is_cold, n.is_public, n.created_at, n.updated_at,
+           IF(n.excerpt_html IS NULL, n.content, NULL) AS content,
+           IF(n.excerpt_html IS NULL, n.content_z, NULL) AS content_z,
+           c.name as category_name, c.color as category_color
+    FROM notes n
+    LEFT JOIN categories c ON n.category_id = c.id
+    WHERE n.user_id = %s AND n.is_archived = FALSE
+    ORDER BY n.is_pinned DESC, n.updated_at DESC
+'''
+STATS_SQL = '''
+    SELECT COUNT(*) as total,
+           SUM(CASE WHEN is_archived = FALSE THEN 1 ELSE 0 END) as active,
+           SUM(CASE WHEN is_pinned = TRUE THEN 1 ELSE 0 END) as pinned,
+           SUM(CASE WHEN is_archived = TRUE THEN 1 ELSE 0 END) as archived
+    FROM notes WHERE user_id = %s
+'''
+
+
+def make_body(rng, size):
+    lines, length = [], 0
+    while length < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + '.'
+        if rng.random() < 0.2:
+            line = '- ' + line
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines)
+
+
+def create_notes(connection, user_id, count, archived, body_bytes, rng):
+    cursor = connection.cursor()
+    try:
+        rows = []
+        for i in range(count):
+            body = make_body(rng, rng.randint(body_bytes // 2, body_bytes * 3 // 2))
+            content, content_z, content_size = encode_content(body)
+            is_archived = rng.random() < archived
+            # Archived notes were last touched months ago
+            age_days = rng.randint(60, 720) if is_archived else rng.randint(0, 30)
+            rows.append((user_id, f'Note {i}', content, content_z, content_size, *make_excerpt(body),
+                         is_archived, age_days))
+            if len(rows) == 500 or i == count - 1:
+                cursor.executemany(
+                    '''INSERT INTO notes (user_id, title, content, content_z, content_size, excerpt_html,
+                                          summary, is_archived, updated_at)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW() - INTERVAL %s DAY)''',
+                    rows
+                )
+                connection.commit()
+                rows = []
+    finally:
+        cursor.close()
+
+
+def status(cursor, name):
+    cursor.execute('SHOW GLOBAL STATUS LIKE %s', (name,))
+    return int(cursor.fetchone()[1])
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measure(connection, user_id, runs, buffer_pages):
+    cursor = connection.cursor()
+    try:
+        for table in ('notes', 'note_archive'):
+            cursor.execute(f'ANALYZE TABLE {table}')
+            cursor.fetchall()
+        cursor.execute(
+            '''SELECT table_name, data_length, index_length FROM information_schema.tables
+               WHERE table_schema = DATABASE() AND table_name IN ('notes', 'note_archive')'''
+        )
+        result = {'size': {row[0]: (row[1], row[2]) for row in cursor.fetchall()}, 'pages': {}}
+
+        timings = {'listing': [], 'stats': []}
+        reads_before = status(cursor, 'Innodb_buffer_pool_read_requests')
+        for _ in range(runs):
+            for name, sql in (('listing', LISTING_SQL), ('stats', STATS_SQL)):
+                started = time.perf_counter()
+                cursor.execute(sql, (user_id,))
+                cursor.fetchall()
+                timings[name].append((time.perf_counter() - started) * 1000)
+        result['reads_per_run'] = (status(cursor, 'Innodb_buffer_pool_read_requests') - reads_before) / runs
+        result['timings'] = timings
+
+        if buffer_pages:
+            cursor.execute(
+                '''SELECT table_name, COUNT(*) FROM information_schema.INNODB_BUFFER_PAGE
+                   WHERE table_name LIKE CONCAT('`', DATABASE(), '`.`note%%`')
+                   GROUP BY table_name'''
+            )
+            result['pages'] = {row[0].split('.')[-1].strip('`'): row[1] for row in cursor.fetchall()}
+        return result
+    finally:
+        cursor.close()
+
+
+def report(label, result):
+    print(f'--- {label}')
+    for table in ('notes', 'note_archive'):
+        data, index = result['size'].get(table, (0, 0))
+        pages = result['pages'].get(table)
+        print(f'{table:<13} data {data / 1024 / 1024:>8.1f} MB  index {index / 1024 / 1024:>7.1f} MB'
+              + (f'  buffer pool {pages} pages' if pages is not None else ''))
+    for name, values in result['timings'].items():
+        print(f'{name:<13} p50 {percentile(values, 50):>7.2f} ms  p95 {percentile(values, 95):>7.2f} ms')
+    print(f'page reads    {result["reads_per_run"]:>10.0f} per listing + stats run')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold archive tier on synthetic notes.')
+    parser.add_argument('--notes', type=int, default=20000)
+    parser.add_argument('--archived', type=float, default=0.7, help='fraction of notes archived')
+    parser.add_argument('--body-bytes', type=int, default=3000, help='average note body size')
+    parser.add_argument('--runs', type=int, default=50, help='query repetitions per measurement')
+    parser.add_argument('--buffer-pages', action='store_true',
+                        help='count buffer-pool pages per table (scans the whole pool)')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    user_id = allocate_user_id()
+    connection = get_db_connection(user_id=user_id)
+    if not connection:
+        print('Error: database connection failed.')
+        return 1
+    try:
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO users (id, display_name, is_guest) VALUES (%s, %s, TRUE)',
+                       (user_id, 'archive benchmark'))
+        connection.commit()
+        user_id = user_id or cursor.lastrowid
+        cursor.close()
+
+        started = time.perf_counter()
+        create_notes(connection, user_id, args.notes, args.archived, args.body_bytes, rng)
+        print(f'created {args.notes} notes ({args.archived:.0%} archived) in {time.perf_counter() - started:.1f}s')
+        report('hot (all bodies in notes)', measure(connection, user_id, args.runs, args.buffer_pages))
+
+        started = time.perf_counter()
+        moved = before = after = 0
+        while True:
+            result = cool_batch(connection, 500, after_days=30, user_id=user_id)
+            if not result:
+                break
+            moved, before, after = moved + result[0], before + result[1], after + result[2]
+        cursor = connection.cursor()
+        cursor.execute('OPTIMIZE TABLE notes')
+        cursor.fetchall()
+        cursor.close()
+        print(f'cooled {moved} notes ({before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB) '
+              f'and rebuilt notes in {time.perf_counter() - started:.1f}s')
+        report('cold tier', measure(connection, user_id, args.runs, args.buffer_pages))
+    finally:
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+        connection.commit()
+        cursor.close()
+        connection.close()
+        forget_users([user_id])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
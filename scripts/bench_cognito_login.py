@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Cognito login benchmark for Note-Taking App
+
+Runs cognito.TokenService against a local stand-in IdP (a token endpoint
+and a JWKS served from 127.0.0.1, signing ID tokens with a generated RSA
+key), so nothing leaves the machine. Measures --logins code exchanges with
+--concurrency threads (a login storm, as after a deploy clears sessions):
+
+    unpooled   a new connection per request and a JWKS fetch per login
+               (what verifying without the service would cost)
+    service    TokenService: keep-alive session, cached JWKS
+
+and reports logins/s, p50 / p95, connections opened and JWKS fetches. Then
+checks that a key rotation refreshes the JWKS once, that unknown key ids
+and tampered tokens are refused without refetching, and that the token
+POST is not retried after the IdP answered. Exits 1 if a check fails.
+
+    venv/bin/python scripts/bench_cognito_login.py --logins 500 --concurrency 16 --latency-ms 20
+"""
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+import cognito  # noqa: E402
+
+CLIENT_ID = 'bench-client'
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# =============================================================================
+# STAND-IN IDP
+# =============================================================================
+class StandInIdP:
+    """Token endpoint (/oauth2/token) and JWKS (/pool/.well-known/jwks.json)."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.connections = 0
+        self.token_requests = 0
+        self.fail_next_token = False
+        self.keys = []
+        self.rotate()
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                idp.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                time.sleep(idp.latency)
+                if self.path == '/pool/.well-known/jwks.json':
+                    self.send_json(200, {'keys': [public for _, public, _ in idp.keys]})
+                else:
+                    self.send_json(404, {})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                time.sleep(idp.latency)
+                idp.token_requests += 1
+                if self.path != '/oauth2/token':
+                    self.send_json(404, {})
+                elif idp.fail_next_token:
+                    idp.fail_next_token = False
+                    self.send_json(503, {'error': 'unavailable'})
+                else:
+                    self.send_json(200, idp.tokens(form['code'][0]))
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.issuer = f'{self.base_url}/pool'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def rotate(self):
+        """Sign with a new key; the JWKS lists it first and keeps the old ones."""
+        private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        kid = f'key-{len(self.keys) + 1}'
+        # Loading a PEM validates the key, which is slow; sign with the loaded one
+        signing_key = jwk.construct(pem, 'RS256')
+        public = signing_key.public_key().to_dict()
+        public.update(kid=kid, use='sig', alg='RS256')
+        self.keys.insert(0, (kid, public, signing_key))
+
+    def id_token(self, sub, access_token=None, kid=None):
+        kid, _, signing_key = self.keys[0] if kid is None else next(k for k in self.keys if k[0] == kid)
+        now = int(time.time())
+        claims = {
+            'sub': sub, 'email': f'{sub}@example.com', 'aud': CLIENT_ID, 'iss': self.issuer,
+            'token_use': 'id', 'iat': now, 'exp': now + 3600
+        }
+        if access_token:
+            digest = hashlib.sha256(access_token.encode()).digest()
+            claims['at_hash'] = base64.urlsafe_b64encode(digest[:16]).rstrip(b'=').decode()
+        return jwt.encode(claims, signing_key, algorithm='RS256', headers={'kid': kid})
+
+    def tokens(self, code):
+        access_token = f'access-{code}'
+        return {'id_token': self.id_token(code, access_token), 'access_token': access_token,
+                'token_type': 'Bearer', 'expires_in': 3600}
+
+    def close(self):
+        self.server.shutdown()
+
+
+# =============================================================================
+# BENCHMARK
+# =============================================================================
+def unpooled_login(idp, code):
+    """Token POST and JWKS GET on fresh connections, then verify."""
+    response = requests.post(f'{idp.base_url}/oauth2/token', data={
+        'grant_type': 'authorization_code', 'client_id': CLIENT_ID, 'code': code, 'redirect_uri': 'x'
+    }, headers={'Connection': 'close'}, timeout=5)
+    tokens = response.json()
+    keys = requests.get(f'{idp.issuer}/.well-known/jwks.json', headers={'Connection': 'close'}, timeout=5).json()
+    return jwt.decode(tokens['id_token'], keys, algorithms=['RS256'], audience=CLIENT_ID,
+                      issuer=idp.issuer, access_token=tokens['access_token'])
+
+
+def run(label, login, logins, concurrency, idp, service=None):
+    connections = idp.connections
+    latencies = []
+
+    def one(i):
+        t = time.perf_counter()
+        claims = login(f'user{i}')
+        latencies.append((time.perf_counter() - t) * 1000)
+        return claims['sub'] == f'user{i}'
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        ok = sum(pool.map(one, range(logins)))
+    elapsed = time.perf_counter() - started
+    fetches = service.jwks_fetches if service else logins
+    print(f'{label:<10} {logins / elapsed:>8.0f} logins/s  p50 {percentile(latencies, 50):>7.2f} ms  '
+          f'p95 {percentile(latencies, 95):>7.2f} ms  {idp.connections - connections:>5} connections  '
+          f'{fetches:>5} JWKS fetches  {ok}/{logins} verified')
+
+
+def check(name, passed):
+    print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    return passed
+
+
+def checks(idp):
+    service = cognito.TokenService(base_url=idp.base_url, issuer=idp.issuer, client_id=CLIENT_ID,
+                                   client_secret='', jwks_min_refresh=1)
+    results = []
+    service.exchange_code('before-rotation', 'x')
+    idp.rotate()
+    time.sleep(1)
+    claims = service.exchange_code('after-rotation', 'x')
+    results.append(check('key rotation refreshes the JWKS once',
+                         claims['sub'] == 'after-rotation' and service.jwks_fetches == 2))
+
+    def refused(token):
+        try:
+            service.verify(token)
+        except cognito.TokenError:
+            return True
+        return False
+
+    forged = jwt.encode({'sub': 'x'}, 'secret', algorithm='HS256', headers={'kid': 'made-up'})
+    results.append(check('unknown key ids are refused without refetching',
+                         all(refused(forged) for _ in range(20)) and service.jwks_fetches == 2))
+    header, payload, signature = idp.id_token('victim').split('.')
+    claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    claims['sub'] = 'attacker'
+    tampered = base64.urlsafe_b64encode(json.dumps(claims).encode()).rstrip(b'=').decode()
+    results.append(check('tampered tokens are refused', refused(f'{header}.{tampered}.{signature}')))
+    results.append(check('tokens for another client are refused',
+                         refused(jwt.encode({'sub': 'x', 'aud': 'other', 'iss': idp.issuer, 'token_use': 'id',
+                                             'exp': int(time.time()) + 60}, idp.keys[0][2],
+                                            algorithm='RS256', headers={'kid': idp.keys[0][0]}))))
+
+    requests_before = idp.token_requests
+    idp.fail_next_token = True
+    try:
+        service.exchange_code('unavailable', 'x')
+        failed = False
+    except cognito.TokenError:
+        failed = True
+    results.append(check('the token POST is not retried after a 503',
+                         failed and idp.token_requests == requests_before + 1))
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure Cognito logins against a local stand-in IdP.')
+    parser.add_argument('--logins', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=20, help='simulated IdP latency per request')
+    args = parser.parse_args()
+
+    idp = StandInIdP(latency=args.latency_ms / 1000)
+    print(f'{args.logins} logins, {args.concurrency} at a time, IdP latency {args.latency_ms:g} ms '
+          f'(plain HTTP: no TLS handshakes, which connection reuse also saves)')
+    try:
+        run('unpooled', lambda code: unpooled_login(idp, code), args.logins, args.concurrency, idp)
+        service = cognito.TokenService(base_url=idp.base_url, issuer=idp.issuer, client_id=CLIENT_ID,
+                                       client_secret='')
+        run('service', lambda code: service.exchange_code(code, 'x'), args.logins, args.concurrency, idp, service)
+        print()
+        return 0 if checks(idp) else 1
+    finally:
+        idp.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Related notes benchmark for Note-Taking App
+
+Builds a related.UserVectors index over --notes synthetic notes (each
+written mostly from one of --topics vocabularies, the rest common words)
+without a database, and reports:
+
+    build      vectorizing every note, and the index size
+    query      related notes for random notes: p50 / p95, and precision@5
+               (share of results from the note's own topic)
+    loop       the same cosine scoring done note by note in Python, for a
+               few queries (what the matrix product replaces)
+    update     editing, adding and deleting one note in place
+    snapshot   saving the .npy files, and memory-mapping them back
+
+    python scripts/bench_related.py --notes 100000 --queries 500
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import related  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_notes(count, topics, seed):
+    """[(note id, title, content, topic)]"""
+    rng = random.Random(seed)
+
+    def word():
+        return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 9)))
+
+    common = [word() for _ in range(2000)]
+    vocabularies = [[word() for _ in range(80)] for _ in range(topics)]
+    notes = []
+    for note_id in range(1, count + 1):
+        topic = rng.randrange(topics)
+        vocabulary = vocabularies[topic]
+        words = [rng.choice(vocabulary) if rng.random() < 0.4 else rng.choice(common)
+                 for _ in range(rng.randint(40, 250))]
+        title = ' '.join(rng.choice(vocabulary) for _ in range(3))
+        notes.append((note_id, title, ' '.join(words), topic))
+    return notes
+
+
+def loop_related(notes_features, idf, note_index, limit=related.RELATED_LIMIT):
+    """Cosine similarity of one note against every other, in plain Python."""
+    def weighted(columns):
+        return {column: value * idf[column] for column, value in columns.items()}
+
+    query = weighted(notes_features[note_index])
+    query_norm = math.sqrt(sum(v * v for v in query.values()))
+    scores = []
+    for i, columns in enumerate(notes_features):
+        if i == note_index:
+            continue
+        other = weighted(columns)
+        norm = math.sqrt(sum(v * v for v in other.values()))
+        dot = sum(value * other.get(column, 0.0) for column, value in query.items())
+        scores.append((dot / (norm * query_norm) if norm and query_norm else 0.0, i))
+    scores.sort(reverse=True)
+    return scores[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the related-notes index.')
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--loop-queries', type=int, default=3, help='queries for the plain Python comparison')
+    parser.add_argument('--dimensions', type=int, default=related.RELATED_DIMENSIONS)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    notes = make_notes(args.notes, args.topics, args.seed)
+    topic_of = {note_id: topic for note_id, _, _, topic in notes}
+    print(f'{args.notes} notes, {args.topics} topics, {args.dimensions} dimensions\n')
+
+    started = time.perf_counter()
+    index = related.UserVectors(args.dimensions)
+    for note_id, title, content, _ in notes:
+        index.add(note_id, title, content, 1)
+    index.reweight()
+    elapsed = time.perf_counter() - started
+    print(f'build      {elapsed:>8.2f} s  ({args.notes / elapsed:,.0f} notes/s), '
+          f'{index.bytes / 1024 / 1024:.1f} MB')
+
+    sample = rng.sample(range(1, args.notes + 1), min(args.queries, args.notes))
+    latencies = []
+    hits = returned = 0
+    for note_id in sample:
+        t = time.perf_counter()
+        matches = index.related(note_id)
+        latencies.append((time.perf_counter() - t) * 1000)
+        hits += sum(1 for match_id, _ in matches if topic_of[match_id] == topic_of[note_id])
+        returned += len(matches)
+    print(f'query      p50 {percentile(latencies, 50):>7.2f} ms  p95 {percentile(latencies, 95):>7.2f} ms  '
+          f'precision@{related.RELATED_LIMIT} {hits / max(returned, 1):.2f} '
+          f'({returned / len(sample):.1f} results per note)')
+
+    if args.loop_queries:
+        notes_features = []
+        for _, title, content, _ in notes:
+            vector = related.features(title, content, args.dimensions)
+            notes_features.append({int(column): float(vector[column]) for column in vector.nonzero()[0]})
+        idf = [float(value) for value in index.idf]
+        loop_ms = []
+        for note_id in sample[:args.loop_queries]:
+            t = time.perf_counter()
+            loop_related(notes_features, idf, note_id - 1)
+            loop_ms.append((time.perf_counter() - t) * 1000)
+        print(f'loop       p50 {percentile(loop_ms, 50):>7.0f} ms  ({args.loop_queries} queries, plain Python)')
+
+    note_id, title, content, _ = notes[0]
+    timings = []
+    for label, change in (('edit', lambda: index.add(note_id, title, content + ' more words', 2)),
+                          ('add', lambda: index.add(args.notes + 1, title, content, 1)),
+                          ('delete', lambda: index.remove(args.notes + 1))):
+        t = time.perf_counter()
+        change()
+        timings.append(f'{label} {(time.perf_counter() - t) * 1000:.2f} ms')
+    print(f"update     {', '.join(timings)}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        t = time.perf_counter()
+        index.save(directory, 1)
+        saved = time.perf_counter() - t
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        t = time.perf_counter()
+        loaded = related.UserVectors.load(directory, 1, args.dimensions)
+        load_ms = (time.perf_counter() - t) * 1000
+        t = time.perf_counter()
+        loaded.related(sample[0])
+        first_ms = (time.perf_counter() - t) * 1000
+        same = all(loaded.related(n) == index.related(n) for n in sample[:50])
+        print(f'snapshot   save {saved * 1000:.0f} ms ({size / 1024 / 1024:.1f} MB), '
+              f'load (mmap) {load_ms:.1f} ms, same results: {same}, first query after load {first_ms:.2f} ms')
+        del loaded
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Markdown render isolation benchmark for Note-Taking App
+
+Renders a set of ordinary and pathological documents (a huge table, runs
+of unmatched "[", deep nesting, long prose) through
+rendering.render_markdown and shows which render_pool path each takes and
+how long it takes. Then measures how small notes fare while --hostile
+threads keep rendering the slow documents, and how long those hold their
+thread: first with every render inline (as before render_pool), then
+through the helper processes.
+
+    python scripts/bench_render_pool.py --timeout 2 --hostile 2 --seconds 5
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rendering  # noqa: E402
+import render_pool  # noqa: E402
+
+SMALL = rendering.WARMUP_MARKDOWN
+DOCUMENTS = {
+    'small note': SMALL,
+    'prose 100 KB': ('Some words in a paragraph, *emphasis* and a [link](https://example.com).\n\n') * 1400,
+    'table 2000 rows': '| a | b | c |\n|---|---|---|\n' + '| 1 | 2 | 3 |\n' * 2000,
+    'unmatched [ x 5000': '[' * 5000,
+    'nested quotes x 300': '>' * 300 + ' deep',
+    'nested list x 80': '\n'.join(' ' * (4 * i) + '- item' for i in range(80)),
+}
+HOSTILE = ['[' * 5000, '| a | b | c |\n|---|---|---|\n' + '| 1 | 2 | 3 |\n' * 4000]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def counts():
+    return {path: entry['count'] for path, entry in render_pool.stats()['paths'].items()}
+
+
+def paths_taken(before):
+    after = counts()
+    return ', '.join(path for path in render_pool.PATHS if after[path] > before[path])
+
+
+def starvation(render, hostile, seconds):
+    """Small renders while hostile threads render slow documents. Returns the
+    small renders' p50 / p95 and how long the slowest hostile render held its
+    thread (a gunicorn worker thread, in production)."""
+    stop = time.monotonic() + seconds
+    latencies = []
+    held = []
+
+    def attack(i, text):
+        n = 0
+        while time.monotonic() < stop:
+            n += 1
+            started = time.perf_counter()
+            # A new document each time, or failed ones would be skipped
+            render(f'{text}\n<!-- {i} {n} -->')
+            held.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=attack, args=(i, HOSTILE[i % len(HOSTILE)]), daemon=True)
+               for i in range(hostile)]
+    for thread in threads:
+        thread.start()
+    while time.monotonic() < stop:
+        started = time.perf_counter()
+        render(SMALL)
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return percentile(latencies, 50), percentile(latencies, 95), max(held) * 1000, len(held)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure isolated markdown rendering.')
+    parser.add_argument('--timeout', type=float, default=render_pool.RENDER_TIMEOUT,
+                        help='RENDER_TIMEOUT for this run (seconds)')
+    parser.add_argument('--hostile', type=int, default=2, help='threads rendering slow documents')
+    parser.add_argument('--seconds', type=float, default=5, help='length of each starvation run')
+    args = parser.parse_args()
+
+    if render_pool.pool is None:
+        print('RENDER_PROCESSES=0: the pool is off, nothing to compare.')
+        return 1
+    render_pool.pool.timeout = args.timeout
+    started = time.perf_counter()
+    render_pool.warm()
+    rendering.render_html(SMALL)
+    print(f'{render_pool.RENDER_PROCESSES} helpers started in {(time.perf_counter() - started) * 1000:.0f} ms, '
+          f'timeout {args.timeout:g} s, memory limit {render_pool.RENDER_MEMORY_MB} MB\n')
+
+    for name, text in DOCUMENTS.items():
+        before = counts()
+        started = time.perf_counter()
+        html = rendering.render_markdown(text)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f'{name:<22} {len(text):>8} chars {elapsed:>9.1f} ms  {paths_taken(before):<10} '
+              f'{len(html):>8} bytes of HTML')
+
+    print(f'\nSmall renders while {args.hostile} threads render slow documents ({args.seconds:g} s each):')
+    for label, render in (('inline', rendering.render_html), ('pool', rendering.render_markdown)):
+        p50, p95, held, count = starvation(render, args.hostile, args.seconds)
+        print(f'{label:<8} small p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms   '
+              f'slow documents: {count} renders, a thread held up to {held:>7.0f} ms')
+
+    print('\nPaths taken (this process):')
+    for path, entry in render_pool.stats()['paths'].items():
+        if entry['count']:
+            print(f'  {path:<10} {entry["count"]:>6}  avg {entry["avg_ms"]:>8.2f} ms  max {entry["max_ms"]:>8.2f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Revision storage benchmark for Note-Taking App
+
+Replays a synthetic but realistic edit trace of one note - editing sessions
+of frequent saves (autosave / Ctrl+S every few seconds) separated by hours,
+mostly appending text with occasional in-place edits, inserted sections and
+deletions - through the revisions.py encoder and compares stored bytes with
+keeping a full copy of every save.
+
+Every stored revision is rebuilt and checked against the text that was saved.
+
+    python scripts/bench_revisions.py --saves 600 --seed 7
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import revisions  # noqa: E402
+from note_store import pack_text, decompress  # noqa: E402
+
+WORDS = ('the note app stores markdown text with lists links code blocks and headings so that '
+         'people can write meeting minutes project plans reading notes recipes and todo items '
+         'quickly while the server keeps every version safe').split()
+
+
+def sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def edit(rng, text):
+    """Apply one realistic edit to a markdown document."""
+    lines = text.split('\n')
+    roll = rng.random()
+    if roll < 0.55:
+        # Typing at the end of the document
+        if rng.random() < 0.2:
+            lines.append('')
+            lines.append(rng.choice(['## ', '- ', '', '1. ']) + sentence(rng))
+        else:
+            lines[-1] = (lines[-1] + ' ' + sentence(rng)).strip()
+    elif roll < 0.80:
+        # Fix a word somewhere
+        i = rng.randrange(len(lines))
+        words = lines[i].split(' ')
+        if words and words[0]:
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        lines[i] = ' '.join(words)
+    elif roll < 0.93:
+        # Insert a list item or paragraph in the middle
+        i = rng.randrange(len(lines) + 1)
+        lines[i:i] = ['- ' + sentence(rng)] if rng.random() < 0.6 else ['', sentence(rng), '']
+    elif len(lines) > 3:
+        # Delete a line
+        del lines[rng.randrange(len(lines))]
+    return '\n'.join(lines)
+
+
+def make_trace(rng, saves):
+    """Return [(timestamp, text)] for `saves` saves."""
+    text = '# Project notes\n\n' + sentence(rng)
+    now = 0.0
+    trace = []
+    while len(trace) < saves:
+        # One editing session: a burst of saves a few seconds apart
+        for _ in range(rng.randint(5, 40)):
+            for _ in range(rng.randint(1, 3)):
+                text = edit(rng, text)
+            now += rng.uniform(3, 45)
+            trace.append((now, text))
+            if len(trace) == saves:
+                break
+        now += rng.uniform(3600, 3 * 86400)
+    return trace
+
+
+class MemoryStore:
+    """In-memory stand-in for note_revisions using the same encoder and policy."""
+
+    def __init__(self, coalesce_seconds):
+        self.rows = []  # dicts: rev, kind, body, created
+        self.coalesce_seconds = coalesce_seconds
+
+    def snapshot_before(self, rev):
+        revs = [r['rev'] for r in self.rows if r['rev'] < rev and r['kind'] == 'snapshot']
+        return max(revs) if revs else None
+
+    def load(self, rev):
+        start = max(r['rev'] for r in self.rows if r['rev'] <= rev and r['kind'] == 'snapshot')
+        return revisions.replay(r for r in self.rows if start <= r['rev'] <= rev)
+
+    def save(self, now, text):
+        if self.rows:
+            latest = self.rows[-1]
+            if now - latest['created'] < self.coalesce_seconds:
+                rev = latest['rev']
+                base = self.load(rev - 1) if rev > 1 else None
+                kind, body = revisions.encode_revision(rev, self.snapshot_before(rev), base, text)
+                latest.update(kind=kind, body=body)
+                return rev
+            base = self.load(latest['rev'])
+        else:
+            base = None
+        rev = len(self.rows) + 1
+        kind, body = revisions.encode_revision(rev, self.snapshot_before(rev), base, text)
+        self.rows.append({'rev': rev, 'kind': kind, 'body': body, 'created': now})
+        return rev
+
+    @property
+    def bytes(self):
+        return sum(len(r['body']) for r in self.rows)
+
+
+def run_store(trace, coalesce_seconds):
+    store = MemoryStore(coalesce_seconds)
+    expected = {}
+    started = time.perf_counter()
+    for now, text in trace:
+        expected[store.save(now, text)] = text
+    save_ms = (time.perf_counter() - started) * 1000 / len(trace)
+
+    load_times = []
+    for rev, text in expected.items():
+        started = time.perf_counter()
+        assert store.load(rev) == text, f'revision {rev} does not round-trip'
+        load_times.append((time.perf_counter() - started) * 1000)
+    return store, save_ms, max(load_times), sum(load_times) / len(load_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Revision storage overhead vs full copies.')
+    parser.add_argument('--saves', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--snapshot-every', type=int, default=revisions.SNAPSHOT_EVERY)
+    parser.add_argument('--coalesce-seconds', type=int, default=revisions.COALESCE_SECONDS)
+    args = parser.parse_args()
+    revisions.SNAPSHOT_EVERY = args.snapshot_every
+
+    trace = make_trace(random.Random(args.seed), args.saves)
+    final = trace[-1][1]
+    raw_copies = sum(len(text.encode('utf-8')) for _, text in trace)
+    packed_copies = sum(len(pack_text(text, revisions.REVISION_COMPRESS_MIN_BYTES)) for _, text in trace)
+    assert decompress(pack_text(final, 0)) == final
+
+    print(f'Trace: {len(trace)} saves, final note {len(final.encode("utf-8")) / 1024:.1f}KB, '
+          f'snapshot every {args.snapshot_every}, coalesce window {args.coalesce_seconds}s')
+    print()
+    print(f"{'strategy':<34}{'revisions':>10}{'stored KB':>12}{'vs copies':>11}{'save ms':>9}"
+          f"{'load max ms':>13}{'load avg ms':>13}")
+    print(f"{'full copy per save':<34}{len(trace):>10}{raw_copies / 1024:>12.1f}{'100.0%':>11}")
+    print(f"{'compressed copy per save':<34}{len(trace):>10}{packed_copies / 1024:>12.1f}"
+          f"{packed_copies / raw_copies:>11.1%}")
+    for label, window in (('snapshots + deltas', 0), ('snapshots + deltas + coalescing', args.coalesce_seconds)):
+        store, save_ms, load_max, load_avg = run_store(trace, window)
+        print(f'{label:<34}{len(store.rows):>10}{store.bytes / 1024:>12.1f}{store.bytes / raw_copies:>11.1%}'
+              f'{save_ms:>9.2f}{load_max:>13.2f}{load_avg:>13.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Typeahead search benchmark for Note-Taking App
+
+Builds a search_index.UserIndex over synthetic notes and times as-you-type
+queries (every prefix of a few search phrases), incremental note updates and
+the index's memory estimate against what tracemalloc measures.
+
+    python scripts/bench_search_index.py --notes 2000 --words 300
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search_index  # noqa: E402
+
+COMMON = ('the note app stores markdown text with lists links code blocks meeting project plan '
+          'server deploy database cluster review budget recipe reading minutes todo').split()
+PHRASES = ['database migration', 'meeting minutes', 'deploy server', 'recipe', 'budget review']
+
+
+def make_notes(rng, count, words):
+    vocab = COMMON + [f'{rng.choice(COMMON)}{i}' for i in range(words * 20)]
+    notes = []
+    for note_id in range(1, count + 1):
+        title = ' '.join(rng.choice(COMMON) for _ in range(rng.randint(0, 5))).capitalize()
+        body = ' '.join(rng.choice(vocab if rng.random() < 0.2 else COMMON) for _ in range(words))
+        notes.append((note_id, title, body))
+    return notes
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-user typeahead index build, query and update times.')
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=300, help='words per note')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    notes = make_notes(rng, args.notes, args.words)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = search_index.UserIndex()
+    for note_id, title, body in notes:
+        index.add(note_id, title, body, 1)
+    build_ms = (time.perf_counter() - started) * 1000
+    measured, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    query_times = []
+    for phrase in PHRASES:
+        for end in range(1, len(phrase) + 1):
+            started = time.perf_counter()
+            index.search(phrase[:end])
+            query_times.append((time.perf_counter() - started) * 1000)
+
+    update_times = []
+    for note_id, title, body in rng.sample(notes, min(200, len(notes))):
+        started = time.perf_counter()
+        index.add(note_id, title, body + ' edited', 2)
+        update_times.append((time.perf_counter() - started) * 1000)
+
+    print(f'{args.notes} notes x {args.words} words: {len(index.vocab)} distinct words')
+    print(f'build            {build_ms:>9.1f} ms')
+    print(f'memory estimate  {index.bytes / 1024 / 1024:>9.1f} MB (tracemalloc: {measured / 1024 / 1024:.1f} MB)')
+    print(f'query p50 / p99  {percentile(query_times, 50):>9.2f} / {percentile(query_times, 99):.2f} ms '
+          f'({len(query_times)} keystrokes)')
+    print(f'update p50 / p99 {percentile(update_times, 50):>9.2f} / {percentile(update_times, 99):.2f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
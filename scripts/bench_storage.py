@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Storage throughput benchmark for Note-Taking App
+
+Runs offline against the storage.py backends: local files in a temporary
+directory, and MemoryStorage with --latency-ms per call standing in for a
+remote store such as S3. For each backend, writes, reads, streams and
+deletes --files files of --size bytes, one at a time and then through the
+bulk thread pool (put_many, delete_many, and concurrent gets on the same
+pool), and reports files/s, MB/s and p50 / p95 per-call latency.
+
+    venv/bin/python scripts/bench_storage.py --files 500 --size 65536 --latency-ms 20
+    venv/bin/python scripts/bench_storage.py --backend s3   # the configured bucket (costs requests)
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def timed_each(fn, items):
+    """Call fn per item; returns (elapsed seconds, per-call ms)."""
+    calls = []
+    started = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        calls.append((time.perf_counter() - t) * 1000)
+    return time.perf_counter() - started, calls
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def row(label, count, size, elapsed, calls=None):
+    line = (f'{label:<24} {count / elapsed:>9.0f} files/s {count * size / elapsed / 1024 / 1024:>8.1f} MB/s')
+    if calls:
+        line += f'  p50 {percentile(calls, 50):>7.2f} ms  p95 {percentile(calls, 95):>7.2f} ms'
+    print(line)
+
+
+def bench(backend, files, size, prefix):
+    data = os.urandom(size)
+    keys = [f'attachments/{prefix}_{i:06d}.bin' for i in range(files)]
+
+    elapsed, calls = timed_each(lambda key: backend.put(key, data, 'application/octet-stream'), keys)
+    row('put (sequential)', files, size, elapsed, calls)
+    elapsed, calls = timed_each(backend.get, keys)
+    row('get (sequential)', files, size, elapsed, calls)
+    elapsed, calls = timed_each(lambda key: sum(len(chunk) for chunk in backend.stream(key).chunks), keys)
+    row('stream (sequential)', files, size, elapsed, calls)
+    elapsed, calls = timed_each(backend.exists, keys)
+    row('exists (sequential)', files, 0, elapsed, calls)
+    elapsed, calls = timed_each(backend.delete, keys)
+    row('delete (sequential)', files, size, elapsed, calls)
+
+    elapsed, failed = timed(lambda: backend.put_many([(key, data, 'application/octet-stream') for key in keys]))
+    row('put_many', files, size, elapsed)
+    elapsed, failed_gets = timed(lambda: storage.run_many(backend.get, keys))
+    row('get (pool)', files, size, elapsed)
+    elapsed, undeleted = timed(lambda: backend.delete_many(keys))
+    row('delete_many', files, size, elapsed)
+    if failed or failed_gets or undeleted:
+        print(f'errors: put {len(failed)}, get {len(failed_gets)}, delete {len(undeleted)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure storage backend throughput.')
+    parser.add_argument('--backend', choices=['local', 'memory', 's3', 'all'], default='all',
+                        help='all = local and memory (no network)')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--size', type=int, default=64 * 1024, help='bytes per file')
+    parser.add_argument('--latency-ms', type=float, default=20,
+                        help='simulated per-call latency of the memory backend')
+    parser.add_argument('--threads', type=int, default=storage.STORAGE_IO_THREADS,
+                        help='bulk thread pool size (STORAGE_IO_THREADS)')
+    args = parser.parse_args()
+
+    # The pool is created on first use, with this many threads
+    storage.STORAGE_IO_THREADS = args.threads
+    print(f'{args.files} files x {args.size / 1024:.0f} KB, {args.threads} pool threads')
+
+    names = ['local', 'memory'] if args.backend == 'all' else [args.backend]
+    for name in names:
+        tmpdir = None
+        if name == 'local':
+            tmpdir = tempfile.mkdtemp(prefix='bench-storage-')
+            backend = storage.LocalStorage(root=tmpdir)
+            label = f'local ({tmpdir})'
+        elif name == 'memory':
+            backend = storage.MemoryStorage(latency=args.latency_ms / 1000)
+            label = f'memory ({args.latency_ms:g} ms per call)'
+        else:
+            if not storage.S3_ENABLED:
+                print('Error: set S3_BUCKET and install boto3 for --backend s3.')
+                return 1
+            backend = storage.S3Storage()
+            label = f's3 ({backend.bucket})'
+        print(f'--- {label}')
+        try:
+            bench(backend, args.files, args.size, f'bench-{os.getpid()}')
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for Note-Taking App
+
+Imports `app` in fresh interpreters with `python -X importtime`, reports the
+median cumulative import time and the slowest modules, and fails when:
+  - the median exceeds the budget (--budget-ms / IMPORT_TIME_BUDGET_MS), or
+  - an optional subsystem that must load lazily was imported eagerly.
+
+Run from the app directory before deploying (exit code 1 on failure):
+    venv/bin/python scripts/check_import_time.py --budget-ms 400
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use only (S3 client, Cognito callback, first render,
+# first related-notes index)
+LAZY_MODULES = ['boto3', 'botocore', 'markdown', 'bleach', 'requests', 'jose', 'numpy']
+
+
+def measure(module):
+    """Import `module` once; return ({package: (self_us, cumulative_us)}, top-level cumulative us)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        raise SystemExit(f'[ERROR] import {module} failed')
+
+    timings = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        package = name.strip()
+        timings[package] = (int(self_us), int(cumulative_us))
+        if name.rstrip() == f' {module}':
+            total = int(cumulative_us)
+    return timings, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the app module.')
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.getenv('IMPORT_TIME_BUDGET_MS', 400)))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest modules to list')
+    args = parser.parse_args()
+
+    # The first run also pays for writing .pyc files
+    measure(args.module)
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [total for _, total in runs]
+    median_ms = statistics.median(totals) / 1000
+    timings = runs[-1][0]
+
+    print(f'import {args.module}: median {median_ms:.1f}ms over {args.runs} runs '
+          f'(min {min(totals) / 1000:.1f}ms, max {max(totals) / 1000:.1f}ms, budget {args.budget_ms:.0f}ms)')
+    print('Slowest modules (self time):')
+    for package, (self_us, cumulative_us) in sorted(timings.items(), key=lambda t: -t[1][0])[:args.top]:
+        print(f'  {self_us / 1000:8.1f}ms  {cumulative_us / 1000:8.1f}ms cumulative  {package}')
+
+    failed = False
+    eager = [m for m in LAZY_MODULES if m in timings]
+    if eager:
+        print(f'[ERROR] Imported eagerly, should load on first use: {", ".join(eager)}')
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f'[ERROR] Import time {median_ms:.1f}ms exceeds budget {args.budget_ms:.0f}ms')
+        failed = True
+    if not failed:
+        print('[OK] Import time within budget.')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Compare the old gunicorn command line with gunicorn.conf.py
+
+Starts each profile on its own port from the app directory, then reports:
+  - startup time until the first successful response
+  - memory of master + workers (PSS, which counts shared pages fairly, and RSS)
+  - latency of the first requests (cold) and of a steady-state run
+
+Run on the target host with the app's .env in place:
+    venv/bin/python scripts/compare_server_profiles.py --requests 2000 --concurrency 8
+
+Memory figures need Linux /proc (smaps_rollup, kernel 4.14+).
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUNICORN = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+
+PROFILES = {
+    # What notes-app.service ran before gunicorn.conf.py
+    'legacy': lambda port: [GUNICORN, '--bind', f'127.0.0.1:{port}', '--workers', '2', 'app:app'],
+    'tuned': lambda port: [GUNICORN, '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}', 'app:app'],
+}
+
+
+def fetch(url):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        status = None
+    return status, (time.perf_counter() - started) * 1000
+
+
+def wait_until_serving(url, timeout=60):
+    started = time.time()
+    while time.time() - started < timeout:
+        status, _ = fetch(url)
+        if status and status < 500:
+            return time.time() - started
+        time.sleep(0.05)
+    return None
+
+
+def process_tree(pid):
+    """The master pid plus its direct children (the workers)."""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+def memory_kb(pids):
+    totals = {'Pss': 0, 'Rss': 0}
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    if name in totals:
+                        totals[name] += int(value.split()[0])
+        except OSError:
+            continue
+    return totals
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run_profile(name, port, args):
+    env = dict(os.environ)
+    process = subprocess.Popen(PROFILES[name](port), cwd=APP_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    urls = [base + path for path in args.path]
+    try:
+        startup = wait_until_serving(urls[0])
+        if startup is None:
+            print(f'[ERROR] {name}: server did not come up')
+            return None
+
+        # One request per worker slot hits a worker that has not served anything yet
+        cold = [fetch(urls[i % len(urls)])[1] for i in range(args.cold)]
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(fetch, (urls[i % len(urls)] for i in range(args.requests))))
+            elapsed = time.perf_counter() - started
+
+        latencies = [ms for status, ms in results if status and status < 500]
+        errors = len(results) - len(latencies)
+        pids = process_tree(process.pid)
+        memory = memory_kb(pids)
+        return {
+            'startup_s': startup,
+            'processes': len(pids),
+            'pss_mb': memory['Pss'] / 1024,
+            'rss_mb': memory['Rss'] / 1024,
+            'cold_max_ms': max(cold) if cold else 0,
+            'cold_mean_ms': statistics.mean(cold) if cold else 0,
+            'p50_ms': percentile(latencies, 50) if latencies else 0,
+            'p95_ms': percentile(latencies, 95) if latencies else 0,
+            'p99_ms': percentile(latencies, 99) if latencies else 0,
+            'rps': len(results) / elapsed,
+            'errors': errors,
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare legacy and tuned gunicorn profiles.')
+    parser.add_argument('--path', action='append',
+                        help='path to request (repeatable, default: /auth/login and /shared/<missing>)')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--cold', type=int, default=8, help='requests measured right after startup')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                        help='profiles to run (default: all)')
+    args = parser.parse_args()
+    args.path = args.path or ['/auth/login', '/shared/warmup-check']
+
+    if not os.path.exists(GUNICORN):
+        print(f'[ERROR] gunicorn not found next to {sys.executable}')
+        return 1
+
+    results = {}
+    for offset, name in enumerate(args.profile or sorted(PROFILES)):
+        print(f'Running {name}...')
+        results[name] = run_profile(name, args.port + offset, args)
+
+    rows = [
+        ('startup (s)', 'startup_s', '{:.2f}'),
+        ('processes', 'processes', '{}'),
+        ('PSS total (MB)', 'pss_mb', '{:.1f}'),
+        ('RSS total (MB)', 'rss_mb', '{:.1f}'),
+        ('cold mean (ms)', 'cold_mean_ms', '{:.1f}'),
+        ('cold max (ms)', 'cold_max_ms', '{:.1f}'),
+        ('p50 (ms)', 'p50_ms', '{:.1f}'),
+        ('p95 (ms)', 'p95_ms', '{:.1f}'),
+        ('p99 (ms)', 'p99_ms', '{:.1f}'),
+        ('requests/s', 'rps', '{:.0f}'),
+        ('errors', 'errors', '{}'),
+    ]
+    names = [n for n in results if results[n]]
+    print()
+    print(f"{'':<16}" + ''.join(f'{n:>12}' for n in names))
+    for label, key, fmt in rows:
+        print(f'{label:<16}' + ''.join(f'{fmt.format(results[n][key]):>12}' for n in names))
+    return 0 if len(names) == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
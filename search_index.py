@@ -0,0 +1,275 @@
+"""
+Typeahead search index for Note-Taking App
+Each worker keeps a per-user in-memory index over note titles and bodies for
+/api/search/suggest:
+    - word postings, searched by prefix (the last word of a query is usually
+      still being typed) through a sorted vocabulary
+    - trigrams of the vocabulary, for matches inside words ("base" finds
+      "database"); they map to words rather than notes, which keeps them small
+
+A user's index is built on their first suggest request, updated in place by
+the app's write paths, and evicted least-recently-used to keep all indexes
+under SEARCH_INDEX_MAX_BYTES. Writes made through other workers are noticed
+by comparing (note count, sum of note versions, max note id) with the
+database at most every SEARCH_INDEX_REFRESH_SECONDS.
+"""
+import os
+import re
+import time
+import bisect
+import threading
+from collections import OrderedDict
+
+from note_store import decode_note
+
+SEARCH_INDEX_MAX_BYTES = int(os.getenv('SEARCH_INDEX_MAX_BYTES', 64 * 1024 * 1024))
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', 10))
+# Only the start of very long notes is indexed
+INDEX_MAX_CHARS = 50000
+MAX_WORD_CHARS = 40
+# Approximate bytes per posting or trigram entry, used for the budget
+ENTRY_BYTES = 96
+TITLE_WEIGHT = 3
+# Words a one- or two-letter prefix may expand to
+MAX_EXPANSIONS = 200
+MAX_QUERY_WORDS = 8
+LABEL_CHARS = 80
+
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [word[:MAX_WORD_CHARS] for word in WORD_RE.findall(text.lower())]
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+# =============================================================================
+# PER-USER INDEX
+# =============================================================================
+class UserIndex:
+    """Word and trigram postings for one user's notes."""
+
+    def __init__(self):
+        self.docs = {}          # note_id -> (label, version, words)
+        self.words = {}         # word -> {note_id: weight}
+        self.grams = {}         # trigram -> {word}
+        self.vocab = []         # sorted keys of self.words
+        self.entries = 0
+        self.label_bytes = 0
+        self.version_sum = 0
+        self.checked_at = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return self.entries * ENTRY_BYTES + self.label_bytes
+
+    def stamp(self):
+        """What the notes table should report for this user if the index is current."""
+        return len(self.docs), self.version_sum, max(self.docs, default=0)
+
+    def add(self, note_id, title, content, version):
+        self.remove(note_id)
+        content = content[:INDEX_MAX_CHARS]
+        weights = dict.fromkeys(tokenize(content), 1)
+        weights.update(dict.fromkeys(tokenize(title or ''), TITLE_WEIGHT))
+
+        for word, weight in weights.items():
+            postings = self.words.get(word)
+            if postings is None:
+                postings = self.words[word] = {}
+                self._add_word(word)
+            postings[note_id] = weight
+
+        label = (title or ' '.join(content[:LABEL_CHARS * 2].split()))[:LABEL_CHARS]
+        self.docs[note_id] = (label, version, tuple(weights))
+        self.entries += len(weights)
+        self.label_bytes += len(label)
+        self.version_sum += version
+
+    def remove(self, note_id):
+        doc = self.docs.pop(note_id, None)
+        if doc is None:
+            return None
+        label, version, words = doc
+        for word in words:
+            postings = self.words[word]
+            del postings[note_id]
+            if not postings:
+                del self.words[word]
+                self._remove_word(word)
+        self.entries -= len(words)
+        self.label_bytes -= len(label)
+        self.version_sum -= version
+        return version
+
+    def _add_word(self, word):
+        bisect.insort(self.vocab, word)
+        grams = trigrams(word)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(word)
+        self.entries += len(grams) + 1
+
+    def _remove_word(self, word):
+        del self.vocab[bisect.bisect_left(self.vocab, word)]
+        grams = trigrams(word)
+        for gram in grams:
+            words = self.grams[gram]
+            words.discard(word)
+            if not words:
+                del self.grams[gram]
+        self.entries -= len(grams) + 1
+
+    def _prefixed(self, token):
+        start = bisect.bisect_left(self.vocab, token)
+        for word in self.vocab[start:start + MAX_EXPANSIONS]:
+            if not word.startswith(token):
+                break
+            yield word
+
+    def _containing(self, token):
+        """Words with the token inside them (not at the start)."""
+        sets = sorted((self.grams.get(gram, ()) for gram in trigrams(token)), key=len)
+        if not sets[0]:
+            return []
+        words = [word for word in set(sets[0]).intersection(*sets[1:])
+                 if token in word and not word.startswith(token)]
+        return words[:MAX_EXPANSIONS]
+
+    def search(self, query):
+        """Note ids matching every word of the query, best first."""
+        tokens = tokenize(query)[:MAX_QUERY_WORDS]
+        if not tokens:
+            return []
+        scores = None
+        for token in tokens:
+            hits = {}
+            # Whole word > prefix > inside a word; title words weigh more
+            matches = [(word, 2 if word == token else 1) for word in self._prefixed(token)]
+            if len(token) >= 3:
+                matches += [(word, 0.5) for word in self._containing(token)]
+            for word, boost in matches:
+                for note_id, weight in self.words[word].items():
+                    if weight * boost > hits.get(note_id, 0):
+                        hits[note_id] = weight * boost
+            if scores is None:
+                scores = hits
+            else:
+                scores = {note_id: scores[note_id] + score for note_id, score in hits.items() if note_id in scores}
+            if not scores:
+                return []
+        # Ties: most recently created first
+        return sorted(scores, key=lambda note_id: (-scores[note_id], -note_id))
+
+    def label(self, note_id):
+        return self.docs[note_id][0]
+
+
+# =============================================================================
+# INDEX CACHE
+# =============================================================================
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _db_stamp(cursor, user_id):
+    cursor.execute(
+        '''SELECT COUNT(*) AS notes, COALESCE(SUM(version), 0) AS versions, COALESCE(MAX(id), 0) AS max_id
+           FROM notes WHERE user_id = %s''',
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    return int(row['notes']), int(row['versions']), int(row['max_id'])
+
+
+def _build(cursor, user_id):
+    index = UserIndex()
+    # Cold (long-archived) notes have an empty body here, so only their title is indexed
+    cursor.execute('SELECT id, title, content, content_z, version FROM notes WHERE user_id = %s', (user_id,))
+    for note in cursor.fetchall():
+        decode_note(note)
+        index.add(note['id'], note['title'], note['content'], note['version'])
+    return index
+
+
+def _evict():
+    """Drop least recently used indexes until under budget (caller holds _lock)."""
+    total = sum(index.bytes for index in _indexes.values())
+    while len(_indexes) > 1 and total > SEARCH_INDEX_MAX_BYTES:
+        _, index = _indexes.popitem(last=False)
+        total -= index.bytes
+
+
+def get_index(connection, user_id):
+    """Return the user's index, building or refreshing it when needed."""
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+    if index is not None and time.time() - index.checked_at < SEARCH_INDEX_REFRESH_SECONDS:
+        return index
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        if index is not None:
+            stamp = _db_stamp(cursor, user_id)
+            with index.lock:
+                current = index.stamp() == stamp
+            if current:
+                index.checked_at = time.time()
+                return index
+        started = time.time()
+        index = _build(cursor, user_id)
+    finally:
+        cursor.close()
+    print(f"Search index built for user {user_id}: {len(index.docs)} notes, "
+          f"{index.bytes / 1024:.0f}KB in {(time.time() - started) * 1000:.0f}ms")
+
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        _evict()
+    return index
+
+
+def suggest(connection, user_id, query, limit=8):
+    """Return (top [(note_id, label)], all matching note ids)."""
+    index = get_index(connection, user_id)
+    with index.lock:
+        ids = index.search(query)
+        return [(note_id, index.label(note_id)) for note_id in ids[:limit]], ids
+
+
+# =============================================================================
+# WRITE HOOKS (call after commit)
+# =============================================================================
+def _loaded(user_id):
+    with _lock:
+        return _indexes.get(user_id)
+
+
+def note_saved(user_id, note_id, title, content):
+    """A note was created or edited (its version went up by one)."""
+    index = _loaded(user_id)
+    if index is None:
+        return
+    with index.lock:
+        previous = index.remove(note_id)
+        index.add(note_id, title, content, (previous or 0) + 1)
+
+
+def note_deleted(user_id, note_id):
+    index = _loaded(user_id)
+    if index is None:
+        return
+    with index.lock:
+        index.remove(note_id)
+
+
+def forget(user_id):
+    """Drop a user's index (bulk changes); it is rebuilt on the next suggest."""
+    with _lock:
+        _indexes.pop(user_id, None)
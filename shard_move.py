@@ -0,0 +1,224 @@
+"""
+Shard maintenance tool for Note-Taking App
+
+Move a user to another shard while the app keeps serving reads:
+    python shard_move.py move <user_id> <target_shard>
+
+Populate the directory from existing data (first-time sharding of shard 0):
+    python shard_move.py init-directory
+
+Moving a user:
+ 1. flags the user as moving in the directory - the app refuses write
+    connections for them but keeps serving reads from the source shard
+ 2. waits for every worker's route cache to pick up the flag
+ 3. copies the user's rows to the target shard in one transaction and
+    verifies row counts
+ 4. points the directory at the target shard and clears the flag
+ 5. waits again for route caches, then deletes the rows from the source
+
+Note and category ids are preserved, so every shard must hand out ids from
+a disjoint range (auto_increment_increment / auto_increment_offset).
+"""
+import sys
+import time
+import argparse
+
+from db import shards, get_directory_connection, ROUTE_CACHE_TTL, SHARDING_ENABLED
+
+# Per-user tables in copy order (parents first) with the filter selecting a user's rows
+USER_TABLES = [
+    ('users', 'id = %s'),
+    ('categories', 'user_id = %s'),
+    ('notes', 'user_id = %s'),
+    ('attachments', 'note_id IN (SELECT id FROM notes WHERE user_id = %s)'),
+    ('note_revisions', 'note_id IN (SELECT id FROM notes WHERE user_id = %s)'),
+    ('note_archive', 'note_id IN (SELECT id FROM notes WHERE user_id = %s)'),
+    ('uploads', 'user_id = %s'),
+    ('note_events', 'user_id = %s'),
+]
+
+
+def set_directory(user_id, **fields):
+    connection = get_directory_connection()
+    try:
+        cursor = connection.cursor()
+        assignments = ', '.join(f'{name} = %s' for name in fields)
+        cursor.execute(f'UPDATE user_directory SET {assignments} WHERE user_id = %s',
+                       (*fields.values(), user_id))
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def get_directory_entry(user_id):
+    connection = get_directory_connection()
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute('SELECT shard_id, is_moving FROM user_directory WHERE user_id = %s', (user_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def count_rows(connection, user_id):
+    cursor = connection.cursor()
+    try:
+        counts = {}
+        for table, where in USER_TABLES:
+            cursor.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}', (user_id,))
+            counts[table] = cursor.fetchone()[0]
+        return counts
+    finally:
+        cursor.close()
+
+
+def copy_user(source, target, user_id):
+    """Copy all of a user's rows from source to target in one target transaction."""
+    read_cursor = source.cursor()
+    write_cursor = target.cursor()
+    try:
+        target.start_transaction()
+        for table, where in USER_TABLES:
+            read_cursor.execute(f'SELECT * FROM {table} WHERE {where}', (user_id,))
+            columns = read_cursor.column_names
+            rows = read_cursor.fetchall()
+            if table == 'categories':
+                # The after_user_insert trigger already created default categories
+                write_cursor.execute('DELETE FROM categories WHERE user_id = %s', (user_id,))
+            if not rows:
+                continue
+            column_list = ', '.join(f'`{c}`' for c in columns)
+            placeholders = ', '.join(['%s'] * len(columns))
+            write_cursor.executemany(
+                f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', rows
+            )
+        target.commit()
+    except Exception:
+        target.rollback()
+        raise
+    finally:
+        read_cursor.close()
+        write_cursor.close()
+
+
+def delete_user(connection, user_id):
+    cursor = connection.cursor()
+    try:
+        # Categories, notes and attachments cascade from users
+        cursor.execute('DELETE FROM users WHERE id = %s', (user_id,))
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+def wait_for_route_caches():
+    delay = ROUTE_CACHE_TTL + 1
+    print(f'Waiting {delay:.0f}s for route caches to expire...')
+    time.sleep(delay)
+
+
+def move_user(user_id, target_id):
+    entry = get_directory_entry(user_id)
+    if not entry:
+        print(f'[ERROR] User {user_id} is not in the directory.')
+        return 1
+    source_id = entry['shard_id']
+    if source_id == target_id:
+        print(f'User {user_id} is already on shard {target_id}.')
+        return 0
+    if entry['is_moving']:
+        print(f'[ERROR] User {user_id} is already being moved.')
+        return 1
+
+    source = shards[source_id].connect()
+    target = shards[target_id].connect()
+    if not source or not target:
+        print('[ERROR] Could not connect to both shards.')
+        return 1
+
+    try:
+        print(f'Moving user {user_id}: shard {source_id} -> shard {target_id}')
+        set_directory(user_id, is_moving=True)
+        wait_for_route_caches()
+
+        try:
+            copy_user(source, target, user_id)
+            expected, copied = count_rows(source, user_id), count_rows(target, user_id)
+            if expected != copied:
+                raise RuntimeError(f'row counts differ after copy: {expected} != {copied}')
+        except Exception as e:
+            print(f'[ERROR] Copy failed, user stays on shard {source_id}: {e}')
+            delete_user(target, user_id)
+            set_directory(user_id, is_moving=False)
+            return 1
+
+        set_directory(user_id, shard_id=target_id, is_moving=False)
+        print(f'Directory updated; rows copied: {copied}')
+
+        # Stale caches may still read the source copy until they expire
+        wait_for_route_caches()
+        delete_user(source, user_id)
+        print(f'[OK] User {user_id} moved to shard {target_id}.')
+        return 0
+    finally:
+        source.close()
+        target.close()
+
+
+def init_directory():
+    """Register every user and share token found on the shards in the directory."""
+    directory = get_directory_connection()
+    try:
+        dir_cursor = directory.cursor()
+        for shard in shards:
+            connection = shard.connect()
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT id, cognito_sub FROM users')
+                users = cursor.fetchall()
+                dir_cursor.executemany(
+                    'INSERT IGNORE INTO user_directory (user_id, shard_id, cognito_sub) VALUES (%s, %s, %s)',
+                    [(uid, shard.shard_id, sub) for uid, sub in users]
+                )
+                cursor.execute('SELECT share_token, user_id, id FROM notes WHERE share_token IS NOT NULL')
+                dir_cursor.executemany(
+                    'INSERT IGNORE INTO share_directory (share_token, user_id, note_id) VALUES (%s, %s, %s)',
+                    cursor.fetchall()
+                )
+                directory.commit()
+                print(f'Shard {shard.shard_id}: registered {len(users)} users')
+            finally:
+                cursor.close()
+                connection.close()
+    finally:
+        dir_cursor.close()
+        directory.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shard directory and user move tool.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    move = sub.add_parser('move', help='move a user to another shard')
+    move.add_argument('user_id', type=int)
+    move.add_argument('target_shard', type=int)
+    sub.add_parser('init-directory', help='register existing users and share tokens')
+    args = parser.parse_args()
+
+    if not SHARDING_ENABLED:
+        print('[ERROR] Sharding is not configured (set DB_SHARDS).')
+        return 1
+
+    if args.command == 'move':
+        if not 0 <= args.target_shard < len(shards):
+            print(f'[ERROR] Unknown shard {args.target_shard}.')
+            return 1
+        return move_user(args.user_id, args.target_shard)
+    return init_directory()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
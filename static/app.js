@@ -17,6 +17,8 @@ document.addEventListener('DOMContentLoaded', () => {
     initViewModal();
     initShareModal();
     initMobileMenu();
+    initLiveUpdates();
+    initOfflineCache();
 });
 
 // ============================================
@@ -92,7 +94,7 @@ function initKeyboardShortcuts() {
             const editContent = document.getElementById('edit-content');
             if (editContent && document.activeElement === editContent) {
                 e.preventDefault();
-                document.getElementById('edit-form').submit();
+                document.getElementById('edit-form').requestSubmit();
             }
         }
 
@@ -135,6 +137,10 @@ function initEditModal() {
 
     if (!modal || !editForm) return;
 
+    const titleInput = document.getElementById('edit-title');
+    const contentInput = document.getElementById('edit-content');
+    const categorySelect = document.getElementById('edit-category');
+
     // Helper to format bytes
     const formatBytes = (bytes, decimals = 2) => {
         if (!+bytes) return '0 Bytes';
@@ -246,19 +252,28 @@ function initEditModal() {
             attachmentList.innerHTML = '';
             editForm.dataset.noteId = noteId;
             editStatus.textContent = '';
+            base = null;
 
-            const response = await fetch(`/api/note/${noteId}`);
-            if (!response.ok) throw new Error('Note not found');
-            const note = await response.json();
+            const note = await fetchNote(noteId);
 
             // Populate form
             document.getElementById('edit-title').value = note.title || '';
             document.getElementById('edit-content').value = note.content || '';
 
-            const categorySelect = document.getElementById('edit-category');
             if (categorySelect && note.category_id) {
                 categorySelect.value = note.category_id;
             }
+            base = {
+                noteId,
+                version: note.version,
+                title: titleInput.value.trim(),
+                content: note.content || '',
+                category: categorySelect ? categorySelect.value : '',
+                reloadOnClose: false,
+                // Saving to the outbox until it has been uploaded (offline cache)
+                offline: Boolean(note.pending)
+            };
+            if (note.offline) editStatus.textContent = 'Offline copy';
 
             // Populate attachments
             if (note.attachments && note.attachments.length > 0) {
@@ -301,15 +316,10 @@ function initEditModal() {
             btnAttach.disabled = true;
             editStatus.textContent = 'Uploading...';
 
-            const formData = new FormData();
-            formData.append('file', file);
-
             try {
-                const res = await fetch(`/api/note/${noteId}/attach`, {
-                    method: 'POST',
-                    body: formData
+                const data = await resumableUpload(noteId, file, (progress) => {
+                    editStatus.textContent = `Uploading ${Math.floor(progress * 100)}%`;
                 });
-                const data = await res.json();
 
                 if (data.success && data.attachment) {
                     // Add to list
@@ -339,7 +349,7 @@ function initEditModal() {
                 }
             } catch (e) {
                 console.error(e);
-                alert('Upload error');
+                alert('Upload failed: ' + e.message);
                 editStatus.textContent = 'Error';
             } finally {
                 btnAttach.innerHTML = originalBtnContent;
@@ -349,12 +359,238 @@ function initEditModal() {
         });
     }
 
-    // Edit button click handlers
-    document.querySelectorAll('.edit-btn').forEach(btn => {
-        btn.addEventListener('click', (e) => {
-            e.stopPropagation(); // Prevent card click
-            openModal(btn.dataset.noteId, 'raw');
+    // ============================================
+    // Autosave
+    // ============================================
+    // Edits are saved with PATCH /api/note/<id>: only the changed fields, with
+    // the body sent as line ops (format in revisions.py) against the version the
+    // editor was loaded from. The server answers 409 if the note was saved
+    // elsewhere in the meantime.
+    const AUTOSAVE_DEBOUNCE_MS = 1500;
+    let base = null;        // {noteId, version, title, content, category, reloadOnClose, offline}
+    let saveTimer = null;
+    let saving = null;      // in-flight save, so saves never overlap
+
+    // Same line splitting as Python's str.splitlines(keepends=True)
+    const LINE_RE = /[^\n\r\v\f\x1c-\x1e\x85\u2028\u2029]*(?:\r\n|[\n\r\v\f\x1c-\x1e\x85\u2028\u2029])|[^\n\r\v\f\x1c-\x1e\x85\u2028\u2029]+/g;
+    const splitLines = (text) => text.match(LINE_RE) || [];
+
+    // Line ops turning oldText into newText: keep the common head and tail,
+    // replace what is in between
+    const lineDiff = (oldText, newText) => {
+        const a = splitLines(oldText);
+        const b = splitLines(newText);
+        let head = 0;
+        while (head < a.length && head < b.length && a[head] === b[head]) head++;
+        let tail = 0;
+        while (tail < a.length - head && tail < b.length - head &&
+            a[a.length - 1 - tail] === b[b.length - 1 - tail]) tail++;
+        const ops = [];
+        if (head) ops.push(head);
+        if (a.length - head - tail) ops.push(-(a.length - head - tail));
+        if (b.length - head - tail) ops.push(b.slice(head, b.length - tail));
+        if (tail) ops.push(tail);
+        return ops;
+    };
+
+    const pendingChanges = () => {
+        if (!base) return null;
+        const changes = {};
+        const title = titleInput.value.trim();
+        const content = contentInput.value.trim();
+        if (title !== base.title) changes.title = title;
+        if (content !== base.content) changes.content = content;
+        if (categorySelect && categorySelect.value !== base.category) {
+            changes.category_id = categorySelect.value ? parseInt(categorySelect.value, 10) : null;
+        }
+        return Object.keys(changes).length ? changes : null;
+    };
+
+    // Reflect a saved note in its card without reloading the page
+    const updateCard = (target, data, changes) => {
+        const card = document.querySelector(`.edit-btn[data-note-id="${target.noteId}"]`)?.closest('.note-card');
+        if (!card) return;
+        if (data.excerpt_html) {
+            const contentEl = card.querySelector('.note-content');
+            if (contentEl) contentEl.innerHTML = data.excerpt_html;
+        } else if (data.excerpt_html === null) {
+            // The server could not render the excerpt just now
+            target.reloadOnClose = true;
+        }
+        if ('title' in changes) {
+            const titleEl = card.querySelector('.note-title');
+            if (titleEl && changes.title) titleEl.textContent = changes.title;
+            else target.reloadOnClose = true;
+        }
+        if ('category_id' in changes) target.reloadOnClose = true;
+    };
+
+    const sendPatch = async (target, changes) => {
+        const body = { version: target.version };
+        if ('title' in changes) body.title = changes.title;
+        if ('category_id' in changes) body.category_id = changes.category_id;
+        if ('content' in changes) {
+            const diff = lineDiff(target.content, changes.content);
+            // Small notes or rewrites: the full text is no bigger than the diff
+            if (JSON.stringify(diff).length < changes.content.length) body.diff = diff;
+            else body.content = changes.content;
+        }
+
+        editStatus.textContent = 'Saving…';
+        let res = await fetch(`/api/note/${target.noteId}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        if (res.status === 400 && body.diff) {
+            // Diff did not apply to the server's text; send the whole body
+            delete body.diff;
+            body.content = changes.content;
+            res = await fetch(`/api/note/${target.noteId}`, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
+            });
+        }
+        const data = await res.json().catch(() => ({}));
+
+        if (res.status === 409) {
+            const overwrite = confirm('This note was changed somewhere else since you opened it. ' +
+                'Overwrite it with your version?');
+            target.version = data.version;
+            target.title = data.title || '';
+            target.content = data.content || '';
+            if (overwrite && base === target) return sendPatch(target, pendingChanges() || {});
+            if (base === target) {
+                titleInput.value = target.title;
+                contentInput.value = target.content;
+            }
+            target.reloadOnClose = true;
+            editStatus.textContent = 'Loaded the latest version';
+            return false;
+        }
+        if (!res.ok) {
+            editStatus.textContent = 'Save failed';
+            console.error('Autosave failed:', data.error || res.status);
+            return false;
+        }
+
+        target.version = data.version;
+        if ('title' in changes) target.title = changes.title;
+        if ('content' in changes) target.content = changes.content;
+        if ('category_id' in changes) target.category = changes.category_id === null ? '' : String(changes.category_id);
+        if (!data.unchanged) updateCard(target, data, changes);
+        editStatus.textContent = 'Saved';
+        return true;
+    };
+
+    // Save now; resolves to false if the save failed
+    const save = async () => {
+        clearTimeout(saveTimer);
+        saveTimer = null;
+        while (saving) await saving;
+        const target = base;
+        const changes = pendingChanges();
+        if (!changes) return true;
+        const send = target.offline ? queueOfflineEdit(target, changes) : sendPatch(target, changes);
+        saving = send
+            .catch(async (error) => {
+                // fetch() rejects with a TypeError when the network is down
+                if (error instanceof TypeError && !target.offline && await queueOfflineEdit(target, changes)) return true;
+                console.error('Autosave error:', error);
+                editStatus.textContent = 'Offline - not saved';
+                return false;
+            })
+            .finally(() => { saving = null; });
+        return saving;
+    };
+
+    // Offline: keep the edit in the outbox (see initOfflineCache). Later saves
+    // go there too until it has been uploaded, since they build on it.
+    const queueOfflineEdit = async (target, changes) => {
+        if (!offlineReady || !(await offlineReady)) return false;
+        if ('title' in changes) target.title = changes.title;
+        if ('content' in changes) target.content = changes.content;
+        if ('category_id' in changes) target.category = changes.category_id === null ? '' : String(changes.category_id);
+        await NotesDB.queueEdit({
+            id: Number(target.noteId),
+            version: target.version,
+            title: target.title,
+            content: target.content,
+            category_id: target.category ? parseInt(target.category, 10) : null
         });
+        target.offline = true;
+        editStatus.textContent = 'Saved offline';
+        requestOutboxSync();
+        return true;
+    };
+
+    // Queued edits were uploaded: an open editor continues from the saved version
+    document.addEventListener('outbox-synced', async (e) => {
+        const target = base;
+        const result = target && e.detail.find(r => r.id === Number(target.noteId));
+        if (!result || !target.offline || result.queued) return;
+        if (result.status === 'saved') {
+            target.version = result.version;
+            target.offline = false;
+            editStatus.textContent = 'Saved';
+        } else if (result.status === 'conflict') {
+            // Kept as a copy; carry on from the note as it is now
+            try {
+                const note = await fetchNote(target.noteId);
+                if (base !== target || note.offline) return;
+                target.version = note.version;
+                target.title = note.title || '';
+                target.content = note.content || '';
+                target.offline = false;
+                titleInput.value = target.title;
+                contentInput.value = target.content;
+                editStatus.textContent = 'Changed elsewhere - your offline edits were saved as a copy';
+            } catch (error) {
+                console.error('Reloading note failed:', error);
+            }
+        }
+    });
+
+    const scheduleSave = () => {
+        if (!base) return;
+        clearTimeout(saveTimer);
+        editStatus.textContent = 'Unsaved changes';
+        saveTimer = setTimeout(save, AUTOSAVE_DEBOUNCE_MS);
+    };
+
+    titleInput.addEventListener('input', scheduleSave);
+    contentInput.addEventListener('input', scheduleSave);
+    if (categorySelect) categorySelect.addEventListener('change', scheduleSave);
+
+    // Save button / Ctrl+Enter: save in place instead of posting the form
+    editForm.addEventListener('submit', async (e) => {
+        e.preventDefault();
+        if (!contentInput.value.trim()) {
+            editStatus.textContent = 'Note content cannot be empty';
+            return;
+        }
+        if (await save()) modal.classList.remove('active');
+    });
+
+    // However the modal gets closed (buttons, backdrop, Escape), flush the
+    // pending save, then reload if the card cannot be patched in place
+    new MutationObserver(async () => {
+        if (modal.classList.contains('active') || !base) return;
+        const target = base;
+        await save();
+        base = null;
+        if (target.reloadOnClose) window.location.reload();
+    }).observe(modal, { attributes: true, attributeFilter: ['class'] });
+
+    window.addEventListener('beforeunload', (e) => {
+        if (saveTimer || saving || pendingChanges()) e.preventDefault();
+    });
+
+    // Edit button click handlers (delegated, so cards replaced by live updates work too)
+    document.addEventListener('click', (e) => {
+        const btn = e.target.closest('.edit-btn');
+        if (btn) openModal(btn.dataset.noteId, 'raw');
     });
 
     // Close handlers
@@ -387,9 +623,7 @@ function initViewModal() {
             document.getElementById('view-title').textContent = 'Loading...';
             modal.classList.add('active');
 
-            const response = await fetch(`/api/note/${noteId}`);
-            if (!response.ok) throw new Error('Note not found');
-            const note = await response.json();
+            const note = await fetchNote(noteId);
 
             // Populate content
             document.getElementById('view-title').textContent = note.title || 'Untitled Note';
@@ -423,6 +657,29 @@ function initViewModal() {
                 viewAttachments.style.display = 'none';
             }
 
+            // Related notes (absent offline, null while the server builds the index)
+            const viewRelated = document.getElementById('view-related');
+            const relatedList = viewRelated.querySelector('ul');
+            relatedList.innerHTML = '';
+            if (note.related && note.related.length > 0) {
+                note.related.forEach(rel => {
+                    const li = document.createElement('li');
+                    const link = document.createElement('a');
+                    link.href = '#';
+                    link.textContent = rel.title || 'Untitled Note';
+                    link.title = `Similarity ${Math.round(rel.score * 100)}%`;
+                    link.addEventListener('click', (e) => {
+                        e.preventDefault();
+                        openViewModal(rel.id);
+                    });
+                    li.appendChild(link);
+                    relatedList.appendChild(li);
+                });
+                viewRelated.style.display = 'block';
+            } else {
+                viewRelated.style.display = 'none';
+            }
+
             // Populate metadata
             // Format: Feb 12, 2024 at 10:30 AM
             const dateStr = note.updated_at ? new Date(note.updated_at).toLocaleString('en-US', {
@@ -457,17 +714,20 @@ function initViewModal() {
         }
     };
 
-    // Card click handlers
-    document.querySelectorAll('.note-card').forEach(card => {
-        card.addEventListener('click', (e) => {
-            // Ignore if clicking interactive elements
-            if (e.target.closest('button') || e.target.closest('a') || e.target.closest('.note-actions-bar') || e.target.closest('.delete-form')) return;
+    // Used by the search suggestions
+    window.openViewModal = openViewModal;
 
-            const btn = card.querySelector('.edit-btn');
-            if (btn) {
-                openViewModal(btn.dataset.noteId);
-            }
-        });
+    // Card click handlers (delegated)
+    document.addEventListener('click', (e) => {
+        const card = e.target.closest('.note-card');
+        if (!card) return;
+        // Ignore if clicking interactive elements
+        if (e.target.closest('button') || e.target.closest('a') || e.target.closest('.note-actions-bar') || e.target.closest('.delete-form')) return;
+
+        const btn = card.querySelector('.edit-btn');
+        if (btn) {
+            openViewModal(btn.dataset.noteId);
+        }
     });
 
     // Close handlers
@@ -504,31 +764,185 @@ function initEditTabs() {
         noteContent.focus();
     });
 
+    const preview = createBlockPreview(previewDiv);
+    let debounceTimer = null;
+
     tabPreview.addEventListener('click', async () => {
         tabPreview.classList.add('active');
         tabRaw.classList.remove('active');
         noteContent.classList.add('hidden');
         previewDiv.classList.remove('hidden');
 
-        // Show loading state
-        previewDiv.innerHTML = '<div style="text-align: center; padding: 2rem; color: var(--text-muted);">Loading preview...</div>';
+        // Show loading state only when there is nothing rendered yet
+        if (!previewDiv.querySelector('.preview-block')) {
+            previewDiv.innerHTML = '<div style="text-align: center; padding: 2rem; color: var(--text-muted);">Loading preview...</div>';
+        }
 
         try {
+            await preview.update(noteContent.value);
+        } catch (error) {
+            console.error('Preview error:', error);
+            previewDiv.innerHTML = '<div style="color: var(--error); padding: 1rem;">Failed to load preview</div>';
+        }
+    });
+
+    // Live preview: re-render changed blocks shortly after typing stops,
+    // so switching to the Preview tab is instant
+    noteContent.addEventListener('input', () => {
+        clearTimeout(debounceTimer);
+        debounceTimer = setTimeout(() => {
+            preview.update(noteContent.value).catch(error => console.error('Preview error:', error));
+        }, PREVIEW_DEBOUNCE_MS);
+    });
+}
+
+// ============================================
+// Block-Level Preview
+// ============================================
+
+const PREVIEW_DEBOUNCE_MS = 300;
+const PREVIEW_CACHE_LIMIT = 2000;
+// Blocks per /api/preview request; matches PREVIEW_MAX_BLOCKS in rendering.py
+const PREVIEW_MAX_BLOCKS = 2000;
+
+// Keep in sync with split_blocks() in rendering.py
+const FENCE_RE = /^ {0,3}(`{3,}|~{3,})/;
+const LIST_ITEM_RE = /^ {0,3}([*+-]|\d+[.)])\s/;
+const DOCUMENT_SCOPED_RE = /^ {0,3}(\[[^\]]+\]:|\*\[[^\]]+\]:)|\[\^/m;
+
+function splitMarkdownBlocks(text) {
+    text = text.replace(/\r\n?/g, '\n');
+    if (DOCUMENT_SCOPED_RE.test(text)) {
+        return text.trim() ? [text] : [];
+    }
+
+    const blocks = [];
+    let current = [];
+    let fence = null;
+
+    const continuesBlock = (previous, firstLine) => {
+        if (firstLine[0] === ' ' || firstLine[0] === '\t') return true;
+        return LIST_ITEM_RE.test(previous.split('\n', 1)[0]) && LIST_ITEM_RE.test(firstLine);
+    };
+
+    const flush = () => {
+        if (!current.length) return;
+        const chunk = current.join('\n');
+        if (blocks.length && continuesBlock(blocks[blocks.length - 1], current[0])) {
+            blocks[blocks.length - 1] += '\n\n' + chunk;
+        } else {
+            blocks.push(chunk);
+        }
+        current = [];
+    };
+
+    text.split('\n').forEach(line => {
+        const match = line.match(FENCE_RE);
+        if (fence) {
+            current.push(line);
+            if (match && match[1][0] === fence[0] && match[1].length >= fence.length) {
+                fence = null;
+            }
+            return;
+        }
+        if (match) {
+            fence = match[1];
+            current.push(line);
+        } else if (line.trim()) {
+            current.push(line);
+        } else {
+            flush();
+        }
+    });
+    flush();
+    return blocks;
+}
+
+// 53-bit string hash (cyrb53), used as a client-side block key
+function hashBlock(text) {
+    let h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+    for (let i = 0; i < text.length; i++) {
+        const ch = text.charCodeAt(i);
+        h1 = Math.imul(h1 ^ ch, 2654435761);
+        h2 = Math.imul(h2 ^ ch, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    return (4294967296 * (2097151 & h2) + (h1 >>> 0)).toString(36);
+}
+
+function createBlockPreview(container) {
+    const rendered = new Map(); // block key -> sanitized HTML from the server
+    let sequence = 0;
+
+    // Reorder, insert or drop block elements so they match `keys`,
+    // leaving unchanged blocks untouched in the DOM
+    const patch = (keys) => {
+        const pool = new Map();
+        Array.from(container.children).forEach(el => {
+            if (!el.classList.contains('preview-block')) {
+                el.remove();
+                return;
+            }
+            if (!pool.has(el.dataset.key)) pool.set(el.dataset.key, []);
+            pool.get(el.dataset.key).push(el);
+        });
+
+        keys.forEach((key, i) => {
+            let el = pool.get(key)?.shift();
+            if (!el) {
+                el = document.createElement('div');
+                el.className = 'preview-block';
+                el.dataset.key = key;
+                el.innerHTML = rendered.get(key);
+            }
+            const current = container.children[i];
+            if (current !== el) container.insertBefore(el, current || null);
+        });
+
+        while (container.children.length > keys.length) {
+            container.lastElementChild.remove();
+        }
+    };
+
+    const update = async (content) => {
+        const current = ++sequence;
+        const blocks = splitMarkdownBlocks(content);
+        const keys = blocks.map(hashBlock);
+
+        // Only send blocks that have never been rendered
+        const seen = new Set();
+        const missing = [];
+        keys.forEach((key, i) => {
+            if (rendered.has(key) || seen.has(key)) return;
+            seen.add(key);
+            missing.push({ i, text: blocks[i] });
+        });
+
+        for (let start = 0; start < missing.length; start += PREVIEW_MAX_BLOCKS) {
             const response = await fetch('/api/preview', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ content: noteContent.value })
+                body: JSON.stringify({ blocks: missing.slice(start, start + PREVIEW_MAX_BLOCKS) })
             });
-
             if (!response.ok) throw new Error('Preview failed');
-
             const data = await response.json();
-            previewDiv.innerHTML = data.html;
-        } catch (error) {
-            console.error('Preview error:', error);
-            previewDiv.innerHTML = '<div style="color: var(--error); padding: 1rem;">Failed to load preview</div>';
+            data.blocks.forEach(block => rendered.set(keys[block.i], block.html));
         }
-    });
+
+        // A newer update started while this one was waiting on the server
+        if (current !== sequence) return;
+        patch(keys);
+
+        if (rendered.size > PREVIEW_CACHE_LIMIT) {
+            const live = new Set(keys);
+            rendered.forEach((_, key) => {
+                if (!live.has(key)) rendered.delete(key);
+            });
+        }
+    };
+
+    return { update };
 }
 
 function closeAllModals() {
@@ -537,17 +951,114 @@ function closeAllModals() {
     });
 }
 
+// ============================================
+// Resumable Uploads (see uploads.py)
+// ============================================
+
+const UPLOAD_RETRY_LIMIT = 5;
+
+async function sha256Base64(blob) {
+    // crypto.subtle is only available over HTTPS (and on localhost)
+    if (!window.crypto || !window.crypto.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return btoa(String.fromCharCode(...new Uint8Array(digest)));
+}
+
+async function fetchJson(url, options) {
+    const res = await fetch(url, options);
+    const data = await res.json().catch(() => ({}));
+    return { res, data };
+}
+
+// Sends a file in chunks. After a dropped connection the upload continues
+// from the last stored chunk; after a page reload, picking the same file
+// again does too.
+async function resumableUpload(noteId, file, onProgress) {
+    const storageKey = `upload:${noteId}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+
+    const savedId = localStorage.getItem(storageKey);
+    if (savedId) {
+        const { res, data } = await fetchJson(`/api/uploads/${savedId}`);
+        if (res.ok) upload = data;
+    }
+    if (!upload) {
+        const { res, data } = await fetchJson(`/api/note/${noteId}/uploads`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, type: file.type })
+        });
+        if (!res.ok) throw new Error(data.error || 'Unknown error');
+        upload = data;
+        localStorage.setItem(storageKey, upload.id);
+    }
+
+    let offset = upload.offset;
+    let failures = 0;
+    while (offset < file.size) {
+        onProgress(offset / file.size);
+        const chunk = file.slice(offset, Math.min(offset + upload.chunk_size, file.size));
+        const headers = {
+            'Content-Type': 'application/offset+octet-stream',
+            'Upload-Offset': String(offset)
+        };
+        const checksum = await sha256Base64(chunk);
+        if (checksum) headers['Upload-Checksum'] = `sha256 ${checksum}`;
+
+        let res = null;
+        let data = {};
+        try {
+            ({ res, data } = await fetchJson(`/api/uploads/${upload.id}`, {
+                method: 'PATCH', headers, body: chunk
+            }));
+        } catch (e) {
+            // Network error: retried below
+        }
+        if (res && res.ok) {
+            offset = data.offset;
+            failures = 0;
+            continue;
+        }
+        if (res && res.status === 404) {
+            localStorage.removeItem(storageKey);
+            throw new Error('Upload expired, please try again');
+        }
+        // Offset conflicts (409), rate limits (429) and damaged chunks (460)
+        // are retried like network errors
+        if (res && res.status < 500 && ![409, 429, 460].includes(res.status)) {
+            throw new Error(data.error || 'Unknown error');
+        }
+        if (++failures > UPLOAD_RETRY_LIMIT) {
+            throw new Error(data.error || 'Connection lost');
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (failures - 1)));
+        if (typeof data.offset === 'number') {
+            offset = data.offset;
+        } else {
+            const status = await fetchJson(`/api/uploads/${upload.id}`).catch(() => null);
+            if (status && status.res.ok) offset = status.data.offset;
+        }
+    }
+
+    onProgress(1);
+    const { res, data } = await fetchJson(`/api/uploads/${upload.id}/finish`, { method: 'POST' });
+    if (res.ok || res.status === 404 || res.status === 460) {
+        localStorage.removeItem(storageKey);
+    }
+    if (!res.ok) throw new Error(data.error || 'Unknown error');
+    return data;
+}
+
 // ============================================
 // Delete Confirmation
 // ============================================
 
 function initDeleteConfirmation() {
-    document.querySelectorAll('.delete-form').forEach(form => {
-        form.addEventListener('submit', (e) => {
-            if (!confirm('Are you sure you want to delete this note permanently?')) {
-                e.preventDefault();
-            }
-        });
+    document.addEventListener('submit', (e) => {
+        if (!e.target.closest('.delete-form')) return;
+        if (!confirm('Are you sure you want to delete this note permanently?')) {
+            e.preventDefault();
+        }
     });
 }
 
@@ -565,29 +1076,378 @@ function initAutoFocus() {
 }
 
 // ============================================
-// Live Search (Optional - for client-side filtering)
+// Live Search (typeahead over /api/search/suggest)
 // ============================================
 
 function initLiveSearch() {
     const searchInput = document.getElementById('search-input');
-    const noteCards = document.querySelectorAll('.note-card');
+    if (!searchInput) return;
+
+    const SUGGEST_DEBOUNCE_MS = 80;
+    const list = document.createElement('ul');
+    list.className = 'search-suggestions hidden';
+    searchInput.closest('.search-box').appendChild(list);
+
+    let timer = null;
+    let controller = null;
+    let active = -1;
+
+    // Hide cards that do not match (ids = null shows all)
+    const filterCards = (ids) => {
+        document.querySelectorAll('.note-card').forEach(card => {
+            const id = Number(card.querySelector('.edit-btn')?.dataset.noteId);
+            card.style.display = !ids || ids.has(id) ? '' : 'none';
+        });
+    };
+
+    const openResult = (noteId) => {
+        list.classList.add('hidden');
+        if (window.openViewModal) window.openViewModal(noteId);
+    };
+
+    const render = (results) => {
+        list.innerHTML = '';
+        active = -1;
+        results.forEach(result => {
+            const li = document.createElement('li');
+            li.textContent = result.title || 'Untitled Note';
+            li.dataset.noteId = result.id;
+            // mousedown fires before the input's blur hides the list
+            li.addEventListener('mousedown', (e) => {
+                e.preventDefault();
+                openResult(result.id);
+            });
+            list.appendChild(li);
+        });
+        list.classList.toggle('hidden', !results.length);
+    };
 
-    if (!searchInput || !noteCards.length) return;
+    const suggest = async () => {
+        const query = searchInput.value.trim();
+        if (controller) controller.abort();
+        if (!query) {
+            render([]);
+            filterCards(null);
+            return;
+        }
+        controller = new AbortController();
+        try {
+            const res = await fetch(`/api/search/suggest?q=${encodeURIComponent(query)}`, { signal: controller.signal });
+            if (!res.ok) return;
+            const data = await res.json();
+            render(data.results);
+            filterCards(new Set(data.ids));
+        } catch (e) {
+            if (e.name !== 'AbortError') console.error('Search suggest failed:', e);
+        }
+    };
 
-    searchInput.addEventListener('input', (e) => {
-        const query = e.target.value.toLowerCase();
+    searchInput.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(suggest, SUGGEST_DEBOUNCE_MS);
+    });
+
+    // Arrow keys move through suggestions; Enter opens one, or submits the full search
+    searchInput.addEventListener('keydown', (e) => {
+        const items = list.querySelectorAll('li');
+        if ((e.key === 'ArrowDown' || e.key === 'ArrowUp') && items.length) {
+            e.preventDefault();
+            active = (active + (e.key === 'ArrowDown' ? 1 : -1) + items.length) % items.length;
+            items.forEach((li, i) => li.classList.toggle('active', i === active));
+        } else if (e.key === 'Enter' && items[active]) {
+            e.preventDefault();
+            openResult(items[active].dataset.noteId);
+        }
+    });
+    searchInput.addEventListener('blur', () => list.classList.add('hidden'));
+    searchInput.addEventListener('focus', () => list.classList.toggle('hidden', !list.children.length));
+}
 
-        noteCards.forEach(card => {
-            const title = card.querySelector('.note-title')?.textContent.toLowerCase() || '';
-            const content = card.querySelector('.note-content')?.textContent.toLowerCase() || '';
+// ============================================
+// Live Updates (server-sent events, see events.py)
+// ============================================
 
-            if (title.includes(query) || content.includes(query)) {
-                card.style.display = '';
-            } else {
-                card.style.display = 'none';
+// Keeps the dashboard in step with changes made in other tabs and devices:
+// changed cards are fetched from /api/note/<id>/card and swapped in place.
+const LIVE_RETRY_MIN_MS = 5000;
+const LIVE_RETRY_MAX_MS = 300000;
+
+function initLiveUpdates() {
+    if (!window.EventSource || !document.getElementById('edit-modal')) return;
+
+    const params = new URLSearchParams(window.location.search);
+    const showArchived = params.get('archived') === '1';
+    // Search and category views cannot tell whether a new note belongs in them
+    const filtered = Boolean(params.get('q') || params.get('category'));
+    let reloadPending = false;
+
+    const findCard = (noteId) => document.querySelector(`.edit-btn[data-note-id="${noteId}"]`)?.closest('.note-card');
+
+    // Reload once nothing is being edited or viewed
+    const reloadWhenIdle = () => {
+        if (reloadPending) return;
+        reloadPending = true;
+        const tryReload = () => {
+            if (document.querySelector('.modal.active')) setTimeout(tryReload, 2000);
+            else window.location.reload();
+        };
+        tryReload();
+    };
+
+    const placeCard = (card, pinned) => {
+        const grid = document.querySelector('.notes-grid');
+        if (!grid) return reloadWhenIdle();
+        // Newest first, pinned notes above the rest
+        const anchor = pinned ? grid.firstElementChild : grid.querySelector('.note-card:not(.pinned)');
+        grid.insertBefore(card, anchor);
+    };
+
+    const refreshCard = async (noteId) => {
+        const existing = findCard(noteId);
+        try {
+            const res = await fetch(`/api/note/${noteId}/card`);
+            if (res.status === 404) {
+                existing?.remove();
+                return;
             }
+            if (!res.ok) return;
+            const data = await res.json();
+            if (data.is_archived !== showArchived || (filtered && !existing)) {
+                existing?.remove();
+                return;
+            }
+            const template = document.createElement('template');
+            template.innerHTML = data.html.trim();
+            const card = template.content.firstElementChild;
+            if (existing) {
+                card.style.display = existing.style.display;
+                existing.remove();
+            }
+            placeCard(card, data.is_pinned);
+        } catch (e) {
+            console.error('Live update failed:', e);
+        }
+    };
+
+    // EventSource reconnects by itself after a dropped connection, but gives
+    // up for good on any non-200 answer (503 when the server has no stream to
+    // spare, 502 during a restart); open a new one then, backing off.
+    let lastEventId = '';
+    let retryDelay = 0;
+    const connect = () => {
+        const url = lastEventId ? `/api/events?last_event_id=${encodeURIComponent(lastEventId)}` : '/api/events';
+        const source = new EventSource(url);
+        const handle = (handler) => (e) => {
+            if (e.lastEventId) lastEventId = e.lastEventId;
+            handler(e);
+        };
+        source.addEventListener('open', () => { retryDelay = 0; });
+        source.addEventListener('saved', handle((e) => {
+            refreshCard(JSON.parse(e.data).note_id);
+            schedulePull();
+        }));
+        source.addEventListener('deleted', handle((e) => {
+            findCard(JSON.parse(e.data).note_id)?.remove();
+            schedulePull();
+        }));
+        source.addEventListener('reload', handle(reloadWhenIdle));
+        source.addEventListener('error', () => {
+            if (source.readyState !== EventSource.CLOSED) return;
+            retryDelay = Math.min(retryDelay ? retryDelay * 2 : LIVE_RETRY_MIN_MS, LIVE_RETRY_MAX_MS);
+            // Jitter, so tabs refused together do not come back together
+            setTimeout(connect, retryDelay * (0.5 + Math.random() / 2));
         });
+    };
+    connect();
+}
+
+// ============================================
+// Offline Cache (IndexedDB + service worker, see sync.py)
+// ============================================
+
+// The dashboard keeps a copy of the user's notes in IndexedDB (NotesDB, in
+// notes-db.js) and brings it up to date through /api/sync on load, when the
+// browser comes back online and after live updates. Notes open from that
+// copy when the network is down, and autosave queues edits in its outbox.
+// sw.js serves the page and its assets when offline and uploads the outbox
+// in the background (Background Sync); elsewhere the page uploads it itself.
+const SYNC_PULL_DEBOUNCE_MS = 2000;
+const OUTBOX_TAG = 'notes-outbox';
+let offlineReady = null;    // resolves to true once the copy is this user's
+let pulling = null;
+let pullTimer = null;
+let flushing = null;
+
+function initOfflineCache() {
+    const userId = Number(document.body.dataset.userId);
+    if (!userId || typeof NotesDB === 'undefined' || !window.indexedDB || !document.getElementById('edit-modal')) return;
+
+    offlineReady = NotesDB.claim(userId).catch((e) => {
+        console.error('Offline cache unavailable:', e);
+        return false;
     });
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js')
+            .catch((e) => console.error('Service worker registration failed:', e));
+        navigator.serviceWorker.addEventListener('message', (e) => {
+            if (e.data?.type === 'outbox-synced') outboxSynced(e.data.results);
+        });
+    }
+
+    // Nothing of the user's stays in the browser after logging out
+    document.querySelectorAll('a[href$="/logout"]').forEach(link => link.addEventListener('click', async (e) => {
+        e.preventDefault();
+        try {
+            if ((await NotesDB.all('outbox')).length) {
+                await flushOutbox();
+                if ((await NotesDB.all('outbox')).length &&
+                    !confirm('Some edits made offline have not been uploaded yet. Log out anyway?')) return;
+            }
+            await NotesDB.clear();
+            if (window.caches) await caches.delete('pages');
+        } catch (error) {
+            console.error('Clearing the offline cache failed:', error);
+        }
+        window.location.href = link.href;
+    }));
+
+    const syncNow = async () => {
+        if (!(await offlineReady)) return;
+        if ((await NotesDB.all('outbox')).length) await flushOutbox();
+        pullNotes();
+    };
+    syncNow();
+    window.addEventListener('online', syncNow);
+    document.addEventListener('visibilitychange', () => {
+        if (!document.hidden) schedulePull();
+    });
+}
+
+// Bring the copy up to date: the changes since the stored cursor, or every
+// note again when there is no cursor or the server asks for a reset
+function pullNotes() {
+    if (pulling) return pulling;
+    pulling = (async () => {
+        if (!offlineReady || !(await offlineReady)) return;
+        const cursor = await NotesDB.getMeta('cursor');
+        if (cursor !== undefined) {
+            const res = await fetch(`/api/sync?since=${cursor}`);
+            if (!res.ok) return;
+            const data = await res.json();
+            if (!data.reset) return NotesDB.applyChanges(data.notes, data.deleted, data.cursor);
+        }
+        let after = 0;
+        let resetCursor;
+        do {
+            const res = await fetch(`/api/sync?after=${after}`);
+            if (!res.ok) return;
+            const data = await res.json();
+            if (!after) {
+                resetCursor = data.cursor;
+                await NotesDB.reset(data.categories);
+            }
+            await NotesDB.applyChanges(data.notes, [], data.next ? undefined : resetCursor);
+            after = data.next;
+        } while (after);
+    })()
+        .catch((e) => {
+            // Offline; the next pull catches up
+            if (!(e instanceof TypeError)) console.error('Offline cache sync failed:', e);
+        })
+        .finally(() => { pulling = null; });
+    return pulling;
+}
+
+function schedulePull() {
+    if (!offlineReady) return;
+    clearTimeout(pullTimer);
+    pullTimer = setTimeout(pullNotes, SYNC_PULL_DEBOUNCE_MS);
+}
+
+// Upload the outbox now, or leave it to the service worker's Background
+// Sync, which also retries after the page is gone
+async function requestOutboxSync() {
+    try {
+        const registration = navigator.serviceWorker?.controller ? await navigator.serviceWorker.ready : null;
+        if (registration?.sync) {
+            await registration.sync.register(OUTBOX_TAG);
+            return;
+        }
+    } catch (e) {
+        // Background Sync not allowed; upload from the page
+    }
+    if (navigator.onLine) flushOutbox();
+}
+
+function flushOutbox() {
+    if (!flushing) {
+        flushing = NotesDB.flush()
+            .then((results) => {
+                if (results.length) outboxSynced(results);
+            })
+            .catch((e) => {
+                if (!(e instanceof TypeError)) console.error('Uploading offline edits failed:', e);
+            })
+            .finally(() => { flushing = null; });
+    }
+    return flushing;
+}
+
+function outboxSynced(results) {
+    document.dispatchEvent(new CustomEvent('outbox-synced', { detail: results }));
+    schedulePull();
+}
+
+// GET /api/note/<id>, or the offline copy when the network is down. The
+// rendered HTML of notes fetched online is kept for reading them offline.
+async function fetchNote(noteId) {
+    let response;
+    try {
+        response = await fetch(`/api/note/${noteId}`);
+    } catch (error) {
+        const note = await loadOfflineNote(noteId);
+        if (note) return note;
+        throw error;
+    }
+    if (!response.ok) throw new Error('Note not found');
+    const note = await response.json();
+    if (offlineReady && await offlineReady) {
+        const { id, title, content, content_html, excerpt_html, category_id, version,
+            is_pinned, is_archived, is_public, created_at, updated_at } = note;
+        NotesDB.saveNote({
+            id, title, content, content_html, excerpt_html, category_id, version, created_at, updated_at,
+            is_pinned: Boolean(is_pinned), is_archived: Boolean(is_archived), is_public: Boolean(is_public), is_cold: false
+        }).catch((e) => console.error('Caching note failed:', e));
+    }
+    return note;
+}
+
+async function loadOfflineNote(noteId) {
+    if (!offlineReady || !(await offlineReady)) return null;
+    const id = Number(noteId);
+    const [note, edit, categories] = await Promise.all([
+        NotesDB.get('notes', id), NotesDB.get('outbox', id), NotesDB.all('categories')
+    ]);
+    // Cold notes' bodies are only fetched when opened online
+    if (!note || note.content === null) return null;
+    const current = edit ? { ...note, ...edit } : note;
+    const category = categories.find(c => c.id === current.category_id);
+    let html = note.content_html;
+    if (edit || !html) {
+        const escaped = document.createElement('div');
+        escaped.textContent = current.content;
+        html = `<p style="white-space: pre-wrap;">${escaped.innerHTML}</p>`;
+    }
+    return {
+        ...current,
+        content_html: html,
+        category_name: category?.name,
+        category_color: category?.color,
+        attachments: [],
+        offline: true,
+        pending: Boolean(edit)
+    };
 }
 
 // ============================================
@@ -744,14 +1604,10 @@ function initShareModal() {
         }
     };
 
-    // Card Button Listeners
-    const cardBtns = document.querySelectorAll('.share-btn');
-    cardBtns.forEach(btn => {
-        // Remove existing listener if any? No, init calls are once.
-        btn.addEventListener('click', (e) => {
-            e.stopPropagation(); // prevent opening preview
-            openShareModal(btn.dataset.noteId);
-        });
+    // Card Button Listeners (delegated; the card click handler ignores buttons)
+    document.addEventListener('click', (e) => {
+        const btn = e.target.closest('.share-btn');
+        if (btn) openShareModal(btn.dataset.noteId);
     });
 
     // Generate Link
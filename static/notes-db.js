@@ -0,0 +1,158 @@
+// ============================================
+// Offline copy of the user's notes (IndexedDB)
+// ============================================
+
+// Shared by the page (app.js) and the service worker (sw.js). Stores:
+//   notes       the user's notes as GET /api/sync sends them, plus the
+//               rendered HTML of notes opened online (content_html)
+//   categories  the user's categories
+//   outbox      edits made offline, one per note, until POST /api/sync
+//               has taken them
+//   meta        'user' (whose copy this is) and 'cursor' (sync position)
+const NotesDB = (() => {
+    const DB_NAME = 'notes-app';
+    const DB_VERSION = 1;
+    const STORES = ['notes', 'categories', 'outbox', 'meta'];
+    const UPLOAD_BATCH = 50;    // sync.SYNC_MAX_CHANGES
+    let opening = null;
+
+    const open = () => {
+        if (!opening) {
+            opening = new Promise((resolve, reject) => {
+                const request = indexedDB.open(DB_NAME, DB_VERSION);
+                request.onupgradeneeded = () => {
+                    const db = request.result;
+                    db.createObjectStore('notes', { keyPath: 'id' });
+                    db.createObjectStore('categories', { keyPath: 'id' });
+                    db.createObjectStore('outbox', { keyPath: 'id' });
+                    db.createObjectStore('meta');
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => {
+                    opening = null;
+                    reject(request.error);
+                };
+            });
+        }
+        return opening;
+    };
+
+    // Run fn(store) in one transaction. fn must only queue requests (no
+    // awaiting); resolves once the transaction commits, with fn's return
+    // value, or its result if that is a request.
+    const run = async (names, mode, fn) => {
+        const db = await open();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(names, mode);
+            const value = fn((name) => tx.objectStore(name));
+            tx.oncomplete = () => resolve(value instanceof IDBRequest ? value.result : value);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    };
+
+    const get = (name, key) => run([name], 'readonly', (store) => store(name).get(key));
+    const all = (name) => run([name], 'readonly', (store) => store(name).getAll());
+    const getMeta = (key) => get('meta', key);
+
+    // Put notes unless the stored copy is newer; a copy of the same version
+    // keeps what the new one lacks (rendered HTML, cold notes' bodies)
+    const putNote = (notes, note) => {
+        notes.get(note.id).onsuccess = (e) => {
+            const stored = e.target.result;
+            if (stored && stored.version > note.version) return;
+            if (stored && stored.version === note.version) {
+                const merged = { ...stored };
+                Object.entries(note).forEach(([key, value]) => {
+                    if (value !== null && value !== undefined) merged[key] = value;
+                });
+                notes.put(merged);
+            } else {
+                notes.put(note);
+            }
+        };
+    };
+
+    // Make the copy the given user's, emptying it if it was someone else's
+    const claim = (userId) => run(STORES, 'readwrite', (store) => {
+        store('meta').get('user').onsuccess = (e) => {
+            if (e.target.result === userId) return;
+            STORES.forEach((name) => store(name).clear());
+            store('meta').put(userId, 'user');
+        };
+        return true;
+    });
+
+    const clear = () => run(STORES, 'readwrite', (store) => {
+        STORES.forEach((name) => store(name).clear());
+    });
+
+    // Start over from the first page of a full download; the cursor is
+    // stored with the last page
+    const reset = (categories) => run(['notes', 'categories', 'meta'], 'readwrite', (store) => {
+        store('notes').clear();
+        store('categories').clear();
+        categories.forEach((category) => store('categories').put(category));
+        store('meta').delete('cursor');
+    });
+
+    const applyChanges = (notes, deleted, cursor) => run(['notes', 'meta'], 'readwrite', (store) => {
+        notes.forEach((note) => putNote(store('notes'), note));
+        deleted.forEach((id) => store('notes').delete(id));
+        if (cursor !== undefined) store('meta').put(cursor, 'cursor');
+    });
+
+    const saveNote = (note) => run(['notes'], 'readwrite', (store) => putNote(store('notes'), note));
+
+    // Queue an offline edit ({id, version, title, content, category_id}).
+    // Later edits of the same note replace it but keep the version the
+    // first one was based on.
+    const queueEdit = (edit) => run(['outbox'], 'readwrite', (store) => {
+        const outbox = store('outbox');
+        outbox.get(edit.id).onsuccess = (e) => {
+            const queued = e.target.result;
+            outbox.put({ ...edit, version: queued ? queued.version : edit.version, queuedAt: Date.now() });
+        };
+    });
+
+    // Upload queued edits; resolves to POST /api/sync's results. Results
+    // of edits changed again while uploading get `queued: true`: those stay
+    // in the outbox, rebased on the version just saved.
+    const flush = async () => {
+        const results = [];
+        const edits = await all('outbox');
+        for (let start = 0; start < edits.length; start += UPLOAD_BATCH) {
+            const batch = edits.slice(start, start + UPLOAD_BATCH);
+            const res = await fetch('/api/sync', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ changes: batch.map(({ queuedAt, ...change }) => change) })
+            });
+            if (!res.ok) throw new Error(`Sync upload failed (${res.status})`);
+            const data = await res.json();
+            await run(['outbox'], 'readwrite', (store) => {
+                const outbox = store('outbox');
+                data.results.forEach((result, i) => {
+                    const sent = batch[i];
+                    results.push(result);
+                    // Server errors are retried with the next flush
+                    if (result.status === 'error') return;
+                    outbox.get(sent.id).onsuccess = (e) => {
+                        const queued = e.target.result;
+                        if (!queued || queued.queuedAt === sent.queuedAt) {
+                            outbox.delete(sent.id);
+                        } else if (result.status === 'saved') {
+                            result.queued = true;
+                            outbox.put({ ...queued, version: result.version });
+                        } else {
+                            result.queued = true;
+                        }
+                    };
+                });
+            });
+        }
+        return results;
+    };
+
+    return { open, get, all, getMeta, claim, clear, reset, applyChanges, saveNote, queueEdit, flush };
+})();
@@ -0,0 +1,113 @@
+// ============================================
+// Service worker (served at /sw.js, see app.py)
+// ============================================
+
+// SHELL_ASSETS and SHELL_VERSION are prepended by the /sw.js route: the
+// current (fingerprinted) stylesheet, scripts and logo. A deploy changes
+// them, which makes the browser install the new worker.
+//   - fingerprinted static files never change and come from the cache
+//     first; other static files from the network, or the cache offline
+//   - the dashboard is loaded from the network and cached, and the cached
+//     copy is shown when the network fails or stalls (offline)
+//   - edits queued offline (NotesDB outbox) are uploaded by Background Sync,
+//     even after the tab is closed, where the browser supports it
+importScripts(SHELL_ASSETS.find((url) => url.includes('notes-db')));
+
+const SHELL_CACHE = `shell-${SHELL_VERSION}`;
+const PAGE_CACHE = 'pages';
+const STATIC_CACHE_LIMIT = 100;
+const NAVIGATION_TIMEOUT_MS = 4000;
+const OUTBOX_TAG = 'notes-outbox';
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then((cache) => cache.addAll(SHELL_ASSETS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((names) => Promise.all(names
+                .filter((name) => name.startsWith('shell-') && name !== SHELL_CACHE)
+                .map((name) => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+const cacheStatic = async (request, response) => {
+    if (!response.ok) return;
+    const cache = await caches.open(SHELL_CACHE);
+    const keys = await cache.keys();
+    if (keys.length >= STATIC_CACHE_LIMIT) await cache.delete(keys[0]);
+    await cache.put(request, response);
+};
+
+const cacheFirst = async (request) => {
+    const cached = await caches.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    await cacheStatic(request, response.clone());
+    return response;
+};
+
+const networkFirst = async (request) => {
+    try {
+        const response = await fetch(request);
+        await cacheStatic(request, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request);
+        if (cached) return cached;
+        throw error;
+    }
+};
+
+// The dashboard from the network; the last good copy when that fails or
+// takes longer than NAVIGATION_TIMEOUT_MS
+const dashboard = async (request) => {
+    const cache = await caches.open(PAGE_CACHE);
+    const network = fetch(request).then(async (response) => {
+        // Only the plain dashboard; not redirects (login), errors or filtered views
+        if (response.ok && !response.redirected && !new URL(request.url).search) {
+            await cache.put('/', response.clone());
+        }
+        return response;
+    });
+    network.catch(() => {});
+    const timeout = new Promise((resolve) => setTimeout(resolve, NAVIGATION_TIMEOUT_MS));
+    try {
+        const response = await Promise.race([network, timeout]);
+        if (response) return response;
+    } catch (error) {
+        // Offline: fall through to the cached page
+    }
+    const cached = await cache.match('/');
+    return cached || network;
+};
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/static/dist/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.pathname.startsWith('/static/') && !url.pathname.startsWith('/static/uploads/')) {
+        event.respondWith(networkFirst(request));
+    } else if (request.mode === 'navigate' && url.pathname === '/') {
+        event.respondWith(dashboard(request));
+    }
+});
+
+self.addEventListener('sync', (event) => {
+    if (event.tag !== OUTBOX_TAG) return;
+    event.waitUntil(NotesDB.flush().then(async (results) => {
+        const windows = await self.clients.matchAll({ type: 'window' });
+        windows.forEach((client) => client.postMessage({ type: 'outbox-synced', results }));
+        // A failed sync is retried by the browser later
+        if (results.some((result) => result.status === 'error')) throw new Error('Some edits were not saved');
+    }));
+});
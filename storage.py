@@ -0,0 +1,403 @@
+"""
+File storage for Note-Taking App
+One interface for wherever avatars and attachments live. Files are named
+by key, "<folder>/<name>" (what attachments.s3_key holds):
+
+    put(key, data, content_type)        store bytes
+    put_file(key, path, content_type)   store a finished local file (moved if possible)
+    get(key)                            the file's bytes
+    stream(key)                         StoredFile: chunk iterator, content type, size
+    delete(key) / exists(key)
+    url(key)                            where the browser loads it from
+    presign(key)                        time-limited direct URL, None if the backend has none
+
+Backends:
+    LocalStorage   static/uploads/ on this host (served by nginx)
+    S3Storage      S3_BUCKET; files are proxied through /s3/<key> or, with
+                   STORAGE_PRESIGN=true, redirected to presigned URLs
+    MemoryStorage  a dict, optionally with simulated per-call latency: a
+                   stand-in for S3 in benchmarks and single-process
+                   development servers (each process has its own)
+
+STORAGE_BACKEND (local, s3, memory) picks one; by default S3 when S3_BUCKET
+is set and boto3 is installed, else local. Missing files raise NotFound,
+other failures StorageError.
+
+Storage calls spend their time waiting on disk or network, so bulk work
+(put_many, delete_many) runs on a per-process pool of STORAGE_IO_THREADS
+threads. S3 deletes go out up to 1000 keys per DeleteObjects request.
+"""
+import os
+import time
+import shutil
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_FOLDER = os.path.join(APP_DIR, 'static', 'uploads')
+
+S3_BUCKET = os.getenv('S3_BUCKET') or os.getenv('S3_BUCKET_NAME', '')
+S3_REGION = os.getenv('S3_REGION', os.getenv('AWS_REGION', 'us-east-1'))
+# boto3 is only imported when the first S3 request needs a client
+S3_ENABLED = bool(S3_BUCKET) and importlib.util.find_spec('boto3') is not None
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', '') or ('s3' if S3_ENABLED else 'local')
+STORAGE_IO_THREADS = int(os.getenv('STORAGE_IO_THREADS', 8))
+STORAGE_PRESIGN = os.getenv('STORAGE_PRESIGN', 'false').lower() == 'true'
+STORAGE_PRESIGN_SECONDS = int(os.getenv('STORAGE_PRESIGN_SECONDS', 300))
+STREAM_CHUNK_BYTES = 256 * 1024
+S3_DELETE_BATCH = 1000
+
+
+class StorageError(Exception):
+    """A storage backend failed."""
+
+
+class NotFound(StorageError):
+    """No file is stored under the key."""
+
+
+class StoredFile:
+    """A file being read: iterate chunks, plus its content type and size."""
+
+    def __init__(self, chunks, content_type, size):
+        self.chunks = chunks
+        self.content_type = content_type or 'application/octet-stream'
+        self.size = size
+
+
+# =============================================================================
+# THREAD POOL
+# =============================================================================
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=STORAGE_IO_THREADS, thread_name_prefix='storage-io')
+    return _executor
+
+
+def run_many(fn, items):
+    """fn(item) for every item on the pool; returns [(item, exception)] for
+    the ones that raised."""
+    items = list(items)
+    if len(items) <= 1 or STORAGE_IO_THREADS <= 1:
+        futures = None
+    else:
+        futures = [get_executor().submit(fn, item) for item in items]
+    failed = []
+    for i, item in enumerate(items):
+        try:
+            if futures is None:
+                fn(item)
+            else:
+                futures[i].result()
+        except Exception as e:
+            failed.append((item, e))
+    return failed
+
+
+# =============================================================================
+# BACKENDS
+# =============================================================================
+class Storage:
+    """Base class; backends implement put, get, stream, delete, exists and url."""
+
+    name = None
+
+    def put_file(self, key, path, content_type=None):
+        with open(path, 'rb') as f:
+            self.put(key, f.read(), content_type)
+        os.remove(path)
+
+    def presign(self, key, expires=STORAGE_PRESIGN_SECONDS):
+        return None
+
+    def put_many(self, files):
+        """Store [(key, data, content_type)] concurrently; returns [(key, exception)]
+        for the ones that failed."""
+        failed = run_many(lambda f: self.put(*f), files)
+        return [(f[0], e) for f, e in failed]
+
+    def delete_many(self, keys):
+        """Delete keys concurrently (missing ones count as deleted); returns the
+        keys that could not be deleted."""
+        return [key for key, _ in run_many(self.delete, keys)]
+
+
+class LocalStorage(Storage):
+    name = 'local'
+
+    def __init__(self, root=UPLOAD_FOLDER, url_prefix='/static/uploads/'):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise NotFound(key)
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError as e:
+            raise StorageError(f'Writing {key} failed: {e}') from e
+
+    def put_file(self, key, path, content_type=None):
+        target = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # A rename when both are on one filesystem
+            shutil.move(path, target)
+        except OSError as e:
+            raise StorageError(f'Storing {key} failed: {e}') from e
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise NotFound(key)
+        except OSError as e:
+            raise StorageError(f'Reading {key} failed: {e}') from e
+
+    def stream(self, key):
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            raise NotFound(key)
+        except OSError as e:
+            raise StorageError(f'Reading {key} failed: {e}') from e
+
+        def chunks():
+            with f:
+                yield from iter(lambda: f.read(STREAM_CHUNK_BYTES), b'')
+        return StoredFile(chunks(), None, os.fstat(f.fileno()).st_size)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise StorageError(f'Deleting {key} failed: {e}') from e
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def url(self, key):
+        return self.url_prefix + key
+
+
+class ProxiedStorage(Storage):
+    """Backends the browser cannot reach directly; files go through /s3/<key>
+    (app.get_s3_file; the path predates backends other than S3)."""
+
+    def url(self, key):
+        return f'/s3/{key}'
+
+
+class S3Storage(ProxiedStorage):
+    name = 's3'
+
+    def __init__(self, bucket=S3_BUCKET, region=S3_REGION):
+        self.bucket = bucket
+        self.region = region
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The boto3 client, created on first use (None if it cannot be)."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    try:
+                        import boto3
+                        self._client = boto3.client('s3', region_name=self.region)
+                        print(f"\u2705 S3 enabled: bucket={self.bucket}")
+                    except Exception as e:
+                        print(f"\u26a0\ufe0f S3 init failed: {e}")
+                        return None
+        return self._client
+
+    def reset(self):
+        """Forget the client; boto3 connection pools must not be shared across fork."""
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _call(self, method, key, **params):
+        client = self.client
+        if client is None:
+            raise StorageError('S3 unavailable')
+        try:
+            return getattr(client, method)(Bucket=self.bucket, Key=key, **params)
+        except client.exceptions.NoSuchKey:
+            raise NotFound(key)
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise NotFound(key)
+            raise StorageError(f'S3 {method} {key} failed: {e}') from e
+
+    def put(self, key, data, content_type=None):
+        self._call('put_object', key, Body=data, ContentType=content_type or 'application/octet-stream')
+
+    def put_file(self, key, path, content_type=None):
+        with open(path, 'rb') as f:
+            self._call('put_object', key, Body=f, ContentType=content_type or 'application/octet-stream')
+        os.remove(path)
+
+    def get(self, key):
+        return self._call('get_object', key)['Body'].read()
+
+    def stream(self, key):
+        obj = self._call('get_object', key)
+        return StoredFile(obj['Body'].iter_chunks(STREAM_CHUNK_BYTES), obj.get('ContentType'), obj['ContentLength'])
+
+    def delete(self, key):
+        self._call('delete_object', key)
+
+    def exists(self, key):
+        try:
+            self._call('head_object', key)
+            return True
+        except NotFound:
+            return False
+
+    def presign(self, key, expires=STORAGE_PRESIGN_SECONDS):
+        client = self.client
+        if client is None:
+            return None
+        return client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires
+        )
+
+    def delete_many(self, keys):
+        """DeleteObjects in batches of 1000, the batches on the pool."""
+        keys = list(keys)
+        batches = [keys[i:i + S3_DELETE_BATCH] for i in range(0, len(keys), S3_DELETE_BATCH)]
+        errors = []
+
+        def delete_batch(batch):
+            client = self.client
+            if client is None:
+                raise StorageError('S3 unavailable')
+            response = client.delete_objects(
+                Bucket=self.bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            errors.extend(error['Key'] for error in response.get('Errors', []))
+
+        for batch, e in run_many(delete_batch, batches):
+            print(f"S3 bulk delete failed ({len(batch)} keys): {e}")
+            errors.extend(batch)
+        return errors
+
+
+class MemoryStorage(ProxiedStorage):
+    """Files in a dict. latency (seconds) is slept on every call, to stand in
+    for a remote store."""
+
+    name = 'memory'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, key, data, content_type=None):
+        self._wait()
+        with self._lock:
+            self._files[key] = (bytes(data), content_type)
+
+    def get(self, key):
+        self._wait()
+        with self._lock:
+            if key not in self._files:
+                raise NotFound(key)
+            return self._files[key][0]
+
+    def stream(self, key):
+        self._wait()
+        with self._lock:
+            if key not in self._files:
+                raise NotFound(key)
+            data, content_type = self._files[key]
+        chunks = (data[i:i + STREAM_CHUNK_BYTES] for i in range(0, len(data), STREAM_CHUNK_BYTES))
+        return StoredFile(chunks, content_type, len(data))
+
+    def delete(self, key):
+        self._wait()
+        with self._lock:
+            self._files.pop(key, None)
+
+    def exists(self, key):
+        self._wait()
+        with self._lock:
+            return key in self._files
+
+
+# =============================================================================
+# CONFIGURED BACKEND
+# =============================================================================
+BACKENDS = {'local': LocalStorage, 's3': S3Storage, 'memory': MemoryStorage}
+_storage = None
+_local = None
+
+
+def get_storage():
+    """The backend STORAGE_BACKEND names."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in BACKENDS:
+            raise ValueError(f'Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (use {", ".join(BACKENDS)})')
+        _storage = BACKENDS[STORAGE_BACKEND]()
+    return _storage
+
+
+def local_storage():
+    """Local files, also the fallback when the configured backend fails."""
+    global _local
+    storage = get_storage()
+    if isinstance(storage, LocalStorage):
+        return storage
+    if _local is None:
+        _local = LocalStorage()
+    return _local
+
+
+def s3_client():
+    """The raw S3 client for multipart uploads, None unless storage is S3."""
+    storage = get_storage()
+    return storage.client if isinstance(storage, S3Storage) else None
+
+
+def key_from_url(url):
+    """Map a URL from Storage.url back to its key."""
+    for prefix in ('/static/uploads/', '/s3/'):
+        if url and url.startswith(prefix):
+            return url[len(prefix):]
+    return None
+
+
+def reset_after_fork():
+    """Each gunicorn worker builds its own S3 client and thread pool."""
+    global _executor, _executor_lock
+    if isinstance(_storage, S3Storage):
+        _storage.reset()
+    _executor = None
+    _executor_lock = threading.Lock()
@@ -0,0 +1,227 @@
+"""
+Offline sync for Note-Taking App
+The dashboard keeps a copy of the user's notes and categories in IndexedDB
+(static/notes-db.js), so notes open without a round trip and can still be
+read and edited offline. GET /api/sync brings that copy up to date and
+POST /api/sync uploads the edits made while offline.
+
+The copy is versioned by note_events (events.py). Every answer carries a
+cursor, an event id; a client that has one asks for the changes after it
+and gets the changed notes plus the ids of deleted ones. Without a cursor,
+or when the events it needs were pruned or include a RELOAD (categories,
+imports), the client is told to reset: it downloads every note in pages of
+SYNC_PAGE_SIZE, keyed on note id. The cursor is read before the first page,
+so changes made while paging arrive with the next delta. Events younger
+than EVENTS_SETTLE_SECONDS may still be joined by ones with lower ids, so
+the cursor stops short of them and they are sent again next time.
+
+Offline edits carry the version they were based on, like autosave's PATCH.
+One that still matches is saved. One whose note was changed or deleted in
+the meantime is saved as a new note, "<title> (offline copy)", so neither
+side loses text. A retried upload matches what is already stored and is
+not saved twice.
+
+Cold (long-archived) notes are sent without their body; the client loads
+it from /api/note/<id> when the note is opened.
+"""
+import os
+
+import search_index
+import related
+from auth import resolve_category_id
+from events import SAVED, DELETED, RELOAD, EVENTS_ENABLED, EVENTS_SETTLE_SECONDS, EVENTS_REPLAY_LIMIT, record_event
+from note_archive import warm_note
+from note_store import encode_content, decode_note, decode_notes
+from rendering import make_excerpt
+from revisions import record_revision
+
+# Deltas come from note_events, so sync needs them
+SYNC_ENABLED = os.getenv('SYNC_ENABLED', 'true').lower() == 'true' and EVENTS_ENABLED
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 200))
+SYNC_MAX_CHANGES = 50
+COPY_SUFFIX = ' (offline copy)'
+
+NOTE_QUERY = '''
+    SELECT n.id, n.title, n.content, n.content_z, n.category_id, n.version, n.is_pinned,
+           n.is_archived, n.is_public, n.is_cold, n.created_at, n.updated_at,
+           COALESCE(n.excerpt_html, a.excerpt_html) AS excerpt_html
+    FROM notes n
+    LEFT JOIN note_archive a ON a.note_id = n.id
+'''
+
+
+def _serialize(note):
+    note.pop('content_z', None)
+    for flag in ('is_pinned', 'is_archived', 'is_public', 'is_cold'):
+        note[flag] = bool(note[flag])
+    if note['is_cold']:
+        note['content'] = None
+    return note
+
+
+def _settled_cursor(cursor):
+    """The newest settled event id of any user, so an idle user's cursor
+    keeps up with pruning."""
+    cursor.execute(
+        '''SELECT id FROM note_events WHERE created_at < NOW() - INTERVAL %s SECOND
+           ORDER BY created_at DESC LIMIT 1''',
+        (EVENTS_SETTLE_SECONDS,)
+    )
+    row = cursor.fetchone()
+    return row['id'] if row else 0
+
+
+def load_page(connection, user_id, after_id=0):
+    """One page of all the user's notes, by id; the first page also has the
+    categories and the cursor to continue from once every page is stored."""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        result = {}
+        if not after_id:
+            result['cursor'] = _settled_cursor(cursor)
+            cursor.execute('SELECT id, name, color FROM categories WHERE user_id = %s ORDER BY name', (user_id,))
+            result['categories'] = cursor.fetchall()
+        cursor.execute(
+            NOTE_QUERY + 'WHERE n.user_id = %s AND n.id > %s ORDER BY n.id LIMIT %s',
+            (user_id, after_id, SYNC_PAGE_SIZE)
+        )
+        notes = [_serialize(note) for note in decode_notes(cursor.fetchall())]
+        result['notes'] = notes
+        result['next'] = notes[-1]['id'] if len(notes) == SYNC_PAGE_SIZE else None
+        return result
+    finally:
+        cursor.close()
+
+
+def load_changes(connection, user_id, since):
+    """Notes saved and deleted after the cursor since; None when the client
+    has to reset (events pruned, too many of them, or a RELOAD among them)."""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute('SELECT COALESCE(MIN(id), 0) AS id FROM note_events')
+        if cursor.fetchone()['id'] > since + 1:
+            return None
+        cursor.execute(
+            '''SELECT id, note_id, kind, created_at < NOW() - INTERVAL %s SECOND AS settled
+               FROM note_events WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s''',
+            (EVENTS_SETTLE_SECONDS, user_id, since, EVENTS_REPLAY_LIMIT + 1)
+        )
+        events = cursor.fetchall()
+        if len(events) > EVENTS_REPLAY_LIMIT or any(event['kind'] == RELOAD for event in events):
+            return None
+
+        next_cursor, settled = since, True
+        saved, deleted = set(), set()
+        for event in events:
+            settled = settled and bool(event['settled'])
+            if settled:
+                next_cursor = event['id']
+            if event['kind'] == DELETED:
+                deleted.add(event['note_id'])
+            elif event['kind'] == SAVED:
+                saved.add(event['note_id'])
+        saved -= deleted
+        if settled:
+            next_cursor = max(next_cursor, _settled_cursor(cursor))
+
+        notes = []
+        if saved:
+            placeholders = ', '.join(['%s'] * len(saved))
+            cursor.execute(
+                NOTE_QUERY + f'WHERE n.user_id = %s AND n.id IN ({placeholders})',
+                [user_id, *saved]
+            )
+            notes = [_serialize(note) for note in decode_notes(cursor.fetchall())]
+            # Saved, then deleted by an event past this page
+            deleted |= saved - {note['id'] for note in notes}
+        connection.commit()
+        return {'cursor': next_cursor, 'notes': notes, 'deleted': sorted(deleted)}
+    finally:
+        cursor.close()
+
+
+# =============================================================================
+# OFFLINE EDITS
+# =============================================================================
+def _save_copy(cursor, user_id, title, content, category_id):
+    """Save text that could not be applied as a new note.
+
+    Returns (note id, title, whether it was created).
+    """
+    title = f'{title or "Untitled"}'[:255 - len(COPY_SUFFIX)] + COPY_SUFFIX
+    # A retried upload already made this copy
+    cursor.execute(
+        '''SELECT id, content, content_z FROM notes
+           WHERE user_id = %s AND title = %s ORDER BY id DESC LIMIT 1''',
+        (user_id, title)
+    )
+    existing = cursor.fetchone()
+    if existing and decode_note(existing)['content'] == content:
+        return existing['id'], title, False
+    cursor.execute(
+        '''INSERT INTO notes (user_id, title, content, content_z, content_size, excerpt_html, summary,
+                              category_id)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+        (user_id, title, *encode_content(content), *make_excerpt(content), category_id)
+    )
+    note_id = cursor.lastrowid
+    record_event(cursor, user_id, SAVED, note_id)
+    return note_id, title, True
+
+
+def apply_change(connection, user_id, change):
+    """Apply one offline edit {id, version, title, content, category_id} and
+    commit it. Returns the client's result entry."""
+    note_id, base_version = change.get('id'), change.get('version')
+    if not isinstance(note_id, int) or not isinstance(base_version, int):
+        return {'id': note_id, 'status': 'rejected', 'error': 'id and version are required'}
+    title = str(change.get('title') or '').strip()[:255]
+    content = str(change.get('content') or '').strip()
+    if not content:
+        return {'id': note_id, 'status': 'rejected', 'error': 'Note content cannot be empty'}
+
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            category_id = resolve_category_id(cursor, user_id, change.get('category_id') or None)
+            category_id = int(category_id) if category_id is not None else None
+        except (TypeError, ValueError):
+            category_id = None
+        warm_note(connection, note_id, user_id)
+        cursor.execute(
+            '''SELECT title, content, content_z, category_id, version FROM notes
+               WHERE id = %s AND user_id = %s FOR UPDATE''',
+            (note_id, user_id)
+        )
+        note = cursor.fetchone()
+        if note:
+            decode_note(note)
+            if (title, content, category_id) == (note['title'], note['content'], note['category_id']):
+                connection.rollback()
+                return {'id': note_id, 'status': 'saved', 'version': note['version']}
+
+        if not note or note['version'] != base_version:
+            copy_id, copy_title, created = _save_copy(cursor, user_id, title, content, category_id)
+            connection.commit()
+            if created:
+                search_index.note_saved(user_id, copy_id, copy_title, content)
+                related.note_saved(user_id, copy_id, copy_title, content)
+            return {'id': note_id, 'status': 'conflict', 'copy_id': copy_id}
+
+        record_revision(connection, note_id, user_id, title, content)
+        cursor.execute(
+            '''UPDATE notes SET title = %s, content = %s, content_z = %s, content_size = %s,
+               excerpt_html = %s, summary = %s, category_id = %s, version = version + 1,
+               updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s''',
+            (title, *encode_content(content), *make_excerpt(content), category_id, note_id, user_id)
+        )
+        record_event(cursor, user_id, SAVED, note_id)
+        connection.commit()
+        search_index.note_saved(user_id, note_id, title, content)
+        related.note_saved(user_id, note_id, title, content)
+        return {'id': note_id, 'status': 'saved', 'version': base_version + 1}
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
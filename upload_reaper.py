@@ -0,0 +1,51 @@
+"""
+Upload reaper for Note-Taking App
+Removes resumable uploads (uploads.py) that have not received a chunk for
+UPLOAD_EXPIRE_HOURS, together with their partial files or S3 multipart
+parts, and partial data left behind when a note was deleted mid-upload.
+
+Run via cron (see scripts/08_setup_reaper.sh):
+    python upload_reaper.py --expire-hours 24
+"""
+import sys
+import time
+import argparse
+
+from app import get_s3_client
+from db import shards
+from uploads import UPLOAD_EXPIRE_HOURS, purge_expired, purge_orphans, active_multipart_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete expired partial uploads.')
+    parser.add_argument('--expire-hours', type=int, default=UPLOAD_EXPIRE_HOURS,
+                        help='delete uploads idle for this many hours')
+    args = parser.parse_args()
+
+    started = time.time()
+    s3_client = get_s3_client()
+    expired = 0
+    active = set()
+    failed = False
+    for shard in shards:
+        connection = shard.connect()
+        if not connection:
+            print(f'Error: database connection failed (shard {shard.shard_id}).')
+            failed = True
+            continue
+        try:
+            expired += purge_expired(connection, s3_client, args.expire_hours)
+            active |= active_multipart_ids(connection)
+        finally:
+            connection.close()
+
+    # Without every shard's list an in-progress S3 upload could look orphaned
+    orphans = 0 if failed else purge_orphans(s3_client, active, args.expire_hours)
+
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] upload reaper: expired={expired} "
+          f"orphans={orphans} elapsed={time.time() - started:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""
+Resumable attachment uploads for Note-Taking App
+A tus-style protocol for files too large, or connections too flaky, for a
+single POST to /api/note/<id>/attach:
+
+    POST   /api/note/<id>/uploads     {filename, size, type, sha256?} -> {id, offset, chunk_size}
+    PATCH  /api/uploads/<id>          one chunk: Upload-Offset header, raw body
+    GET    /api/uploads/<id>          current offset, to resume after a failure
+    POST   /api/uploads/<id>/finish   attach the completed file to the note
+    DELETE /api/uploads/<id>          abandon the upload
+
+Chunks are streamed from the request straight into the partial file (local
+storage), or through a chunk-sized temporary file into one S3 multipart part,
+so no worker holds a whole file in memory. A chunk only moves the offset
+once all of it has arrived and its Upload-Checksum ("sha256 <base64>")
+matched; a retried chunk overwrites whatever the failed attempt left. For
+local storage, one request at a time checks, writes and records a chunk
+(chunk_lock): a retry sent while the first attempt is still streaming gets
+409 instead of writing the same bytes over it.
+
+Partial uploads untouched for UPLOAD_EXPIRE_HOURS are removed by
+upload_reaper.py.
+"""
+import os
+import json
+import uuid
+import time
+import base64
+import hashlib
+import tempfile
+import contextlib
+
+import storage
+from storage import S3_BUCKET
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) concurrent chunks are only caught by record_chunk
+    fcntl = None
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Partial files stay out of static/ so they are never served or backed up
+UPLOAD_PARTS_DIR = os.getenv('UPLOAD_PARTS_DIR') or os.path.join(APP_DIR, 'upload_parts')
+
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 2 * 1024 ** 3))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', 8 * 1024 * 1024))
+UPLOAD_EXPIRE_HOURS = int(os.getenv('UPLOAD_EXPIRE_HOURS', 24))
+# S3 multipart parts must be at least 5MB (except the last)
+S3_MIN_PART_BYTES = 5 * 1024 * 1024
+READ_BLOCK_BYTES = 256 * 1024
+
+
+class ChecksumError(ValueError):
+    """Received data does not match the checksum the client sent."""
+
+
+class IncompleteChunk(ValueError):
+    """The request body ended before Content-Length bytes arrived."""
+
+
+class ChunkInProgress(ValueError):
+    """Another request is storing a chunk of the same upload."""
+
+
+def chunk_size(multipart):
+    return max(UPLOAD_CHUNK_BYTES, S3_MIN_PART_BYTES) if multipart else UPLOAD_CHUNK_BYTES
+
+
+def part_path(upload_id):
+    return os.path.join(UPLOAD_PARTS_DIR, f'{upload_id}.part')
+
+
+def parse_checksum(header):
+    """Digest bytes from an Upload-Checksum header, None if absent."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise ValueError('Only sha256 checksums are supported')
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError('Malformed Upload-Checksum')
+    if len(digest) != hashlib.sha256().digest_size:
+        raise ValueError('Malformed Upload-Checksum')
+    return digest
+
+
+def describe(upload):
+    """JSON view of an upload row."""
+    return {
+        'id': upload['id'],
+        'offset': upload['received'],
+        'size': upload['total_size'],
+        'chunk_size': chunk_size(upload['multipart_id'] is not None),
+        'filename': upload['filename'],
+    }
+
+
+# =============================================================================
+# CREATE / LOOKUP
+# =============================================================================
+def create_upload(cursor, s3, user_id, note_id, filename, content_type, size, sha256=None):
+    """Start an upload and insert its row (caller commits). Returns the row."""
+    upload_id = uuid.uuid4().hex
+    key = f'attachments/{uuid.uuid4().hex}_{filename}'
+    multipart_id = None
+    if s3:
+        multipart_id = s3.create_multipart_upload(
+            Bucket=S3_BUCKET, Key=key, ContentType=content_type, ChecksumAlgorithm='SHA256'
+        )['UploadId']
+    else:
+        os.makedirs(UPLOAD_PARTS_DIR, exist_ok=True)
+        open(part_path(upload_id), 'wb').close()
+
+    cursor.execute(
+        '''INSERT INTO uploads (id, user_id, note_id, filename, file_type, s3_key, total_size,
+                                checksum, multipart_id)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+        (upload_id, user_id, note_id, filename, content_type, key, size, sha256, multipart_id)
+    )
+    return get_upload(cursor, upload_id, user_id)
+
+
+def get_upload(cursor, upload_id, user_id, for_update=False):
+    cursor.execute(
+        f'''SELECT id, note_id, filename, file_type, s3_key, total_size, received, checksum,
+                   multipart_id, parts
+            FROM uploads WHERE id = %s AND user_id = %s{' FOR UPDATE' if for_update else ''}''',
+        (upload_id, user_id)
+    )
+    return cursor.fetchone()
+
+
+# =============================================================================
+# CHUNKS
+# =============================================================================
+def _copy(stream, out, length):
+    """Copy exactly length bytes from stream to out; returns their sha256."""
+    digest = hashlib.sha256()
+    remaining = length
+    while remaining:
+        block = stream.read(min(READ_BLOCK_BYTES, remaining))
+        if not block:
+            raise IncompleteChunk('Connection closed before the chunk was complete')
+        out.write(block)
+        digest.update(block)
+        remaining -= len(block)
+    return digest.digest()
+
+
+@contextlib.contextmanager
+def chunk_lock(upload):
+    """Hold an exclusive lock on a local upload's part file; raises
+    ChunkInProgress if another request has it.
+
+    Hold it from re-reading the offset until record_chunk has committed:
+    whoever takes it next then writes at the recorded offset, so the part
+    file is never overwritten or truncated below it.
+    """
+    if upload['multipart_id'] is not None or fcntl is None:
+        yield
+        return
+    with open(part_path(upload['id']), 'rb') as f:
+        try:
+            # flock, not lockf: receive_chunk closing its own handle must not release it
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ChunkInProgress('Another request is storing a chunk of this upload')
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def receive_chunk(upload, s3, stream, length, checksum=None):
+    """Store length bytes from stream at the upload's current offset.
+
+    Returns the S3 part entry for multipart uploads, None for local ones.
+    Raises ChecksumError or IncompleteChunk without advancing anything.
+    """
+    if upload['multipart_id'] is None:
+        with open(part_path(upload['id']), 'r+b') as out:
+            out.seek(upload['received'])
+            digest = _copy(stream, out, length)
+            if checksum is not None and digest != checksum:
+                raise ChecksumError('Chunk checksum mismatch')
+            # Anything past the new offset is left over from a failed attempt
+            out.truncate()
+        return None
+
+    os.makedirs(UPLOAD_PARTS_DIR, exist_ok=True)
+    with tempfile.TemporaryFile(dir=UPLOAD_PARTS_DIR) as buffer:
+        digest = _copy(stream, buffer, length)
+        if checksum is not None and digest != checksum:
+            raise ChecksumError('Chunk checksum mismatch')
+        buffer.seek(0)
+        encoded = base64.b64encode(digest).decode()
+        number = upload['received'] // chunk_size(True) + 1
+        # S3 checks the part against ChecksumSHA256 as well
+        response = s3.upload_part(
+            Bucket=S3_BUCKET, Key=upload['s3_key'], UploadId=upload['multipart_id'],
+            PartNumber=number, Body=buffer, ContentLength=length,
+            ChecksumAlgorithm='SHA256', ChecksumSHA256=encoded
+        )
+    return {'PartNumber': number, 'ETag': response['ETag'], 'ChecksumSHA256': encoded}
+
+
+def record_chunk(cursor, upload, length, part=None):
+    """Advance the offset if no other request got there first (caller commits)."""
+    parts = json.loads(upload['parts'] or '[]')
+    if part:
+        parts = [p for p in parts if p['PartNumber'] != part['PartNumber']] + [part]
+    cursor.execute(
+        '''UPDATE uploads SET received = received + %s, parts = %s
+           WHERE id = %s AND received = %s''',
+        (length, json.dumps(parts), upload['id'], upload['received'])
+    )
+    return cursor.rowcount == 1
+
+
+# =============================================================================
+# FINISH / DISCARD
+# =============================================================================
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish_upload(upload, s3):
+    """Move the completed file to its final storage key (storage.py).
+
+    Raises ChecksumError if the whole-file sha256 given at creation does not
+    match (checked for local storage; S3 has verified every part).
+    """
+    if upload['multipart_id'] is None:
+        path = part_path(upload['id'])
+        if upload['checksum'] and _file_sha256(path) != upload['checksum'].lower():
+            raise ChecksumError('File checksum mismatch')
+        storage.get_storage().put_file(upload['s3_key'], path, upload['file_type'])
+        return
+
+    parts = sorted(json.loads(upload['parts'] or '[]'), key=lambda p: p['PartNumber'])
+    s3.complete_multipart_upload(
+        Bucket=S3_BUCKET, Key=upload['s3_key'], UploadId=upload['multipart_id'],
+        MultipartUpload={'Parts': parts}
+    )
+
+
+def discard_upload(upload, s3):
+    """Remove an upload's partial data (storage errors are logged, not raised)."""
+    if upload['multipart_id'] is None:
+        try:
+            os.remove(part_path(upload['id']))
+        except FileNotFoundError:
+            pass
+        return
+    if not s3:
+        print(f"Cannot abort S3 upload {upload['id']}: S3 unavailable")
+        return
+    try:
+        s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=upload['s3_key'], UploadId=upload['multipart_id'])
+    except Exception as e:
+        print(f"S3 abort failed for {upload['s3_key']}: {e}")
+
+
+def purge_expired(connection, s3, expire_hours=UPLOAD_EXPIRE_HOURS, batch_size=200):
+    """Delete uploads untouched for expire_hours with their partial data.
+
+    Returns the number of uploads removed.
+    """
+    cursor = connection.cursor(dictionary=True)
+    removed = 0
+    try:
+        while True:
+            cursor.execute(
+                '''SELECT id, s3_key, multipart_id FROM uploads
+                   WHERE updated_at < NOW() - INTERVAL %s HOUR LIMIT %s''',
+                (expire_hours, batch_size)
+            )
+            expired = cursor.fetchall()
+            if not expired:
+                break
+            for upload in expired:
+                cursor.execute('DELETE FROM uploads WHERE id = %s', (upload['id'],))
+                connection.commit()
+                discard_upload(upload, s3)
+            removed += len(expired)
+    finally:
+        cursor.close()
+    return removed
+
+
+def active_multipart_ids(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT multipart_id FROM uploads WHERE multipart_id IS NOT NULL')
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def purge_orphans(s3, active_ids, expire_hours=UPLOAD_EXPIRE_HOURS):
+    """Remove partial data with no uploads row (e.g. its note was deleted).
+
+    active_ids are the multipart ids still referenced on any shard. Returns
+    the number of partial files and S3 multipart uploads removed.
+    """
+    removed = 0
+    cutoff = time.time() - expire_hours * 3600
+    # Every chunk touches the file, so an old one belongs to an expired upload
+    if os.path.isdir(UPLOAD_PARTS_DIR):
+        for name in os.listdir(UPLOAD_PARTS_DIR):
+            path = os.path.join(UPLOAD_PARTS_DIR, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    if s3:
+        paginator = s3.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=S3_BUCKET, Prefix='attachments/'):
+            for pending in page.get('Uploads', []):
+                if pending['UploadId'] in active_ids or pending['Initiated'].timestamp() >= cutoff:
+                    continue
+                s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=pending['Key'], UploadId=pending['UploadId'])
+                removed += 1
+    return removed